@@ -0,0 +1,82 @@
+"""
+Deterministic synthetic contacts for the benchmarks.
+
+The same count and seed always give the same rows, so runs on different machines or commits measure the
+same data. A seeded SQLite file is kept and reused while it still holds exactly that dataset.
+"""
+import random
+from datetime import date, timedelta
+from typing import Iterator
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fast_api_app.database.models import Base, User, UserAuth, birthday_key
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+FIRST_NAMES = ('Olena', 'Taras', 'Iryna', 'Andrii', 'Maria', 'Dmytro', 'Oksana', 'Serhii', 'Natalia', 'Bohdan',
+               'Anna', 'Yurii', 'Sofia', 'Maksym', 'Kateryna', 'Ivan', 'Daria', 'Oleh', 'Viktoriia', 'Roman')
+LAST_NAMES = ('Shevchenko', 'Kovalenko', 'Bondarenko', 'Tkachenko', 'Kravchenko', 'Oliinyk', 'Shevchuk', 'Polishchuk',
+              'Lysenko', 'Boiko', 'Marchenko', 'Rudenko', 'Savchenko', 'Melnyk', 'Moroz', 'Petrenko', 'Pavlenko',
+              'Klymenko', 'Kozak', 'Hnatiuk')
+DESCRIPTIONS = (None, None, None, 'Work', 'Family', 'Gym', 'University', 'Neighbour')
+FIRST_BIRTHDAY = date(1950, 1, 1)
+BIRTHDAY_SPAN = (date(2005, 12, 31) - FIRST_BIRTHDAY).days
+
+
+def contact(index: int, seed: int = 42) -> dict:
+    """
+    The contact function builds the contact with the given index.
+        Every contact has its own random generator, so any one of them can be rebuilt without the others.
+
+    :param index: int: Position of the contact in the dataset, starting at 0
+    :param seed: int: Dataset seed
+    :return: The UserSchema fields of the contact
+    """
+    rng = random.Random(seed * 1000003 + index)
+    first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {"first_name": first_name, "last_name": last_name,
+            "birthday_date": FIRST_BIRTHDAY + timedelta(days=rng.randrange(BIRTHDAY_SPAN)),
+            "phone_numbers": f"+380{rng.randrange(10 ** 9):09d}",
+            "email": f"{first_name}.{last_name}.{index}@example.com".lower(),
+            "other_description": rng.choice(DESCRIPTIONS)}
+
+
+def generate_contacts(count: int, seed: int = 42, start: int = 0) -> Iterator[dict]:
+    for index in range(start, start + count):
+        yield contact(index, seed)
+
+
+async def seed_contacts(engine: AsyncEngine, count: int, seed: int = 42, batch_size: int = 10000) -> bool:
+    """
+    The seed_contacts function makes the users table hold exactly the first count contacts of the dataset.
+        Rows the benchmark added on a previous run and all accounts are removed. The contacts are only
+        inserted again when the table does not already hold them.
+
+    :param engine: AsyncEngine: The benchmark database
+    :param count: int: Number of contacts
+    :param seed: int: Dataset seed
+    :param batch_size: int: Rows per INSERT
+    :return: True when the contacts had to be inserted
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(delete(User).where(User.id > count))
+        await conn.execute(delete(UserAuth))
+        stored = await conn.scalar(select(func.count()).select_from(User))
+        last = await conn.scalar(select(User.email).where(User.id == count))
+    if stored == count and last == contact(count - 1, seed)["email"]:
+        return False
+
+    async with engine.begin() as conn:
+        await conn.execute(delete(User))
+    for start in range(0, count, batch_size):
+        rows = [{"id": start + offset + 1, **row, "birthday_key": birthday_key(row["birthday_date"])}
+                for offset, row in enumerate(generate_contacts(min(batch_size, count - start), seed, start))]
+        async with engine.begin() as conn:
+            await conn.execute(insert(User), rows)
+    if engine.dialect.name == 'postgresql':
+        async with engine.begin() as conn:
+            await conn.execute(text("SELECT setval(pg_get_serial_sequence('users', 'id'), :count)"), {"count": count})
+    return True
@@ -0,0 +1,371 @@
+"""
+Benchmarks every route of the API in-process on a seeded contacts dataset.
+
+Requests go through httpx's ASGI transport straight into the app. Redis is fakeredis, emails queued by the
+auth routes are delivered by an outbox worker to the fake SMTP server, and avatars go to a local store in a
+temporary directory. Each route is reported with its throughput and p50/p95/p99 latency, and the results
+can be saved as JSON and compared with an earlier run:
+
+    python -m benchmarks.endpoints --contacts 100k --requests 200 --concurrency 10 --output before.json
+    python -m benchmarks.endpoints --contacts 100k --requests 200 --concurrency 10 --baseline before.json
+"""
+import os
+
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", "sqlite://")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("MAIL_FROM", "noreply@example.com")
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import fakeredis
+import httpx
+from PIL import Image
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.dataset import SIZES, LAST_NAMES, contact, generate_contacts, seed_contacts
+from benchmarks.fake_smtp import FakeSMTPServer
+from fast_api_app.database.connect_db import create_db_engine, get_db
+from fast_api_app.database.models import UserAuth
+from fast_api_app.services.auth import auth_service, hash_pool
+from fast_api_app.services.avatars import LocalAvatarStore, get_avatar_store, get_avatar_uploader, image_pool
+from fast_api_app.services.cache import user_cache
+from fast_api_app.services.email import MailSender, SMTPPool
+from fast_api_app.services.outbox import EmailOutbox
+from fast_api_app.services.ratelimit import rate_limiters
+from fast_api_app.services.redis_client import init_redis, close_redis
+from fast_api_app.services.sessions import session_store
+from fast_api_app.worker import OutboxWorker
+from main import app
+
+DATA_DIR = Path(__file__).resolve().parent / '.data'
+PASSWORD = '123456789'
+
+
+@dataclass
+class Context:
+    """
+    State the scenarios share: the client, the benchmark account and what earlier scenarios created.
+    """
+    client: httpx.AsyncClient
+    contacts: int
+    seed: int
+    run_id: str
+    headers: dict = field(default_factory=dict)
+    refresh_token: str = ''
+    email_token: str = ''
+    avatar_url: str = ''
+    created: list = field(default_factory=list)
+    sessions: list = field(default_factory=list)
+
+
+@dataclass
+class Scenario:
+    name: str
+    call: Callable[[Context, int], Awaitable[httpx.Response]]
+    expect: int = 200
+    requests: int | None = None
+    concurrency: int | None = None
+    prepare: Callable[[Context, int], Awaitable[None]] | None = None
+
+
+def avatar_image(index: int) -> bytes:
+    out = BytesIO()
+    Image.new('RGB', (640, 480), (index % 256, index // 256 % 256, 120)).save(out, format='JPEG')
+    return out.getvalue()
+
+
+def import_file(index: int, ctx: Context, rows: int = 1000) -> bytes:
+    start = ctx.contacts + 1000000 * (index + 1)
+    return b''.join(json.dumps(row, default=str).encode() + b'\n'
+                    for row in generate_contacts(rows, ctx.seed, start))
+
+
+async def refresh(ctx: Context, i: int) -> httpx.Response:
+    response = await ctx.client.get('/api/auth/refresh_token',
+                                    headers={"Authorization": f"Bearer {ctx.refresh_token}"})
+    if response.status_code == 200:
+        ctx.refresh_token = response.json()["refresh_token"]
+    return response
+
+
+async def start_sessions(ctx: Context, count: int):
+    for _ in range(count):
+        fid, _ = await session_store.start('bench@example.com')
+        ctx.sessions.append(await auth_service.create_access_token(data={"sub": 'bench@example.com', "fid": fid}))
+
+
+async def logout(ctx: Context, i: int) -> httpx.Response:
+    return await ctx.client.post('/api/auth/logout', headers={"Authorization": f"Bearer {ctx.sessions.pop()}"})
+
+
+async def create(ctx: Context, i: int) -> httpx.Response:
+    body = contact(ctx.contacts + i, ctx.seed)
+    response = await ctx.client.post('/api/users/', json={**body, "birthday_date": str(body["birthday_date"])},
+                                     headers=ctx.headers)
+    if response.status_code == 201:
+        ctx.created.append(response.json()["id"])
+    return response
+
+
+async def update(ctx: Context, i: int) -> httpx.Response:
+    user_id = i * 7919 % ctx.contacts + 1
+    body = contact(user_id - 1, ctx.seed)
+    return await ctx.client.put(f'/api/users/{user_id}', json={**body, "birthday_date": str(body["birthday_date"])},
+                                headers=ctx.headers)
+
+
+async def upload_avatar(ctx: Context, i: int) -> httpx.Response:
+    response = await ctx.client.patch('/api/users/avatar', headers=ctx.headers,
+                                      files={"file": ("avatar.jpg", avatar_image(i), "image/jpeg")})
+    if response.status_code == 200:
+        ctx.avatar_url = response.json()["avatar"]
+    return response
+
+
+SCENARIOS = [
+    Scenario('auth.signup', lambda ctx, i: ctx.client.post('/api/auth/signup', json={
+        "username": f"user{i:07d}", "email": f"signup-{ctx.run_id}-{i}@example.com", "password": PASSWORD}),
+             expect=201),
+    Scenario('auth.login', lambda ctx, i: ctx.client.post('/api/auth/login', data={
+        "username": "bench@example.com", "password": PASSWORD})),
+    Scenario('auth.confirmed_email', lambda ctx, i: ctx.client.get(f'/api/auth/confirmed_email/{ctx.email_token}')),
+    Scenario('auth.request_email', lambda ctx, i: ctx.client.post('/api/auth/request_email', json={
+        "email": "pending@example.com"})),
+    Scenario('auth.refresh_token', refresh, concurrency=1),
+    # Each logout ends a session of its own, opened before the timing starts
+    Scenario('auth.logout', logout, expect=204, prepare=start_sessions),
+    Scenario('users.read_users', lambda ctx, i: ctx.client.get('/api/users/', params={"limit": 100},
+                                                               headers=ctx.headers)),
+    Scenario('users.read_users_by_last_name', lambda ctx, i: ctx.client.get('/api/users/', params={
+        "limit": 100, "order_by": "last_name"}, headers=ctx.headers)),
+    Scenario('users.read_users_me', lambda ctx, i: ctx.client.get('/api/users/me/', headers=ctx.headers)),
+    Scenario('users.update_avatar', upload_avatar),
+    Scenario('avatars.read_avatar', lambda ctx, i: ctx.client.get(ctx.avatar_url)),
+    Scenario('users.read_birthdays', lambda ctx, i: ctx.client.get('/api/users/birthdays', params={"days": 7},
+                                                                   headers=ctx.headers)),
+    Scenario('users.search', lambda ctx, i: ctx.client.get('/api/users/search', params={
+        "last_name": LAST_NAMES[i % len(LAST_NAMES)], "limit": 100}, headers=ctx.headers)),
+    Scenario('users.read_user', lambda ctx, i: ctx.client.get(f'/api/users/{i * 7919 % ctx.contacts + 1}',
+                                                              headers=ctx.headers)),
+    Scenario('users.create_users', create, expect=201),
+    Scenario('users.update_user', update),
+    Scenario('users.patch_user', lambda ctx, i: ctx.client.patch(
+        f'/api/users/{i * 7919 % ctx.contacts + 1}', json={"other_description": f"note {i}"}, headers=ctx.headers)),
+    Scenario('users.remove_user', lambda ctx, i: ctx.client.delete(f'/api/users/{ctx.created.pop()}',
+                                                                   headers=ctx.headers)),
+    Scenario('users.export_users', lambda ctx, i: ctx.client.get('/api/users/export', params={"format": "ndjson"},
+                                                                 headers=ctx.headers), requests=3, concurrency=1),
+    Scenario('users.import_users', lambda ctx, i: ctx.client.post(
+        '/api/users/import', files={"file": ("contacts.ndjson", import_file(i, ctx), "application/x-ndjson")},
+        headers=ctx.headers), requests=3, concurrency=1),
+]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int) -> dict:
+    """
+    The summarize function reduces the latencies of one scenario to the numbers that get reported.
+
+    :param latencies: list[float]: Seconds each request took
+    :param elapsed: float: Wall time of the whole scenario
+    :param errors: int: Requests that did not get the expected status
+    :return: A dict with the request count, errors, requests per second and latency percentiles in ms
+    """
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {"requests": len(latencies), "errors": errors,
+            "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            "p50_ms": round(p50 * 1000, 3), "p95_ms": round(p95 * 1000, 3), "p99_ms": round(p99 * 1000, 3)}
+
+
+async def measure(scenario: Scenario, ctx: Context, requests: int, concurrency: int) -> dict:
+    """
+    The measure function sends a scenario's requests from concurrency lanes at once and times each of them.
+
+    :param scenario: Scenario: What to request
+    :param ctx: Context: Shared benchmark state
+    :param requests: int: Number of requests, unless the scenario sets its own
+    :param concurrency: int: Requests in flight, unless the scenario sets its own
+    :return: The summary of the scenario
+    """
+    total = min(scenario.requests or requests, requests)
+    if scenario.name == 'users.remove_user':
+        total = min(total, len(ctx.created))
+    if scenario.prepare is not None:
+        await scenario.prepare(ctx, total)
+    latencies: list[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def lane():
+        nonlocal errors
+        while (i := next(counter)) < total:
+            start = time.perf_counter()
+            response = await scenario.call(ctx, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != scenario.expect:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(lane() for _ in range(scenario.concurrency or concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def prepare_account(ctx: Context, sessions: async_sessionmaker):
+    password = await auth_service.get_password_hash(PASSWORD)
+    async with sessions() as db:
+        db.add_all([UserAuth(username='bench', email='bench@example.com', password=password, confirmed=True),
+                    UserAuth(username='pending', email='pending@example.com', password=password, confirmed=False)])
+        await db.commit()
+    # Every login opens a session family of its own, so auth.login does not disturb this session's refresh chain
+    response = await ctx.client.post('/api/auth/login', data={"username": 'bench@example.com', "password": PASSWORD})
+    response.raise_for_status()
+    tokens = response.json()
+    ctx.headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    ctx.refresh_token = tokens["refresh_token"]
+    ctx.email_token = auth_service.create_email_token({"sub": "bench@example.com"})
+    await upload_avatar(ctx, -1)
+
+
+async def run(contacts: int, seed: int, requests: int, concurrency: int, database_url: str | None = None,
+              only: list[str] | None = None) -> dict:
+    """
+    The run function seeds the dataset, runs the scenarios one after another and collects their summaries.
+
+    :param contacts: int: Number of contacts in the dataset
+    :param seed: int: Dataset seed
+    :param requests: int: Requests per scenario
+    :param concurrency: int: Requests in flight per scenario
+    :param database_url: str | None: Async database URL, a SQLite file under benchmarks/.data by default
+    :param only: list[str] | None: Run only the scenarios whose name starts with one of these
+    :return: The run metadata and the results per scenario
+    """
+    if database_url is None:
+        DATA_DIR.mkdir(exist_ok=True)
+        database_url = f"sqlite+aiosqlite:///{DATA_DIR / f'contacts-{contacts}-{seed}.db'}"
+    engine = create_db_engine(database_url, 'benchmark')
+    started = time.perf_counter()
+    seeded = await seed_contacts(engine, contacts, seed)
+    seed_seconds = time.perf_counter() - started
+    sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_db():
+        async with sessions() as db:
+            yield db
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    await init_redis(redis)
+    await user_cache.init(redis)
+    # The benchmark measures the limiter's cost, not its limits: only the limit is lifted, each tier keeps
+    # the lease size it was configured with, so it makes as many Redis round trips as in production
+    limits = {name: limiter.times for name, limiter in rate_limiters.items()}
+    for limiter in rate_limiters.values():
+        limiter.times = 10 ** 9
+    overrides = dict(app.dependency_overrides)
+    results = {}
+    with tempfile.TemporaryDirectory() as avatars:
+        store = LocalAvatarStore(Path(avatars))
+        app.dependency_overrides.update({get_db: override_get_db, get_avatar_uploader: lambda: store,
+                                         get_avatar_store: lambda: store})
+        try:
+            async with FakeSMTPServer() as smtp:
+                sender = MailSender(SMTPPool(smtp.host, smtp.port, size=4), 'noreply@example.com')
+                stop = asyncio.Event()
+                worker = asyncio.create_task(OutboxWorker(EmailOutbox(redis), sender, 'benchmark').run(stop))
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+                    ctx = Context(client, contacts, seed, datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S'))
+                    await prepare_account(ctx, sessions)
+                    for scenario in SCENARIOS:
+                        if only and not scenario.name.startswith(tuple(only)):
+                            continue
+                        results[scenario.name] = await measure(scenario, ctx, requests, concurrency)
+                stop.set()
+                await worker
+                await sender.close()
+                emails = len(smtp.messages)
+        finally:
+            app.dependency_overrides.clear()
+            app.dependency_overrides.update(overrides)
+            for name, limiter in rate_limiters.items():
+                limiter.times = limits[name]
+            await user_cache.close()
+            await close_redis()
+            hash_pool.shutdown()
+            image_pool.shutdown()
+            await engine.dispose()
+
+    return {"meta": {"contacts": contacts, "seed": seed, "requests": requests, "concurrency": concurrency,
+                     "database": engine.dialect.name, "seeded": seeded, "seed_seconds": round(seed_seconds, 3),
+                     "emails_delivered": emails, "python": platform.python_version(),
+                     "platform": platform.platform(), "revision": git_revision(),
+                     "timestamp": datetime.now(timezone.utc).isoformat()},
+            "results": results}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(run_result: dict, baseline: dict | None = None) -> str:
+    """
+    The report function formats the results as a table, with the change against baseline when one is given.
+
+    :param run_result: dict: What run returned
+    :param baseline: dict | None: An earlier result loaded from JSON
+    :return: The table
+    """
+    lines = [f"{'route':34} {'req':>6} {'err':>4} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for name, result in run_result["results"].items():
+        line = (f"{name:34} {result['requests']:>6} {result['errors']:>4} {result['rps']:>10.1f} "
+                f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+        before = (baseline or {}).get("results", {}).get(name)
+        if before and before["rps"] and before["p95_ms"]:
+            line += (f"   req/s {(result['rps'] / before['rps'] - 1) * 100:+6.1f}%"
+                     f"  p95 {(result['p95_ms'] / before['p95_ms'] - 1) * 100:+6.1f}%")
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contacts', choices=SIZES, default='1k')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--database-url', help='async SQLAlchemy URL, a SQLite file under benchmarks/.data by default')
+    parser.add_argument('--only', nargs='*', help='route name prefixes to run, e.g. users.search auth.')
+    parser.add_argument('--output', type=Path, help='save the results as JSON')
+    parser.add_argument('--baseline', type=Path, help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(SIZES[args.contacts], args.seed, args.requests, args.concurrency, args.database_url,
+                             args.only))
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print(report(result, baseline))
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import List
+
+
+@dataclass
+class ReceivedMessage:
+    mail_from: str
+    rcpt_tos: List[str]
+    data: bytes
+
+
+@dataclass
+class FakeSMTPServer:
+    """
+    A minimal in-process SMTP server that accepts every message and keeps it in memory.
+
+    It speaks just enough SMTP (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT) for aiosmtplib,
+    without TLS. connect_latency and message_latency simulate the handshake and per-message cost of a real
+    server, so the effect of connection reuse can be measured offline.
+    """
+
+    host: str = '127.0.0.1'
+    port: int = 0
+    connect_latency: float = 0
+    message_latency: float = 0
+    messages: List[ReceivedMessage] = field(default_factory=list)
+    connections: int = 0
+    _server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> 'FakeSMTPServer':
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        await asyncio.sleep(self.connect_latency)
+        mail_from, rcpt_tos = '', []
+
+        async def reply(text: str):
+            writer.write(text.encode() + b'\r\n')
+            await writer.drain()
+
+        await reply('220 fake-smtp ESMTP')
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors='replace').strip()
+                verb = command.split(' ', 1)[0].upper()
+                if verb == 'EHLO':
+                    await reply('250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME')
+                elif verb == 'HELO':
+                    await reply('250 fake-smtp')
+                elif verb == 'AUTH':
+                    await reply('235 Authentication successful')
+                elif verb == 'MAIL':
+                    mail_from, rcpt_tos = command[10:].strip('<> '), []
+                    await reply('250 OK')
+                elif verb == 'RCPT':
+                    rcpt_tos.append(command[8:].strip('<> '))
+                    await reply('250 OK')
+                elif verb == 'DATA':
+                    await reply('354 End data with <CR><LF>.<CR><LF>')
+                    chunks = []
+                    while (chunk := await reader.readline()) not in (b'.\r\n', b''):
+                        chunks.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                    await asyncio.sleep(self.message_latency)
+                    self.messages.append(ReceivedMessage(mail_from, rcpt_tos, b''.join(chunks)))
+                    await reply('250 OK: queued')
+                elif verb in ('RSET', 'NOOP'):
+                    await reply('250 OK')
+                elif verb == 'QUIT':
+                    await reply('221 Bye')
+                    break
+                else:
+                    await reply('502 Command not implemented')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
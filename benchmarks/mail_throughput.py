@@ -0,0 +1,52 @@
+"""
+Measures email throughput against the fake SMTP server.
+
+Compares a fresh connection per message (what FastMail did) with the pooled MailSender:
+
+    python -m benchmarks.mail_throughput --messages 500 --pool-size 4 --connect-latency 0.05
+"""
+import argparse
+import asyncio
+import time
+
+import aiosmtplib
+
+from benchmarks.fake_smtp import FakeSMTPServer
+from fast_api_app.services.email import MailSender, SMTPPool
+
+
+async def run(messages: int, pool_size: int, connect_latency: float, message_latency: float):
+    async with FakeSMTPServer(connect_latency=connect_latency, message_latency=message_latency) as server:
+        sender = MailSender(SMTPPool(server.host, server.port, size=pool_size), 'noreply@example.com')
+        batch = [sender.build(f'user{i}@example.com', 'Confirm your email ', 'email_template.html',
+                              host='http://localhost/', username=f'user{i}', token='token') for i in range(messages)]
+
+        start = time.perf_counter()
+        for message in batch:
+            await aiosmtplib.send(message, hostname=server.host, port=server.port)
+        unpooled = time.perf_counter() - start
+        unpooled_connections = server.connections
+
+        start = time.perf_counter()
+        await sender.send_many(batch)
+        pooled = time.perf_counter() - start
+        await sender.close()
+
+    print(f'connection per message: {messages / unpooled:10.1f} msg/s  {unpooled_connections} connections')
+    print(f'pooled (size {pool_size}):      {messages / pooled:10.1f} msg/s  '
+          f'{server.connections - unpooled_connections} connections')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--connect-latency', type=float, default=0.02,
+                        help='seconds the fake server waits before greeting, stands in for the TLS handshake')
+    parser.add_argument('--message-latency', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.pool_size, args.connect_latency, args.message_latency))
+
+
+if __name__ == '__main__':
+    main()
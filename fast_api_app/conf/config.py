@@ -4,18 +4,80 @@ from pydantic import ConfigDict
 
 class Settings(BaseSettings):
     sqlalchemy_database_url: str = 'sqlalchemy'
+    create_schema_on_startup: bool = True
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_max_connections: int = 0
+    web_concurrency: int = 1
+    db_pool_timeout: float = 5
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_connect_timeout: float = 5
+    db_statement_timeout: int = 10000
+    db_lock_timeout: int = 3000
+    db_statement_cache_size: int = 100
+    replica_urls: list[str] = []
+    read_your_writes_window: float = 5
     secret_key: str = 'secret_key'
     algorithm: str = 'algorithms'
+    bcrypt_rounds: int = 12
+    hash_pool_size: int = 2
+    hash_max_concurrency: int = 8
+    hash_queue_timeout: float = 5
     mail_username: str = 'mail_username'
     mail_password: str = 'mail_'
     mail_from: str = 'mail_from'
     mail_port: int = 465
     mail_server: str = 'mail_server'
+    mail_from_name: str = 'Desired Name'
+    mail_ssl_tls: bool = True
+    mail_starttls: bool = False
+    mail_use_credentials: bool = True
+    mail_validate_certs: bool = True
+    mail_pool_size: int = 4
+    mail_timeout: float = 30
+    outbox_maxlen: int = 1000000
+    outbox_concurrency: int = 20
+    outbox_max_attempts: int = 6
+    outbox_backoff_base: float = 5
+    outbox_backoff_max: float = 600
+    outbox_domain_rate: float = 10
+    outbox_domain_burst: float = 20
+    outbox_claim_idle: float = 300
+    slow_query_threshold: float = 0.5
+    slow_query_log_parameters: bool = True
+    n_plus_one_threshold: int = 10
     redis_host: str = 'localhost'
     redis_port: int = 6379
+    redis_db: int = 0
+    redis_password: str | None = None
+    redis_max_connections: int = 50
+    redis_pool_timeout: float = 2
+    redis_socket_timeout: float = 1
+    redis_socket_connect_timeout: float = 1
+    redis_health_check_interval: int = 30
+    user_cache_size: int = 10000
+    user_cache_local_ttl: float = 60
+    user_cache_ttl: int = 900
+    token_cache_size: int = 10000
+    refresh_token_ttl: int = 7 * 24 * 3600
+    session_cache_size: int = 10000
+    session_local_ttl: float = 5
+    rate_limit_tiers: dict[str, str] = {'read': '10/60', 'write': '10/60', 'bulk': '2/60'}
+    rate_limit_batch: int = 10
+    rate_limit_cache_size: int = 100000
     cloudinary_name: str = 'cloudinary'
     cloudinary_api_key: str = 'cloudinary_api_key'
     cloudinary_api_secret: str = 'cloudinary_api_secret'
+    avatar_uploader: str = 'cloudinary'
+    avatar_local_dir: str = 'avatars'
+    avatar_max_bytes: int = 5 * 1024 * 1024
+    image_pool_size: int = 1
+    image_max_concurrency: int = 4
+    image_queue_timeout: float = 10
+    import_batch_size: int = 1000
+    import_max_errors: int = 1000
+    export_batch_size: int = 1000
 
     model_config = ConfigDict(
         env_file=".env",
@@ -1,18 +1,194 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from fast_api_app.conf.config import settings
+from fast_api_app.services.metrics import instrument_engine, registry
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(url: str) -> str:
+    """
+    The async_database_url function maps a synchronous database URL (the one Alembic uses)
+    onto the asyncio driver for the same backend: asyncpg for Postgres and aiosqlite for SQLite.
+    URLs that already name a driver are returned unchanged.
+
+    :param url: str: The database URL from the settings
+    :return: The URL to build the async engine with
+    """
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed.render_as_string(hide_password=False)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    The asyncio queue pool, counting checkouts, the time spent getting them (waiting for a free connection
+    or opening a new one) and the checkouts that gave up after pool_timeout.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.waiting = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+            self.wait_seconds += time.perf_counter() - start
+        self.checkouts += 1
+        return connection
+
+
+def pool_limits() -> tuple[int, int]:
+    """
+    The pool_limits function sizes the pool of one worker process.
+        With settings.db_max_connections set, pool_size and max_overflow are cut down so that
+        settings.web_concurrency workers together never open more connections than that.
+
+    :return: The pool_size and max_overflow
+    """
+    size, overflow = settings.db_pool_size, settings.db_max_overflow
+    if settings.db_max_connections:
+        per_worker = max(1, settings.db_max_connections // max(1, settings.web_concurrency))
+        size = min(size, per_worker)
+        overflow = max(0, min(overflow, per_worker - size))
+    return size, overflow
+
+
+def engine_options(url: str) -> dict:
+    """
+    The engine_options function builds the create_async_engine arguments for url from the settings.
+        Postgres connections get server-side statement_timeout and lock_timeout, so a slow query or a
+        lock wait fails instead of holding the connection; SQLite waits settings.db_lock_timeout for a lock.
+        In-memory SQLite keeps its single-connection pool.
+
+    :param url: str: The database URL
+    :return: Keyword arguments for create_async_engine
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == 'sqlite' and parsed.database in (None, '', ':memory:'):
+        return {}
+    size, overflow = pool_limits()
+    options = {'poolclass': TimedQueuePool, 'pool_size': size, 'max_overflow': overflow,
+               'pool_timeout': settings.db_pool_timeout, 'pool_recycle': settings.db_pool_recycle,
+               'pool_pre_ping': settings.db_pool_pre_ping}
+    if backend == 'postgresql':
+        options['connect_args'] = {
+            'timeout': settings.db_connect_timeout,
+            'prepared_statement_cache_size': settings.db_statement_cache_size,
+            'statement_cache_size': settings.db_statement_cache_size,
+            'server_settings': {'statement_timeout': str(settings.db_statement_timeout),
+                                'lock_timeout': str(settings.db_lock_timeout)},
+        }
+    elif backend == 'sqlite':
+        options['connect_args'] = {'timeout': settings.db_lock_timeout / 1000}
+    return options
+
+
+engines: dict[str, AsyncEngine] = {}
+
+
+def create_db_engine(url: str, name: str = 'primary') -> AsyncEngine:
+    """
+    The create_db_engine function creates an instrumented async engine configured from the settings.
+        Its pool shows up in the db_pool_* metrics under name.
+
+    :param url: str: The database URL, synchronous or async
+    :param name: str: The engine label in the metrics
+    :return: The engine
+    """
+    db_engine = create_async_engine(async_database_url(url), **engine_options(url))
+    instrument_engine(db_engine)
+    engines[name] = db_engine
+    return db_engine
+
+
+def _pool_stats(stat):
+    return lambda: {(('engine', name),): stat(db_engine.pool) for name, db_engine in engines.items()
+                    if isinstance(db_engine.pool, TimedQueuePool)}
+
+
+registry.add_collector('db_pool_checked_out', 'gauge', 'Connections in use.',
+                       _pool_stats(lambda pool: pool.checkedout()))
+registry.add_collector('db_pool_idle', 'gauge', 'Idle connections in the pool.',
+                       _pool_stats(lambda pool: pool.checkedin()))
+registry.add_collector('db_pool_waiting', 'gauge', 'Checkouts waiting for a connection.',
+                       _pool_stats(lambda pool: pool.waiting))
+registry.add_collector('db_pool_checkouts_total', 'counter', 'Connections handed out.',
+                       _pool_stats(lambda pool: pool.checkouts))
+registry.add_collector('db_pool_checkout_wait_seconds_total', 'counter', 'Time spent getting a connection.',
+                       _pool_stats(lambda pool: pool.wait_seconds))
+registry.add_collector('db_pool_timeouts_total', 'counter', 'Checkouts that gave up after pool_timeout.',
+                       _pool_stats(lambda pool: pool.timeouts))
+
+# Timeouts and lost connections are the database being slow or away, not a bug in the request
+STATEMENT_TIMEOUT = '57014'
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def database_error_status(error: Exception) -> int | None:
+    """
+    The database_error_status function picks the HTTP status for a database error that is not the request's fault.
+
+    :param error: Exception: The error raised by SQLAlchemy
+    :return: 504 for a statement timeout, 503 for pool timeouts, lock timeouts and lost connections, else None
+    """
+    if isinstance(error, exc.TimeoutError):
+        return 503
+    if not isinstance(error, exc.DBAPIError):
+        return None
+    sqlstate = getattr(error.orig, 'sqlstate', None) or ''
+    if sqlstate == STATEMENT_TIMEOUT:
+        return 504
+    if sqlstate == LOCK_NOT_AVAILABLE or sqlstate.startswith('08') or error.connection_invalidated:
+        return 503
+    if isinstance(error, exc.OperationalError) and 'database is locked' in str(error.orig):
+        return 503
+    return None
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    """
+    The get_db function is a FastAPI dependency that opens an AsyncSession for the request
+    and closes it once the response has been sent.
+
+    :return: An AsyncSession bound to the application engine
+    """
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def create_schema():
+    """
+    The create_schema function creates all tables known to the models' metadata.
+
+    :return: None
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
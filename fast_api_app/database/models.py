@@ -1,18 +1,25 @@
-from sqlalchemy import Column, Integer, String, Date, Boolean
+from datetime import date
 
-from connect_db import Base, engine
+from sqlalchemy import Column, Integer, String, Date, Boolean, Index, func
+
+from fast_api_app.database.connect_db import Base
 
 
 class UserAuth(Base):
     __tablename__ = 'users_auth'
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50))
-    email = Column(String, nullable=False, index=True)
+    email = Column(String, nullable=False)
     password = Column(String(255), nullable=False)
     avatar = Column(String(255), nullable=True)
-    refresh_token = Column(String(255), nullable=True)
+    avatar_hash = Column(String(64), nullable=True)
     confirmed = Column(Boolean, default=False)
 
+    # One account per address whatever its case; lookups compare lower(email) so they can use it
+    __table_args__ = (
+        Index('ix_users_auth_email_lower', func.lower(email), unique=True),
+    )
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -20,9 +27,32 @@ class User(Base):
     first_name = Column(String(25), nullable=False)
     last_name = Column(String(25), nullable=False)
     birthday_date = Column(Date)
+    birthday_key = Column(Integer, nullable=True, index=True)
     email = Column(String, nullable=False, index=True)
     phone_numbers = Column(String, nullable=False, index=True)
     other_description = Column(String, nullable=True, default=None)
 
+    # text_pattern_ops lets Postgres use the same indexes for equality and prefix (LIKE 'abc%') searches
+    __table_args__ = (
+        Index('ix_users_last_name_id', last_name, id),
+        Index('ix_users_email_lower', func.lower(email).label('email_lower'),
+              postgresql_ops={'email_lower': 'text_pattern_ops'}),
+        Index('ix_users_name_lower', func.lower(last_name).label('last_name_lower'),
+              func.lower(first_name).label('first_name_lower'),
+              postgresql_ops={'last_name_lower': 'text_pattern_ops', 'first_name_lower': 'text_pattern_ops'}),
+        Index('ix_users_first_name_lower', func.lower(first_name).label('first_name_lower'),
+              postgresql_ops={'first_name_lower': 'text_pattern_ops'}),
+    )
+
+
+def birthday_key(birthday_date: date | None) -> int | None:
+    """
+    The birthday_key function turns a birthday into the month/day ordinal stored in User.birthday_key,
+    e.g. 26 October becomes 1026, so upcoming birthdays can be looked up with an index range scan.
 
-Base.metadata.create_all(bind=engine)
+    :param birthday_date: date | None: The birthday to encode
+    :return: The month * 100 + day key, or None when there is no birthday
+    """
+    if birthday_date is None:
+        return None
+    return birthday_date.month * 100 + birthday_date.day
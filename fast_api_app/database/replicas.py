@@ -0,0 +1,54 @@
+import itertools
+from typing import Sequence
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from fast_api_app.conf.config import settings
+from fast_api_app.database.connect_db import create_db_engine
+from fast_api_app.services.cache import TTLCache
+
+
+class ReadRouter:
+    """
+    Spreads read-only sessions over the read replicas, round-robin.
+
+    Replicas lag behind the primary, so after a user's own commit their reads go to the primary for
+    window seconds (read-your-writes). Recent writers are remembered per worker: with several workers
+    the window only holds on the worker that handled the write.
+    """
+
+    def __init__(self, replicas: Sequence[async_sessionmaker], window: float, maxsize: int = 10000):
+        self.replicas = list(replicas)
+        self._next = itertools.cycle(self.replicas)
+        self.recent_writes = TTLCache(maxsize, window)
+
+    def wrote(self, key: str):
+        """
+        The wrote function starts the read-your-writes window of key.
+
+        :param key: str: Who wrote, e.g. the user's email
+        :return: None
+        """
+        if self.replicas:
+            self.recent_writes.set(key.lower(), True)
+
+    def reader(self, key: str | None = None) -> async_sessionmaker | None:
+        """
+        The reader function picks the replica the next read-only session should use.
+
+        :param key: str | None: Who reads; None for reads that need not see their own writes
+        :return: A replica's sessionmaker, or None when the read has to go to the primary
+        """
+        if not self.replicas or (key is not None and self.recent_writes.get(key.lower())):
+            return None
+        return next(self._next)
+
+
+replica_engines: list[AsyncEngine] = [create_db_engine(url, f'replica{index}')
+                                      for index, url in enumerate(settings.replica_urls)]
+read_router = ReadRouter([async_sessionmaker(replica, autoflush=False, expire_on_commit=False)
+                          for replica in replica_engines], settings.read_your_writes_window)
+
+
+def get_read_router() -> ReadRouter:
+    return read_router
@@ -1,24 +1,46 @@
-from typing import List
+import base64
+import calendar
+import json
+from datetime import date
+from typing import AsyncIterator, List, Sequence, Tuple
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
-from fast_api_app.database.models import User, UserAuth
-from fast_api_app.schemas import UserSchema, UserModel
+from sqlalchemy import select, insert, update, delete, and_, or_, case, func, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row, RowMapping
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fast_api_app.database.models import User, UserAuth, birthday_key
+from fast_api_app.schemas import UserSchema, UserModel, UserUpdate
+from fast_api_app.services.cache import user_cache
 
+USER_COLUMNS = (User.id, User.first_name, User.last_name, User.birthday_date, User.phone_numbers, User.email,
+                User.other_description)
 
-async def get_user_by_email(email: str, db: Session) -> User:
-    return db.query(UserAuth).filter(UserAuth.email == email).first()
+# Dialects whose insert() has on_conflict_do_nothing; anything else is assumed to be PostgreSQL
+_INSERTS = {'sqlite': sqlite.insert}
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+def _email_is(email: str):
+    # Matches the expression of ix_users_auth_email_lower, so the lookup is an index scan
+    return func.lower(UserAuth.email) == email.lower()
+
+
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
+    return await db.scalar(select(UserAuth).filter(_email_is(email)))
+
+
+async def create_user(body: UserModel, db: AsyncSession) -> User:
     """
     The create_user function creates a new user in the database.
         Args:
             body (UserModel): The UserModel object containing the data to be inserted into the database.
-            db (Session): The SQLAlchemy Session object used to interact with our PostgreSQL database.
+            db (AsyncSession): The SQLAlchemy Session object used to interact with our PostgreSQL database.
+        The INSERT ... ON CONFLICT DO NOTHING RETURNING checks for an existing account and creates the new one
+        in a single statement, so two signups with the same email cannot both succeed.
 
     :param body: UserModel: Create a new user object
-    :param db: Session: Pass in the database session
-    :return: A user object
+    :param db: AsyncSession: Pass in the database session
+    :return: A user object, loaded from the RETURNING, or None if the email is already taken
     :doc-author: Trelent
     """
     avatar = None
@@ -27,113 +49,269 @@ async def create_user(body: UserModel, db: Session) -> User:
         avatar = g.get_image()
     except Exception as e:
         print(e)
-    new_user = UserAuth(**body.dict(), avatar=avatar)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    dialect_insert = _INSERTS.get(db.bind.dialect.name, postgresql.insert)
+    stmt = dialect_insert(UserAuth).values(**body.model_dump(), avatar=avatar).on_conflict_do_nothing()
+    new_user = await db.scalar(stmt.returning(UserAuth))
+    await db.commit()
     return new_user
 
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession, avatar_hash: str | None = None) -> User:
     """
     The update_avatar function updates the avatar of a user.
 
     :param email: Find the user in the database
     :param url: str: Specify the type of data that will be passed to the function
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param avatar_hash: str: Content hash of the uploaded image, used to skip re-uploading it
     :return: The updated user object
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.avatar = url
-    db.commit()
+    stmt = update(UserAuth).where(_email_is(email)).values(avatar=url, avatar_hash=avatar_hash)
+    user = await db.scalar(stmt.returning(UserAuth))
+    await db.commit()
+    await user_cache.invalidate(email)
     return user
 
 
-async def update_token(user: UserAuth, token: str | None, db: Session) -> None:
-    user.refresh_token = token
-    db.commit()
+async def update_password(user: UserAuth, password: str, db: AsyncSession) -> None:
+    """
+    The update_password function stores a new password hash for the user.
 
+    :param user: UserAuth: The user to update
+    :param password: str: The new bcrypt hash
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    user.password = password
+    await db.commit()
 
-async def get_users(skip: int, limit: int, user: UserAuth, db: Session) -> List[User]:
-    return db.query(User).offset(skip).limit(limit).all()
 
+def _encode_cursor(order_by: str, user: Row) -> str:
+    key = [user.last_name, user.id] if order_by == 'last_name' else [user.id]
+    return base64.urlsafe_b64encode(json.dumps([order_by, *key]).encode()).decode().rstrip('=')
 
-async def get_user(user_id: int, user: UserAuth, db: Session) -> User:
-    return db.query(User).filter(User.id == user_id).first()
 
+def _decode_cursor(cursor: str, order_by: str) -> list:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, list) or not data or data[0] != order_by:
+        raise ValueError("Invalid cursor")
+    key, types = data[1:], ((str, int) if order_by == 'last_name' else (int,))
+    if len(key) != len(types) or not all(isinstance(value, type_) for value, type_ in zip(key, types)):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+async def get_users(limit: int, cursor: str | None, user: UserAuth, db: AsyncSession,
+                    order_by: str = 'id') -> Tuple[Sequence[Row], str | None]:
+    """
+    The get_users function returns one page of users using keyset pagination.
+        Users are ordered by id or by (last_name, id) and the page starts right after the position
+        encoded in cursor, so deep pages cost the same index seek as the first one.
+        Only USER_COLUMNS are selected and returned as plain rows, no ORM objects are built.
+
+    :param limit: int: Maximum number of users on the page
+    :param cursor: str | None: Opaque token returned with the previous page, None for the first page
+    :param user: UserAuth: Get the current user
+    :param db: AsyncSession: Access the database
+    :param order_by: str: Sort key, 'id' or 'last_name'
+    :return: The user rows on the page and the cursor of the next page (None on the last page)
+    :raises ValueError: If the cursor is malformed or was issued for another order
+    :doc-author: Trelent
+    """
+    stmt = select(*USER_COLUMNS)
+    if order_by == 'last_name':
+        stmt = stmt.order_by(User.last_name, User.id)
+        if cursor is not None:
+            stmt = stmt.where(tuple_(User.last_name, User.id) > tuple_(*_decode_cursor(cursor, order_by)))
+    else:
+        stmt = stmt.order_by(User.id)
+        if cursor is not None:
+            stmt = stmt.where(User.id > _decode_cursor(cursor, order_by)[0])
+    result = await db.execute(stmt.limit(limit + 1))
+    users = result.all()
+    next_cursor = _encode_cursor(order_by, users[limit - 1]) if len(users) > limit else None
+    return users[:limit], next_cursor
+
+
+async def estimate_users_total(db: AsyncSession) -> int | None:
+    """
+    The estimate_users_total function returns the planner's row estimate for the users table.
+        It reads pg_class instead of running count(*), so it is cheap but only as fresh as the last ANALYZE.
 
-async def get_birthday(today, end_date, user: UserAuth, db: Session):
+    :param db: AsyncSession: Access the database
+    :return: The estimated number of users, or None when the database can't tell
     """
-    The get_birthday function returns a list of users whose birthday is between today and the end date.
+    if db.bind.dialect.name != 'postgresql':
+        return None
+    estimate = await db.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass"))
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+async def stream_users(user: UserAuth, db: AsyncSession, batch_size: int = 1000) -> AsyncIterator[RowMapping]:
+    """
+    The stream_users function yields every user as a plain row, ordered by id.
+        Rows are read through a server-side cursor batch_size at a time, so memory use does not
+        depend on the size of the table.
+
+    :param user: UserAuth: Get the current user
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: How many rows to fetch per round trip
+    :return: An async iterator of row mappings with the USER_COLUMNS keys
+    :doc-author: Trelent
+    """
+    stmt = select(*USER_COLUMNS).order_by(User.id).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for row in result.mappings():
+        yield row
+
+
+async def get_user(user_id: int, user: UserAuth, db: AsyncSession) -> User:
+    return await db.scalar(select(User).filter(User.id == user_id))
+
 
+def _birthday_window(today: date, end_date: date):
+    """
+    The _birthday_window function builds the WHERE clause matching birthday keys between today and end_date.
+        A window that runs past 31 December wraps around to January, and in years without 29 February
+        people born on that day are celebrated on 28 February.
+
+    :param today: date: First day of the window
+    :param end_date: date: Last day of the window, inclusive
+    :return: A SQL condition on User.birthday_key
+    """
+    if (end_date - today).days >= 365:
+        return User.birthday_key.is_not(None)
+    start, end = birthday_key(today), birthday_key(end_date)
+    if start <= end:
+        condition = User.birthday_key.between(start, end)
+    else:
+        condition = or_(User.birthday_key >= start, User.birthday_key <= end)
+    for year in range(today.year, end_date.year + 1):
+        if not calendar.isleap(year) and today <= date(year, 2, 28) <= end_date:
+            condition = or_(condition, User.birthday_key == 229)
+    return condition
+
+
+async def get_birthday(today: date, end_date: date, user: UserAuth, db: AsyncSession) -> Sequence[Row]:
+    """
+    The get_birthday function returns a list of users whose birthday is between today and the end date.
+        The window is matched in SQL against the indexed birthday_key column and the result is ordered
+        by how soon the birthday comes up.
 
-    :param today: Get the current date, and the end_date parameter is used to set a date range
-    :param end_date: Determine the end date of the range
+    :param today: date: Get the current date, and the end_date parameter is used to set a date range
+    :param end_date: date: Determine the end date of the range
     :param user: UserAuth: Get the user's information from the database
-    :param db: Session: Access the database
-    :return: A list of users whose birthday is between today and end_date
+    :param db: AsyncSession: Access the database
+    :return: Rows of USER_COLUMNS for the users whose birthday is between today and end_date
     :doc-author: Trelent
     """
-    users = db.query(User).all()
-    result = []
-    for user in users:
-        if (
-                user.birthday_date.month >= today.month and user.birthday_date.day >= today.day and user.birthday_date.month <= end_date.month and user.birthday_date.day <= end_date.day):
-            result.append(user)
-    return result
+    start = birthday_key(today)
+    upcoming = case((User.birthday_key >= start, 0), else_=1)
+    stmt = select(*USER_COLUMNS).where(_birthday_window(today, end_date)).order_by(upcoming, User.birthday_key,
+                                                                                   User.id)
+    users = await db.execute(stmt)
+    return users.all()
+
 
+def _matches(column, value: str, prefix: bool):
+    value = value.lower()
+    if not prefix:
+        return func.lower(column) == value
+    pattern = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return func.lower(column).like(pattern, escape='\\')
 
-async def search_users(first_name: str | None, last_name: str | None, email: str | None, user: UserAuth, db: Session):
+
+async def search_users(first_name: str | None, last_name: str | None, email: str | None, user: UserAuth,
+                       db: AsyncSession, match_all: bool = False, prefix: bool = False, limit: int = 100,
+                       cursor: int | None = None) -> Sequence[Row]:
     """
     The search_users function searches for users in the database based on first name, last name, or email.
-        If a user is found with any of these parameters, they are added to a list and returned.
+        Matching is case-insensitive and runs against the lower() functional indexes on the users table.
+        Each user is returned once, ordered by id, no matter how many criteria it matches.
 
     :param first_name: str | None: Specify that the first_name parameter is a string or none
     :param last_name: str | None: Search for a user with the last name specified
     :param email: str | None: Search for users with a specific email
     :param user: UserAuth: Check if the user is logged in
-    :param db: Session: Access the database
-    :return: A list of users that match the search criteria
+    :param db: AsyncSession: Access the database
+    :param match_all: bool: Require every given criterion to match (AND) instead of any of them (OR)
+    :param prefix: bool: Match values that start with the given strings instead of whole values
+    :param limit: int: Maximum number of users to return
+    :param cursor: int | None: Return only users with an id greater than this one (the last id of the previous page)
+    :return: Rows of USER_COLUMNS for the users that match the search criteria
     :doc-author: Trelent
     """
-    result = []
-    users = db.query(User).all()
-    for user in users:
-        if first_name != None:
-            if user.first_name == first_name:
-                result.append(user)
-        if last_name != None:
-            if user.last_name == last_name:
-                result.append(user)
-        if email != None:
-            if user.email == email:
-                result.append(user)
-    return result
+    criteria = [_matches(column, value, prefix)
+                for column, value in ((User.first_name, first_name), (User.last_name, last_name), (User.email, email))
+                if value is not None]
+    if not criteria:
+        return []
+    stmt = select(*USER_COLUMNS).where(and_(*criteria) if match_all else or_(*criteria))
+    if cursor is not None:
+        stmt = stmt.where(User.id > cursor)
+    users = await db.execute(stmt.order_by(User.id).limit(limit))
+    return users.all()
+
+
+def _user_values(body: UserSchema) -> dict:
+    return {"first_name": body.first_name, "last_name": body.last_name, "birthday_date": body.birthday_date,
+            "birthday_key": birthday_key(body.birthday_date), "email": body.email,
+            "phone_numbers": body.phone_numbers, "other_description": body.other_description}
 
 
-async def create_users(body: UserSchema, user: UserAuth, db: Session) -> User:
+async def create_users(body: UserSchema, user: UserAuth, db: AsyncSession) -> User:
     """
     The create_users function creates a new user in the database.
         Args:
             body (UserSchema): The UserSchema object containing all of the information for creating a new user.
-            db (Session): The SQLAlchemy Session object that is used to communicate with the database.
+            db (AsyncSession): The SQLAlchemy Session object that is used to communicate with the database.
 
     :param body: UserSchema: Get the information from the request body
     :param user: UserAuth: Get the user's id from the jwt token
-    :param db: Session: Pass the database session to the function
-    :return: A user object
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A user object, loaded from the INSERT ... RETURNING
     :doc-author: Trelent
     """
-    user_ = User(first_name=body.first_name, last_name=body.last_name, birthday_date=body.birthday_date,
-                 email=body.email, phone_numbers=body.phone_numbers, other_description=body.other_description)
-    db.add(user_)
-    db.commit()
-    db.refresh(user_)
+    user_ = await db.scalar(insert(User).values(**_user_values(body)).returning(User))
+    await db.commit()
     return user_
 
 
-async def update_user(user_id: int, body: UserSchema, user: UserAuth, db: Session) -> User | None:
+async def create_users_batch(bodies: List[UserSchema], user: UserAuth, db: AsyncSession) -> List[Tuple[int, str]]:
+    """
+    The create_users_batch function inserts many users with a single executemany INSERT and one commit.
+        If the batch is rejected by the database it is retried row by row, so one bad row
+        only costs itself and not the rest of the batch.
+
+    :param bodies: List[UserSchema]: The validated users to insert
+    :param user: UserAuth: Get the current user
+    :param db: AsyncSession: Access the database
+    :return: The position in bodies and the error of every row that could not be inserted
+    :doc-author: Trelent
+    """
+    rows = [_user_values(body) for body in bodies]
+    try:
+        await db.execute(insert(User), rows)
+        await db.commit()
+        return []
+    except SQLAlchemyError:
+        await db.rollback()
+    failed = []
+    for index, row in enumerate(rows):
+        try:
+            await db.execute(insert(User), [row])
+            await db.commit()
+        except SQLAlchemyError as err:
+            await db.rollback()
+            failed.append((index, str(err.orig if isinstance(err, DBAPIError) else err)))
+    return failed
+
+
+async def update_user(user_id: int, body: UserSchema, user: UserAuth, db: AsyncSession) -> User | None:
     """
     The update_user function updates a user's information in the database.
         Args:
@@ -143,52 +321,66 @@ async def update_user(user_id: int, body: UserSchema, user: UserAuth, db: Sessio
     :param user_id: int: Find the user in the database
     :param body: UserSchema: Pass the data that is being updated
     :param user: UserAuth: Check if the user is authorized to update a user
-    :param db: Session: Access the database
-    :return: A user object, which is a model
+    :param db: AsyncSession: Access the database
+    :return: The updated user, or None if there is no user with that id
+    :doc-author: Trelent
+    """
+    stmt = update(User).where(User.id == user_id).values(**_user_values(body)).returning(User)
+    user = await db.scalar(stmt)
+    await db.commit()
+    return user
+
+
+async def patch_user(user_id: int, body: UserUpdate, user: UserAuth, db: AsyncSession) -> User | None:
+    """
+    The patch_user function writes only the fields that were sent in body, with one UPDATE ... RETURNING.
+
+    :param user_id: int: Find the user in the database
+    :param body: UserUpdate: The fields to change
+    :param user: UserAuth: Get the current user
+    :param db: AsyncSession: Access the database
+    :return: The updated user, or None if there is no user with that id
     :doc-author: Trelent
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if user:
-        user.first_name = body.first_name
-        user.last_name = body.last_name
-        user.phone_numbers = body.phone_numbers
-        user.email = body.email
-        user.other_description = body.other_description
-        db.commit()
+    values = body.model_dump(exclude_unset=True)
+    if not values:
+        return await get_user(user_id, user, db)
+    if 'birthday_date' in values:
+        values['birthday_key'] = birthday_key(values['birthday_date'])
+    user = await db.scalar(update(User).where(User.id == user_id).values(**values).returning(User))
+    await db.commit()
     return user
 
 
-async def remove_user(user_id: int, user: UserAuth, db: Session) -> User | None:
+async def remove_user(user_id: int, user: UserAuth, db: AsyncSession) -> User | None:
     """
     The remove_user function removes a user from the database.
         Args:
             user_id (int): The id of the user to remove.
-            db (Session): A connection to the database.
+            db (AsyncSession): A connection to the database.
 
     :param user_id: int: Specify the user id of the user to be deleted
     :param user: UserAuth: Check if the user is authorized to perform this action
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The user object that was removed from the database
     :doc-author: Trelent
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if user:
-        db.delete(user)
-        db.commit()
+    user = await db.scalar(delete(User).where(User.id == user_id).returning(User))
+    await db.commit()
     return user
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
     The confirmed_email function takes in an email and a database session,
     and sets the confirmed field of the user with that email to True.
 
 
     :param email: str: Get the email of the user
-    :param db: Session: Pass the database session to this function
+    :param db: AsyncSession: Pass the database session to this function
     :return: None
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.confirmed = True
-    db.commit()
+    await db.execute(update(UserAuth).where(_email_is(email)).values(confirmed=True))
+    await db.commit()
+    await user_cache.invalidate(email)
@@ -1,50 +1,53 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Security, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, status, Security, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from fast_api_app.database.connect_db import get_db
 from fast_api_app.schemas import UserModel, UserResponses, TokenModel, RequestEmail
 from fast_api_app.repository import users as repository_users
 from fast_api_app.services.auth import auth_service
-from fast_api_app.services.email import send_email
+from fast_api_app.services.outbox import email_outbox
+from fast_api_app.services.sessions import SessionStore, get_session_store
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponses, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes in a UserModel object, which is validated by pydantic.
-        If the email already exists, it will return an HTTP 409 error code (conflict).
-        Otherwise, it will create a new user and send them an email to verify their account.
+        If the email already exists in any letter case, it will return an HTTP 409 error code (conflict).
+        Otherwise, it will create a new user and queue an email to verify their account in the outbox.
 
     :param body: UserModel: Get the data from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dict with the user and a detail message
     :doc-author: Trelent
     """
-    exist_user = await repository_users.get_user_by_email(body.email, db)
-    if exist_user:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
+    if new_user is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
+    await email_outbox.enqueue(new_user.email, new_user.username, str(request.base_url))
     return {"user": new_user, "detail": "User successfully created"}
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db),
+                sessions: SessionStore = Depends(get_session_store)):
     """
     The login function is used to authenticate a user.
         It takes the username and password from the request body,
         verifies that they are correct, and returns an access token.
+        A password hash made with an outdated bcrypt cost is replaced on the way.
+        Every login opens its own session, so a user can be logged in on several devices.
 
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Pass the database connection to the function
+    :param db: AsyncSession: Pass the database connection to the function
+    :param sessions: SessionStore: Open the session the tokens belong to
     :return: A dictionary with the access_token, refresh_token and token_type
     :doc-author: Trelent
     """
@@ -53,17 +56,20 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    valid, new_hash = await auth_service.verify_password(body.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash is not None:
+        await repository_users.update_password(user, new_hash, db)
 
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    fid, jti = await sessions.start(user.email)
+    access_token = await auth_service.create_access_token(data={"sub": user.email, "fid": fid})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email, "fid": fid, "jti": jti})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         It takes the token from the URL and uses it to get the user's email address.
@@ -73,7 +79,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
             confirmed_email function which sets the 'confirmed' field of that particular record to
 
     :param token: str: Get the token from the url
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A message that the email is already confirmed or it confirms your email
     :doc-author: Trelent
     """
@@ -88,52 +94,67 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
 
 
 @router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+async def request_email(body: RequestEmail, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that they can click on
     to confirm their email address. The function takes in a RequestEmail object, which contains the
     email of the user who wants to confirm their account. It then checks if there is already a confirmed
-    user with that email address, and if so returns an error message saying as much. If not, it sends
-    an email containing a confirmation link.
+    user with that email address, and if so returns an error message saying as much. If not, it queues
+    an email containing a confirmation link in the outbox.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add a background task to the queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A message that indicates whether the email was confirmed or not
     :doc-author: Trelent
     """
     user = await repository_users.get_user_by_email(body.email, db)
 
+    if user is None:
+        return {"message": "Check your email for confirmation."}
     if user.confirmed:
         return {"message": "Your email is already confirmed"}
-    if user:
-        background_tasks.add_task(send_email, user.email, user.username, request.base_url)
+    await email_outbox.enqueue(user.email, user.username, str(request.base_url))
     return {"message": "Check your email for confirmation."}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        sessions: SessionStore = Depends(get_session_store)):
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns an access_token, a new refresh_token, and the type of token.
-        If there is no valid user associated with the given email address or if there are any errors during decoding
-        or creating tokens then an HTTPException will be raised.
+        Each refresh token can be used once. Presenting one that was already used logs the whole session out,
+        as it means the token was copied; any errors during decoding or rotating tokens raise an HTTPException.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the header
-    :param db: Session: Pass the database session to the function
+    :param sessions: SessionStore: Rotate the refresh token of the session
     :return: An access_token and a refresh_token
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    email, fid, jti = await auth_service.decode_refresh_token(credentials.credentials)
+    new_jti = await sessions.rotate(fid, jti)
+    if new_jti is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    access_token = await auth_service.create_access_token(data={"sub": email, "fid": fid})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "fid": fid, "jti": new_jti})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(credentials: HTTPAuthorizationCredentials = Security(security),
+                 sessions: SessionStore = Depends(get_session_store)):
+    """
+    The logout function ends the session of the access token in the Authorization header.
+        Its refresh token and all access tokens issued in the session stop working.
+
+    :param credentials: HTTPAuthorizationCredentials: Get the access token from the header
+    :param sessions: SessionStore: Revoke the session
+    :return: None
+    :doc-author: Trelent
+    """
+    claims = auth_service.decode_access_token(credentials.credentials)
+    if claims is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    await sessions.revoke(claims[1])
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import re
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Request, Response, status
+from fastapi.responses import FileResponse
+
+from fast_api_app.services.avatars import LocalAvatarStore, get_avatar_store
+
+router = APIRouter(prefix='/avatars', tags=["avatars"])
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [value.strip().removeprefix('W/') for value in header.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    The parse_range function turns a single byte range into the first and last byte to send.
+        Ranges it does not understand, including lists of several ranges, are ignored and the whole
+        file is sent instead, which the RFC allows.
+
+    :param header: str: The Range header
+    :param size: int: Size of the file
+    :return: (start, end), both inclusive, or None to send the whole file
+    :raises HTTPException: 416 when the range starts past the end of the file
+    """
+    match = RANGE_RE.fullmatch(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+@router.api_route('/{digest}', methods=['GET', 'HEAD'], response_class=FileResponse)
+async def read_avatar(request: Request, digest: str = Path(pattern='^[0-9a-f]{64}$'),
+                      store: LocalAvatarStore = Depends(get_avatar_store)):
+    """
+    The read_avatar function serves an avatar from the local avatar store.
+        Stored avatars never change, so the digest is a strong ETag and responses may be cached forever.
+        If-None-Match answers 304, and a single byte Range (optionally guarded by If-Range) answers 206.
+
+    :param request: Request: Read the conditional and range headers
+    :param digest: str: The avatar digest from its URL
+    :param store: LocalAvatarStore: Where avatars are kept
+    :return: The avatar, part of it, or an empty 304
+    :doc-author: Trelent
+    """
+    path = store.path(digest)
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size = stat_result.st_size
+    byte_range = request.headers.get('range')
+    if byte_range is not None and request.headers.get('if-range', etag) == etag:
+        span = parse_range(byte_range, size)
+        if span is not None:
+            start, end = span
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            body = b'' if request.method == 'HEAD' else await asyncio.to_thread(store.read, digest, start, end)
+            response = Response(body, status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers,
+                                media_type='image/png')
+            response.headers["Content-Length"] = str(end - start + 1)
+            return response
+
+    return FileResponse(path, headers=headers, media_type='image/png', stat_result=stat_result,
+                        method=request.method)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from fast_api_app.services.auth import auth_service
+from fast_api_app.services.cache import user_cache
+from fast_api_app.services.metrics import registry
+
+router = APIRouter(tags=["metrics"])
+
+
+def _cache_stats(stat: str):
+    return lambda: {(("cache", "token"),): auth_service.token_cache.stats()[stat],
+                    (("cache", "user"),): user_cache.local.stats()[stat]}
+
+
+registry.add_collector('cache_hits_total', 'counter', 'In-process cache hits.', _cache_stats('hits'))
+registry.add_collector('cache_misses_total', 'counter', 'In-process cache misses.', _cache_stats('misses'))
+registry.add_collector('cache_entries', 'gauge', 'Entries held by in-process caches.', _cache_stats('size'))
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """
+    The metrics function exposes request latencies, per-phase timings and cache statistics in the
+    Prometheus text format.
+
+    :return: The metrics as text
+    :doc-author: Trelent
+    """
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
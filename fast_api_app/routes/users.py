@@ -1,36 +1,59 @@
-from typing import List
+from typing import List, Literal
 
 from fastapi import APIRouter, HTTPException, Depends, status, Query, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import date, timedelta
-from fast_api_app.database.connect_db import get_db
-from fast_api_app.schemas import UserSchema, UserResponse, UserDb
+from fast_api_app.schemas import UserSchema, UserUpdate, UserResponse, UserDb, UserPage, ImportReport
 from fast_api_app.repository import users as repository_users
 from fast_api_app.database.models import User, UserAuth
-from fast_api_app.services.auth import auth_service
-from fastapi_limiter.depends import RateLimiter
-import cloudinary
-import cloudinary.uploader
+from fast_api_app.services.auth import auth_service, get_read_db, get_write_db
+from fast_api_app.services.contacts_io import import_contacts, export_contacts, EXPORT_FORMATS
+from fast_api_app.conf.config import settings
+from fast_api_app.services.avatars import AvatarUploader, get_avatar_uploader, image_pool, read_upload, \
+    content_hash, resize_avatar
+from fast_api_app.services.metrics import TimedORJSONResponse, timed
+from fast_api_app.services.ratelimit import RateLimit
 
 router = APIRouter(prefix='/users', tags=["users"])
 
 
-@router.get("/", response_model=List[UserResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
+def _rows(rows) -> List[dict]:
+    # Rows of USER_COLUMNS already have the UserResponse shape; response_model only documents them
+    with timed('serialize'):
+        return [row._asdict() for row in rows]
+
+
+@router.get("/", response_model=UserPage, response_class=TimedORJSONResponse,
+            description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimit('read'))])
+async def read_users(limit: int = Query(100, ge=1, le=1000), cursor: str = Query(None),
+                     order_by: Literal['id', 'last_name'] = Query('id'), with_total: bool = Query(False),
+                     db: AsyncSession = Depends(get_read_db),
                      current_user: UserAuth = Depends(auth_service.get_current_user)):
     """
-    The read_users function returns a list of users.
+    The read_users function returns a page of users.
+        Pages are ordered by id or by last name and chained with the opaque next_cursor token,
+        which is null on the last page. With with_total=true the page also carries the planner's
+        estimate of the total number of users.
+        Rows come straight from the database, so they are encoded with orjson without being validated again.
 
-    :param skip: int: Skip the first n users
     :param limit: int: Limit the number of users returned
-    :param db: Session: Pass the database session to the function
+    :param cursor: str: The next_cursor of the previous page
+    :param order_by: str: Order users by id or by last_name
+    :param with_total: bool: Add an estimated total to the page
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: UserAuth: Get the current user from the database
-    :return: A list of users
+    :return: A page of users
     :doc-author: Trelent
     """
-    users = await repository_users.get_users(skip, limit, current_user, db)
-    return users
+    try:
+        users, next_cursor = await repository_users.get_users(limit, cursor, current_user, db, order_by=order_by)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    estimated_total = await repository_users.estimate_users_total(db) if with_total else None
+    return TimedORJSONResponse({"items": _rows(users), "next_cursor": next_cursor,
+                                "estimated_total": estimated_total})
 
 
 @router.get("/me/", response_model=UserDb)
@@ -48,92 +71,124 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
 
 @router.patch('/avatar', response_model=UserDb)
 async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_write_db),
+                             uploader: AvatarUploader = Depends(get_avatar_uploader)):
     """
     The update_avatar_user function is used to update the avatar of a user.
-        The function takes in an UploadFile object, which contains the file that will be uploaded to Cloudinary.
-        It also takes in a User object, which is obtained from auth_service.get_current_user(). This ensures that only
-        authenticated users can access this endpoint and change their own avatars (and not anyone else's). Finally, it
-        takes in a Session object for database access.
+        Request bodies much larger than settings.avatar_max_bytes are rejected with 413 before the form is parsed,
+        and the file itself is read in chunks and rejected with 413 once it passes settings.avatar_max_bytes.
+        The image is cropped and scaled to 250x250 on the image pool, so only the small version is uploaded.
+        If the upload has the same content hash as the current avatar nothing is processed or uploaded.
 
     :param file: UploadFile: Get the file from the request body
     :param current_user: User: Get the current user from the database
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
+    :param uploader: AvatarUploader: Where the processed avatar is stored
     :return: The updated user
     :doc-author: Trelent
     """
-    cloudinary.config(
-        cloud_name="dmybldclv",
-        api_key="592143484358843",
-        api_secret="YqKAI25KSkQ9UwyWxPn_gcwX-3A",
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'NotesApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'NotesApp/{current_user.username}') \
-        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    user = await repository_users.update_avatar(current_user.email, src_url, db)
+    data = await read_upload(file, settings.avatar_max_bytes)
+    digest = content_hash(data)
+    if current_user.avatar and current_user.avatar_hash == digest:
+        return current_user
+    try:
+        avatar = await image_pool.run(resize_avatar, data)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    src_url = await uploader.upload(avatar, current_user.username, digest)
+    user = await repository_users.update_avatar(current_user.email, src_url, db, avatar_hash=digest)
     return user
 
 
-@router.get("/birthdays", response_model=List[UserResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def read_birthdays(db: Session = Depends(get_db),
+@router.get("/birthdays", response_model=List[UserResponse], response_class=TimedORJSONResponse,
+            description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimit('read'))])
+async def read_birthdays(days: int = Query(7, ge=0, le=366), db: AsyncSession = Depends(get_read_db),
                          current_user: UserAuth = Depends(auth_service.get_current_user)):
     """
-    The read_birthdays function returns a list of users who have birthdays in the next 7 days.
-    The function takes an optional db parameter, which is used to access the database.
-    If no db parameter is provided, then it will use the default get_db() function to obtain a database connection.
+    The read_birthdays function returns a list of users who have birthdays in the next `days` days.
+    The window includes today and may run past the end of the year.
 
-    :param db: Session: Pass the database session to the function
+    :param days: int: How many days ahead to look, 7 by default
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: UserAuth: Get the current user from the database
-    :return: A list of users with birthdays in the next 7 days
+    :return: A list of users with birthdays in the window, soonest first
     :doc-author: Trelent
     """
     today = date.today()
-    end_date = today + timedelta(days=7)
+    end_date = today + timedelta(days=days)
     birthdays = await repository_users.get_birthday(today, end_date, current_user, db)
     if birthdays is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return birthdays
+    return TimedORJSONResponse(_rows(birthdays))
 
 
-@router.get("/search", response_model=List[UserResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def search(db: Session = Depends(get_db), current_user: UserAuth = Depends(auth_service.get_current_user),
-                 first_name: str = Query(None), last_name: str = Query(None), email: str = Query(None)):
+@router.get("/search", response_model=List[UserResponse], response_class=TimedORJSONResponse,
+            description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimit('read'))])
+async def search(db: AsyncSession = Depends(get_read_db), current_user: UserAuth = Depends(auth_service.get_current_user),
+                 first_name: str = Query(None), last_name: str = Query(None), email: str = Query(None),
+                 match: Literal['any', 'all'] = Query('any'), prefix: bool = Query(False),
+                 limit: int = Query(100, ge=1, le=1000), cursor: int = Query(None)):
     """
     The search function allows users to search for other users by first name, last name, or email.
-        The function takes in the following parameters:
-            - db: a database session object that is used to query the database. This parameter is automatically passed in
-                when this function is called from an endpoint (see below). It can also be manually passed into this function
-                if it needs to be called outside of an endpoint (e.g., during testing) and a database session object needs
-                to be provided as input. If no value for db is provided when calling this function, then Depends(get
+        Comparisons ignore case. With match=any a user matching at least one criterion is returned,
+        with match=all it has to match every criterion given. With prefix=true the values are treated
+        as prefixes. Results are ordered by id; pass the id of the last user as cursor to get the next page.
 
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: UserAuth: Get the current user from the database
     :param first_name: str: Get the first name of the user from the request body
     :param last_name: str: Search for a user by last name
-    :param email: str: Get the email of the user to be deleted
-    :return: A list of users, but the user_id function returns a single user
+    :param email: str: Search for a user by email
+    :param match: str: Combine the criteria with OR (any) or AND (all)
+    :param prefix: bool: Match the beginning of the values instead of whole values
+    :param limit: int: Limit the number of users returned
+    :param cursor: int: Id of the last user of the previous page
+    :return: A list of users matching the search
     :doc-author: Trelent
     """
-    users = await repository_users.search_users(first_name, last_name, email, current_user, db)
+    users = await repository_users.search_users(first_name, last_name, email, current_user, db,
+                                                match_all=match == 'all', prefix=prefix, limit=limit, cursor=cursor)
     if users is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return users
+    return TimedORJSONResponse(_rows(users))
+
+
+@router.get("/export", response_class=StreamingResponse, description='No more than 2 requests per minute',
+            dependencies=[Depends(RateLimit('bulk'))])
+async def export_users(fmt: Literal['ndjson', 'csv', 'vcard'] = Query('ndjson', alias='format'),
+                       db: AsyncSession = Depends(get_read_db),
+                       current_user: UserAuth = Depends(auth_service.get_current_user)):
+    """
+    The export_users function streams the whole contact book as NDJSON, CSV or vCard.
+        Rows come from a server-side cursor and are written out as they arrive, so memory use
+        stays flat however many contacts there are. The database session stays open until the
+        response has been sent.
+
+    :param fmt: str: 'ndjson', 'csv' or 'vcard'
+    :param db: AsyncSession: Get the database session
+    :param current_user: UserAuth: Get the current user
+    :return: A streaming response with the contacts
+    :doc-author: Trelent
+    """
+    media_type, extension, _ = EXPORT_FORMATS[fmt]
+    rows = repository_users.stream_users(current_user, db, batch_size=settings.export_batch_size)
+    return StreamingResponse(export_contacts(rows, fmt, batch_size=settings.export_batch_size),
+                             media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="contacts.{extension}"'})
 
 
 @router.get("/{user_id}", response_model=UserResponse, description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def read_user(user_id: int, db: Session = Depends(get_db),
+            dependencies=[Depends(RateLimit('read'))])
+async def read_user(user_id: int, db: AsyncSession = Depends(get_read_db),
                     current_user: UserAuth = Depends(auth_service.get_current_user)):
     """
     The read_user function is used to read a single user from the database.
     It takes in an integer user_id, and returns a User object.
 
     :param user_id: int: Specify the user id of the user to be updated
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: UserAuth: Get the current user
     :return: A user object
     :doc-author: Trelent
@@ -146,14 +201,14 @@ async def read_user(user_id: int, db: Session = Depends(get_db),
 
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED,
              description='No more than 10 requests per minute',
-             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def create_users(body: UserSchema, db: Session = Depends(get_db),
+             dependencies=[Depends(RateLimit('write'))])
+async def create_users(body: UserSchema, db: AsyncSession = Depends(get_write_db),
                        current_user: UserAuth = Depends(auth_service.get_current_user)):
     """
     The create_users function creates a new user in the database.
 
     :param body: UserSchema: Validate the body of the request
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: UserAuth: Get the current user from the database
     :return: The user object created
     :doc-author: Trelent
@@ -161,20 +216,46 @@ async def create_users(body: UserSchema, db: Session = Depends(get_db),
     return await repository_users.create_users(body, current_user, db)
 
 
+@router.post("/import", response_model=ImportReport, description='No more than 2 requests per minute',
+             dependencies=[Depends(RateLimit('bulk'))])
+async def import_users(file: UploadFile = File(), fmt: Literal['csv', 'ndjson'] = Query(None, alias='format'),
+                       db: AsyncSession = Depends(get_write_db),
+                       current_user: UserAuth = Depends(auth_service.get_current_user)):
+    """
+    The import_users function creates users in bulk from an uploaded CSV or NDJSON file.
+        CSV files need a header row with the UserSchema field names, NDJSON files hold one object per line.
+        The format is taken from the format query parameter or else from the file name.
+        Rows that fail validation are listed in the report and the rest of the file is imported anyway.
+
+    :param file: UploadFile: The file to import
+    :param fmt: str: 'csv' or 'ndjson'
+    :param db: AsyncSession: Get the database session
+    :param current_user: UserAuth: Get the current user
+    :return: How many rows were imported and which ones failed
+    :doc-author: Trelent
+    """
+    if fmt is None:
+        suffix = (file.filename or '').rsplit('.', 1)[-1].lower()
+        fmt = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(suffix)
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown file format")
+    return await import_contacts(file, fmt, current_user, db)
+
+
 @router.put("/{user_id}", response_model=UserResponse, description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def update_user(body: UserSchema, user_id: int, db: Session = Depends(get_db),
+            dependencies=[Depends(RateLimit('write'))])
+async def update_user(body: UserSchema, user_id: int, db: AsyncSession = Depends(get_write_db),
                       current_user: UserAuth = Depends(auth_service.get_current_user)):
     """
     The update_user function updates a user in the database.
         The function takes three arguments:
             body (UserSchema): A UserSchema object containing the new values for the user.
             user_id (int): An integer representing the ID of a specific user to update.
-            db (Session, optional): A SQLAlchemy Session object used to query and modify data in a database. Defaults to Depends(get_db).
+            db (AsyncSession, optional): A SQLAlchemy AsyncSession object used to query and modify data in a database. Defaults to Depends(get_write_db).
 
     :param body: UserSchema: Validate the body of the request
     :param user_id: int: Identify the user to update
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: UserAuth: Get the current user
     :return: A user object
     :doc-author: Trelent
@@ -185,9 +266,30 @@ async def update_user(body: UserSchema, user_id: int, db: Session = Depends(get_
     return user
 
 
+@router.patch("/{user_id}", response_model=UserResponse, description='No more than 10 requests per minute',
+              dependencies=[Depends(RateLimit('write'))])
+async def patch_user(body: UserUpdate, user_id: int, db: AsyncSession = Depends(get_write_db),
+                     current_user: UserAuth = Depends(auth_service.get_current_user)):
+    """
+    The patch_user function changes only the fields sent in the request body.
+        Fields that are left out keep their values; a body without fields changes nothing.
+
+    :param body: UserUpdate: The fields to change
+    :param user_id: int: Identify the user to update
+    :param db: AsyncSession: Get the database session
+    :param current_user: UserAuth: Get the current user
+    :return: The updated user object
+    :doc-author: Trelent
+    """
+    user = await repository_users.patch_user(user_id, body, current_user, db)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user
+
+
 @router.delete("/{user_id}", response_model=UserResponse, description='No more than 10 requests per minute',
-               dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def remove_user(user_id: int, db: Session = Depends(get_db),
+               dependencies=[Depends(RateLimit('write'))])
+async def remove_user(user_id: int, db: AsyncSession = Depends(get_write_db),
                       current_user: UserAuth = Depends(auth_service.get_current_user)):
     """
     The remove_user function removes a user from the database.
@@ -195,7 +297,7 @@ async def remove_user(user_id: int, db: Session = Depends(get_db),
         and returns a User object if successful.
 
     :param user_id: int: Specify the user_id of the user to be removed
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: UserAuth: Get the current user
     :return: The removed user
     :doc-author: Trelent
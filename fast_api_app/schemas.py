@@ -1,6 +1,6 @@
 from datetime import date
-from typing import Optional
-from pydantic import BaseModel, Field, EmailStr
+from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, field_validator
 
 
 class UserSchema(BaseModel):
@@ -12,12 +12,44 @@ class UserSchema(BaseModel):
     other_description: Optional[str]
 
 
+class UserUpdate(BaseModel):
+    first_name: Optional[str] = Field(None, max_length=25)
+    last_name: Optional[str] = Field(None, max_length=25)
+    birthday_date: Optional[date] = None
+    phone_numbers: Optional[str] = Field(None, min_length=10, max_length=13)
+    email: Optional[EmailStr] = None
+    other_description: Optional[str] = None
+
+    @field_validator('first_name', 'last_name', 'birthday_date', 'phone_numbers', 'email')
+    @classmethod
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError('may be left out but not set to null')
+        return value
+
+
 class UserResponse(UserSchema):
     id: int
     email: EmailStr
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class UserPage(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[str] = None
+    estimated_total: Optional[int] = None
+
+
+class ImportRowError(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
 
 
 class UserModel(BaseModel):
@@ -32,8 +64,7 @@ class UserDb(BaseModel):
     email: str
     avatar: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserResponses(BaseModel):
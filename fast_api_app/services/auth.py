@@ -1,30 +1,75 @@
+import hashlib
+import time
+from functools import lru_cache
 from typing import Optional
-import pickle
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from fast_api_app.database.connect_db import get_db
+from fast_api_app.database.replicas import ReadRouter, get_read_router
+from fast_api_app.database.models import UserAuth
 from fast_api_app.repository import users as repository_users
-import redis
 from fast_api_app.conf.config import settings
+from fast_api_app.services.cache import TTLCache, user_cache
+from fast_api_app.services.metrics import timed
+from fast_api_app.services.pool import BoundedPool
+from fast_api_app.services.sessions import SessionStore, get_session_store
+
+
+@lru_cache
+def _crypt_context(rounds: int):
+    # passlib is only needed where hashes are computed, i.e. in the hash_pool processes
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=rounds,
+                        bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds)
+
+
+def _hash_password(password: str, rounds: int) -> str:
+    return _crypt_context(rounds).hash(password)
+
+
+def _verify_password(password: str, hashed_password: str, rounds: int) -> tuple[bool, str | None]:
+    return _crypt_context(rounds).verify_and_update(password, hashed_password)
+
+
+hash_pool = BoundedPool("hash", settings.hash_pool_size, settings.hash_max_concurrency, settings.hash_queue_timeout)
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    token_cache = TTLCache(settings.token_cache_size, ttl=0)
 
-    def verify_password(self, plain_password, hashed_password):
-        return self.pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        The verify_password function checks a password against its bcrypt hash on hash_pool.
+            When the password is right but the hash was made with a different cost than settings.bcrypt_rounds,
+            a new hash with the current cost is returned as well so the caller can store it.
 
-    def get_password_hash(self, password: str):
-        return self.pwd_context.hash(password)
+        :param self: Represent the instance of the class
+        :param plain_password: str: The password the user typed
+        :param hashed_password: str: The stored hash
+        :return: Whether the password matches, and the replacement hash or None
+        """
+        with timed('hash'):
+            return await hash_pool.run(_verify_password, plain_password, hashed_password, settings.bcrypt_rounds)
+
+    async def get_password_hash(self, password: str) -> str:
+        """
+        The get_password_hash function hashes a password with bcrypt on hash_pool.
+
+        :param self: Represent the instance of the class
+        :param password: str: The password to hash
+        :return: The bcrypt hash
+        """
+        with timed('hash'):
+            return await hash_pool.run(_hash_password, password, settings.bcrypt_rounds)
 
     def create_email_token(self, data: dict):
         """
@@ -40,7 +85,8 @@ class Auth:
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        with timed('jwt'):
+            token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return token
 
     async def get_email_from_token(self, token: str):
@@ -54,7 +100,8 @@ class Auth:
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            with timed('jwt'):
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             email = payload["sub"]
             return email
         except JWTError as e:
@@ -82,18 +129,19 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
-        encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        with timed('jwt'):
+            encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_access_token
 
     async def create_refresh_token(self, data: dict, expires_delta: Optional[float] = None):
         """
         The create_refresh_token function creates a refresh token for the user.
             Args:
-                data (dict): A dictionary containing the user's id and username.
+                data (dict): A dictionary containing the user's email and the fid and jti of the session.
                 expires_delta (Optional[float]): The number of seconds until the token expires, defaults to None.
 
         :param self: Represent the instance of the class
-        :param data: dict: Store the user's id and username
+        :param data: dict: Store the user's email and session ids
         :param expires_delta: Optional[float]: Set the expiration time for the refresh token
         :return: The encoded refresh token
         :doc-author: Trelent
@@ -102,42 +150,77 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=settings.refresh_token_ttl)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
-        encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        with timed('jwt'):
+            encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
-    async def decode_refresh_token(self, refresh_token: str):
+    async def decode_refresh_token(self, refresh_token: str) -> tuple[str, str, str]:
         """
         The decode_refresh_token function is used to decode the refresh token.
-        It takes a refresh_token as an argument and returns the email of the user if it's valid.
+        It takes a refresh_token as an argument and returns the email of the user and the session ids if it's valid.
         If not, it raises an HTTPException with status code 401 (UNAUTHORIZED) and detail 'Could not validate credentials'.
 
 
         :param self: Represent the instance of a class
         :param refresh_token: str: Pass in the refresh token
-        :return: The email of the user that is stored in the refresh token
+        :return: The email, fid and jti stored in the refresh token
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
+            with timed('jwt'):
+                payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
+        if payload.get('scope') != 'refresh_token':
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
+        claims = payload.get('sub'), payload.get('fid'), payload.get('jti')
+        if None in claims:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
+        return claims
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    def decode_access_token(self, token: str) -> tuple[str, str] | None:
+        """
+        The decode_access_token function returns the email and session family of a valid access token.
+            Tokens that passed verification are kept in token_cache, keyed by their SHA-256 digest, until
+            their own exp, so repeated requests with the same bearer token skip the signature check.
+
+        :param self: Represent the instance of the class
+        :param token: str: The bearer token
+        :return: The sub and fid claims, or None if the token is invalid, expired or not an access token
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        claims = self.token_cache.get(key)
+        if claims is not None:
+            return claims
+        try:
+            with timed('jwt'):
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        except JWTError:
+            return None
+        claims = payload.get("sub"), payload.get("fid")
+        if payload.get("scope") != "access_token" or None in claims:
+            return None
+        remaining = payload["exp"] - time.time()
+        if remaining > 0:
+            self.token_cache.set(key, claims, ttl=remaining)
+        return claims
+
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db),
+                               sessions: SessionStore = Depends(get_session_store)):
         """
         The get_current_user function is a dependency that will be called by the FastAPI framework
         to retrieve the current user. It uses the oauth2_scheme to get an access token from either
-        the Authorization header or query string, and then validates it using PyJWT. If successful,
-        it returns a User object.
+        the Authorization header or query string, and then validates it using PyJWT. Tokens of a session
+        that was logged out or revoked are refused. If successful, it returns a User object, taken from
+        user_cache when possible and from the primary otherwise. A miss is never served by a replica: the row
+        is cached for every worker, and a lagging replica could put back the account an update just invalidated.
 
         :param self: Access the class variables
         :param token: str: Get the token from the request header
-        :param db: Session: Get the database session
+        :param db: AsyncSession: Get the session on the primary
+        :param sessions: SessionStore: Check that the token's session is still open
         :return: The user object that is associated with the token
         :doc-author: Trelent
         """
@@ -147,27 +230,52 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
-        except JWTError as e:
+        claims = self.decode_access_token(token)
+        if claims is None or not await sessions.is_active(claims[1]):
             raise credentials_exception
-        user = self.r.get(f"user:{email}")
+        email = claims[0]
+        user = await user_cache.get(email)
         if user is None:
             user = await repository_users.get_user_by_email(email, db)
             if user is None:
                 raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            await user_cache.set(user)
 
         return user
 
 
 auth_service = Auth()
+
+
+async def get_read_db(current_user: UserAuth = Depends(auth_service.get_current_user),
+                      db: AsyncSession = Depends(get_db), router: ReadRouter = Depends(get_read_router)):
+    """
+    The get_read_db function is a FastAPI dependency for the read-only queries of a request. The session
+    is opened on a read replica, or on the primary when there is none or the current user wrote recently.
+
+    :param current_user: UserAuth: Whose reads have to see their own writes
+    :param db: AsyncSession: The session on the primary, used when the read cannot go to a replica
+    :param router: ReadRouter: Pick the replica
+    :return: An AsyncSession
+    """
+    reader = router.reader(current_user.email)
+    if reader is None:
+        yield db
+        return
+    async with reader() as replica:
+        yield replica
+
+
+async def get_write_db(current_user: UserAuth = Depends(auth_service.get_current_user),
+                       db: AsyncSession = Depends(get_db), router: ReadRouter = Depends(get_read_router)):
+    """
+    The get_write_db function is a FastAPI dependency for requests that write. The session is the one on the
+    primary, and each commit starts the current user's read-your-writes window.
+
+    :param current_user: UserAuth: Who writes
+    :param db: AsyncSession: The session on the primary
+    :param router: ReadRouter: Told about the commits
+    :return: An AsyncSession
+    """
+    event.listen(db.sync_session, "after_commit", lambda session: router.wrote(current_user.email))
+    yield db
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+
+from fast_api_app.conf.config import settings
+from fast_api_app.services.pool import BoundedPool
+
+AVATAR_SIZE = 250
+CHUNK_SIZE = 64 * 1024
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 16 * 1024
+
+image_pool = BoundedPool("image", settings.image_pool_size, settings.image_max_concurrency,
+                         settings.image_queue_timeout)
+
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    """
+    The read_upload function reads an uploaded file chunk by chunk and stops as soon as it grows past max_bytes.
+
+    :param file: UploadFile: The uploaded file
+    :param max_bytes: int: The largest accepted size
+    :return: The file content
+    :raises HTTPException: 413 when the file is larger than max_bytes
+    """
+    data = bytearray()
+    while chunk := await file.read(CHUNK_SIZE):
+        data += chunk
+        if len(data) > max_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Avatar must not be larger than {max_bytes} bytes")
+    return bytes(data)
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that caps the request body of upload routes before anything parses it.
+
+    FastAPI spools a multipart form to disk before the route runs, so read_upload alone only stops
+    the copy into memory. A request whose Content-Length is over the limit is answered with 413
+    without reading its body; a chunked body is counted as it streams and fails with 413 once it
+    passes the limit.
+    """
+
+    def __init__(self, app, limits: dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Request body must not be larger than {limit} bytes"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def resize_avatar(data: bytes, size: int = AVATAR_SIZE) -> bytes:
+    """
+    The resize_avatar function crops an image to a centered square, scales it to size x size and encodes it as PNG.
+        It runs on image_pool, so it has to stay a module-level function.
+
+    :param data: bytes: The uploaded image
+    :param size: int: Width and height of the result
+    :return: The PNG encoded avatar
+    :raises ValueError: When data is not an image Pillow can read
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            mode = 'RGBA' if 'A' in image.getbands() else 'RGB'
+            avatar = ImageOps.fit(image.convert(mode), (size, size), Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as err:
+        raise ValueError("Not a valid image") from err
+    out = BytesIO()
+    avatar.save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+class AvatarUploader(ABC):
+    """
+    Where processed avatars end up. upload must not block the event loop.
+    """
+
+    @abstractmethod
+    async def upload(self, data: bytes, username: str, digest: str) -> str:
+        """
+        The upload function stores a processed avatar.
+
+        :param data: bytes: The PNG encoded avatar
+        :param username: str: Owner of the avatar
+        :param digest: str: Content hash of the original upload
+        :return: The public URL of the avatar
+        """
+
+
+class CloudinaryUploader(AvatarUploader):
+    """
+    Uploads avatars to Cloudinary. The SDK is configured once, and its blocking calls run on a worker thread.
+    """
+
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str, folder: str = 'NotesApp'):
+        self.options = dict(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+        self.folder = folder
+        self._configured = False
+
+    def _upload(self, data: bytes, public_id: str) -> str:
+        import cloudinary
+        import cloudinary.uploader
+
+        if not self._configured:
+            cloudinary.config(**self.options)
+            self._configured = True
+        r = cloudinary.uploader.upload(data, public_id=public_id, overwrite=True)
+        return cloudinary.CloudinaryImage(public_id).build_url(version=r.get('version'))
+
+    async def upload(self, data: bytes, username: str, digest: str) -> str:
+        return await asyncio.to_thread(self._upload, data, f'{self.folder}/{username}')
+
+
+class LocalAvatarStore(AvatarUploader):
+    """
+    Keeps avatars on the local filesystem, addressed by the sha256 of the stored bytes.
+
+    Identical avatars share one file and a stored file never changes, so it can be cached forever and
+    its digest is a strong ETag. Files are fanned out into directories named after the first two hex
+    digits and written to a temporary name first, so readers never see half a file.
+    """
+
+    def __init__(self, root: Path, base_url: str = '/api/avatars'):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+        self.uploads = 0
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / f'{digest}.png'
+
+    def _write(self, data: bytes, digest: str):
+        path = self.path(digest)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def read(self, digest: str, start: int, end: int) -> bytes:
+        """
+        The read function returns bytes start to end (inclusive) of a stored avatar through a memory map,
+            so only the requested pages are read.
+
+        :param digest: str: The avatar digest
+        :param start: int: First byte
+        :param end: int: Last byte
+        :return: The requested bytes
+        """
+        with open(self.path(digest), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end + 1]
+
+    async def upload(self, data: bytes, username: str, digest: str) -> str:
+        key = content_hash(data)
+        await asyncio.to_thread(self._write, data, key)
+        self.uploads += 1
+        return f'{self.base_url}/{key}'
+
+
+def create_avatar_uploader() -> AvatarUploader:
+    """
+    The create_avatar_uploader function builds the uploader named by settings.avatar_uploader.
+
+    :return: A CloudinaryUploader or the local avatar_store
+    """
+    if settings.avatar_uploader == 'local':
+        return avatar_store
+    return CloudinaryUploader(settings.cloudinary_name, settings.cloudinary_api_key, settings.cloudinary_api_secret)
+
+
+avatar_store = LocalAvatarStore(Path(settings.avatar_local_dir))
+avatar_uploader = create_avatar_uploader()
+
+
+def get_avatar_uploader() -> AvatarUploader:
+    return avatar_uploader
+
+
+def get_avatar_store() -> LocalAvatarStore:
+    return avatar_store
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+import redis.asyncio
+from redis.exceptions import RedisError
+
+from fast_api_app.conf.config import settings
+from fast_api_app.database.models import UserAuth
+from fast_api_app.services.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    A bounded in-process LRU cache whose entries expire after a TTL or at an absolute time.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        The get function returns the cached value for key and marks it as recently used.
+
+        :param key: Hashable: The cache key
+        :return: The value, or None if it is missing or expired
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """
+        The set function stores value under key, evicting the least recently used entry when the cache is full.
+
+        :param key: Hashable: The cache key
+        :param value: Any: The value to store
+        :param ttl: float | None: Seconds the entry stays valid, the cache default when None
+        :return: None
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the size of the cache and its hit and miss counters.
+
+        :return: A dict with size, hits and misses
+        """
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class UserCache:
+    """
+    Two-tier cache of the authenticated user behind Auth.get_current_user.
+
+    L1 is a per-worker TTLCache, L2 is Redis. Entries hold only the UserAuth columns the API reads
+    (no password hash) as JSON, keyed by the lower-cased email. Writes to users_auth call invalidate, which drops
+    the Redis key and tells every worker over pub/sub to drop its L1 entry. Without Redis the cache
+    runs on L1 only.
+    """
+
+    CHANNEL = 'user-cache:invalidate'
+    LISTEN_TIMEOUT = 5.0
+    RECONNECT_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30.0
+    FIELDS = ('id', 'username', 'email', 'avatar', 'avatar_hash', 'confirmed')
+
+    def __init__(self, maxsize: int, local_ttl: float, ttl: int):
+        self.local = TTLCache(maxsize, local_ttl)
+        self.ttl = ttl
+        self.redis: redis.asyncio.Redis | None = None
+        self._listener: asyncio.Task | None = None
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return f"user:{email}"
+
+    async def init(self, client: redis.asyncio.Redis):
+        """
+        The init function attaches the Redis client used as L2 and starts listening for invalidations.
+
+        :param client: redis.asyncio.Redis: A client created with decode_responses=True
+        :return: None
+        """
+        self.redis = client
+        self._listener = asyncio.create_task(self._listen(await self._subscribe()))
+
+    async def _subscribe(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(self.CHANNEL)
+        except BaseException:
+            await pubsub.close()
+            raise
+        return pubsub
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        self.redis = None
+        self.local.clear()
+
+    async def _listen(self, pubsub):
+        """
+        The _listen function applies invalidations from other workers until the cache is closed.
+            When the subscription breaks it is opened again, waiting longer after each failed attempt.
+            Invalidations published in between were missed, so L1 is emptied once it is back.
+
+        :param pubsub: PubSub: The subscription made by init
+        :return: None
+        """
+        delay = self.RECONNECT_DELAY
+        try:
+            while True:
+                try:
+                    if pubsub is None:
+                        pubsub = await self._subscribe()
+                        self.local.clear()
+                        logger.info("user cache invalidations resubscribed")
+                        delay = self.RECONNECT_DELAY
+                    # get_message with its own timeout: pubsub.listen() would read with the pool's socket_timeout
+                    # and die with TimeoutError after the first quiet second
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=self.LISTEN_TIMEOUT)
+                    if message is not None and message["type"] == "message":
+                        self.local.pop(message["data"])
+                except Exception as e:
+                    logger.warning("user cache invalidations lost, resubscribing in %.1f s: %r", delay, e)
+                    if pubsub is not None:
+                        await self._close_quietly(pubsub)
+                        pubsub = None
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+        finally:
+            if pubsub is not None:
+                await self._close_quietly(pubsub)
+
+    @staticmethod
+    async def _close_quietly(pubsub):
+        try:
+            await pubsub.close()
+        except Exception:
+            pass
+
+    def dumps(self, user: UserAuth) -> str:
+        return json.dumps({field: getattr(user, field) for field in self.FIELDS})
+
+    def loads(self, data: str) -> UserAuth:
+        return UserAuth(**json.loads(data))
+
+    async def get(self, email: str) -> UserAuth | None:
+        """
+        The get function looks the user up in L1, then in Redis, refilling L1 on a Redis hit.
+
+        :param email: str: The user's email
+        :return: A detached UserAuth with the cached fields, or None on a miss
+        """
+        email = email.lower()
+        data = self.local.get(email)
+        if data is None and self.redis is not None:
+            try:
+                with timed('redis'):
+                    data = await self.redis.get(self._key(email))
+            except RedisError:
+                data = None
+            if data is not None:
+                self.local.set(email, data)
+        return None if data is None else self.loads(data)
+
+    async def set(self, user: UserAuth):
+        """
+        The set function stores the user in both tiers.
+
+        :param user: UserAuth: The user loaded from the database
+        :return: None
+        """
+        data = self.dumps(user)
+        email = user.email.lower()
+        self.local.set(email, data)
+        if self.redis is not None:
+            try:
+                with timed('redis'):
+                    await self.redis.set(self._key(email), data, ex=self.ttl)
+            except RedisError:
+                pass
+
+    async def invalidate(self, email: str):
+        """
+        The invalidate function drops the user from Redis and from the L1 cache of every worker.
+
+        :param email: str: The user's email
+        :return: None
+        """
+        email = email.lower()
+        self.local.pop(email)
+        if self.redis is not None:
+            try:
+                with timed('redis'):
+                    await self.redis.delete(self._key(email))
+                    await self.redis.publish(self.CHANNEL, email)
+            except RedisError:
+                pass
+
+
+user_cache = UserCache(settings.user_cache_size, settings.user_cache_local_ttl, settings.user_cache_ttl)
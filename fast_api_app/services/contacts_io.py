@@ -0,0 +1,259 @@
+import codecs
+import csv
+import io
+import json
+from collections import deque
+from typing import AsyncIterator, Callable, List, Tuple
+
+from fastapi import UploadFile
+from pydantic import ValidationError
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from fast_api_app.conf.config import settings
+from fast_api_app.database.models import UserAuth
+from fast_api_app.repository import users as repository_users
+from fast_api_app.schemas import UserSchema
+
+READ_CHUNK_SIZE = 64 * 1024
+# Longest a quoted value may run before the record is given up on
+MAX_RECORD_LINES = 100
+EXPORT_FIELDS = ['id', 'first_name', 'last_name', 'birthday_date', 'phone_numbers', 'email', 'other_description']
+
+
+async def iter_lines(file: UploadFile, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[str]:
+    """
+    The iter_lines function reads an uploaded file chunk by chunk and yields its decoded lines,
+    so the whole upload never has to be held in memory.
+
+    :param file: UploadFile: The uploaded file
+    :param chunk_size: int: How many bytes to read at a time
+    :return: An async iterator over the lines, without line endings
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    while chunk := await file.read(chunk_size):
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail.rstrip('\r')
+
+
+def _ends_in_quotes(text: str) -> bool:
+    """
+    The _ends_in_quotes function tells whether text stops inside a quoted value, by the rules of csv's default
+    dialect: a quote only opens a value at the start of a field and a doubled quote inside one is literal,
+    so a stray quote in an unquoted field (O"Neil) does not start a multi-line value.
+
+    :param text: str: The lines of a record read so far, joined with newlines
+    :return: True when the record continues on the next line
+    """
+    inside, at_start, i = False, True, 0
+    while i < len(text):
+        char = text[i]
+        if inside:
+            if char == '"':
+                if text.startswith('"', i + 1):
+                    i += 1
+                else:
+                    inside = False
+        elif char == '"' and at_start:
+            inside = True
+        at_start = not inside and char in ',\n'
+        i += 1
+    return inside
+
+
+async def iter_csv_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, dict | Exception]]:
+    """
+    The iter_csv_records function turns CSV lines into dicts keyed by the header row.
+        A quoted value may span several lines; such a record is reported under the line it starts on.
+        A quoted value still open after MAX_RECORD_LINES lines, or at the end of the file, is reported as
+        an error on its first line and the lines after it are read again as records of their own, so one
+        bad cell costs one row.
+
+    :param lines: AsyncIterator[str]: Lines of the CSV file
+    :return: An async iterator of (line number, record or parse error) pairs
+    """
+    header = None
+    record: List[Tuple[int, str]] = []
+
+    def parse(start: int, text: str) -> Tuple[int, dict | Exception] | None:
+        nonlocal header
+        if not text.strip():
+            return None
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as err:
+            return start, err
+        if header is None:
+            header = [name.strip() for name in values]
+            return None
+        if len(values) != len(header):
+            return start, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+        return start, {name: value or None for name, value in zip(header, values)}
+
+    def feed(numbered: List[Tuple[int, str]], final: bool = False) -> List[Tuple[int, dict | Exception]]:
+        results = []
+        queue = deque(numbered)
+        while queue or (final and record):
+            if queue:
+                record.append(queue.popleft())
+                text = '\n'.join(line for _, line in record)
+                if not _ends_in_quotes(text):
+                    result = parse(record[0][0], text)
+                    record.clear()
+                    if result is not None:
+                        results.append(result)
+                    continue
+                if len(record) < MAX_RECORD_LINES:
+                    continue
+            # The quoted value never closes: report its first line and read the others again
+            results.append((record[0][0], ValueError("Unterminated quoted value")))
+            queue.extendleft(reversed(record[1:]))
+            record.clear()
+        return results
+
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not record and '"' not in line:
+            result = parse(line_no, line)
+            if result is not None:
+                yield result
+            continue
+        for result in feed([(line_no, line)]):
+            yield result
+    for result in feed([], final=True):
+        yield result
+
+
+async def iter_ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, dict | Exception]]:
+    """
+    The iter_ndjson_records function parses one JSON object per line, skipping blank lines.
+
+    :param lines: AsyncIterator[str]: Lines of the NDJSON file
+    :return: An async iterator of (line number, record or parse error) pairs
+    """
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as err:
+            yield line_no, err
+            continue
+        if not isinstance(record, dict):
+            yield line_no, ValueError("Expected a JSON object")
+            continue
+        yield line_no, record
+
+
+def _describe(err: Exception) -> str:
+    if isinstance(err, ValidationError):
+        return '; '.join(f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in err.errors())
+    return str(err)
+
+
+async def import_contacts(file: UploadFile, fmt: str, user: UserAuth, db: AsyncSession) -> dict:
+    """
+    The import_contacts function streams a CSV or NDJSON upload into the users table.
+        Rows are validated against UserSchema and inserted in batches of settings.import_batch_size.
+        Invalid rows are reported with their line number and skipped, the rest of the file is still imported.
+
+    :param file: UploadFile: The uploaded file
+    :param fmt: str: 'csv' or 'ndjson'
+    :param user: UserAuth: The user running the import
+    :param db: AsyncSession: Access the database
+    :return: A dict with the number of imported and failed rows and the first settings.import_max_errors errors
+    """
+    records = iter_csv_records if fmt == 'csv' else iter_ndjson_records
+    report = {"imported": 0, "failed": 0, "errors": []}
+
+    def fail(line_no: int, detail: str):
+        report["failed"] += 1
+        if len(report["errors"]) < settings.import_max_errors:
+            report["errors"].append({"line": line_no, "detail": detail})
+
+    async def flush(batch: List[Tuple[int, UserSchema]]):
+        failed = await repository_users.create_users_batch([body for _, body in batch], user, db)
+        report["imported"] += len(batch) - len(failed)
+        for index, detail in failed:
+            fail(batch[index][0], detail)
+
+    batch = []
+    async for line_no, record in records(iter_lines(file)):
+        if isinstance(record, Exception):
+            fail(line_no, _describe(record))
+            continue
+        try:
+            batch.append((line_no, UserSchema.model_validate(record)))
+        except ValidationError as err:
+            fail(line_no, _describe(err))
+            continue
+        if len(batch) >= settings.import_batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return report
+
+
+def _ndjson_row(row: RowMapping) -> str:
+    return json.dumps({field: row[field] for field in EXPORT_FIELDS}, default=str, ensure_ascii=False) + '\n'
+
+
+def _csv_row(row: RowMapping) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow(
+        ['' if row[field] is None else row[field] for field in EXPORT_FIELDS])
+    return buffer.getvalue()
+
+
+def _vcard_escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace(',', '\\,').replace(';', '\\;')
+
+
+def _vcard_row(row: RowMapping) -> str:
+    first_name, last_name = _vcard_escape(row['first_name']), _vcard_escape(row['last_name'])
+    lines = ['BEGIN:VCARD', 'VERSION:3.0', f'N:{last_name};{first_name};;;', f'FN:{first_name} {last_name}',
+             f'EMAIL:{_vcard_escape(row["email"])}', f'TEL:{_vcard_escape(row["phone_numbers"])}']
+    if row['birthday_date'] is not None:
+        lines.append(f'BDAY:{row["birthday_date"].isoformat()}')
+    if row['other_description']:
+        lines.append(f'NOTE:{_vcard_escape(row["other_description"])}')
+    lines.append('END:VCARD')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson', _ndjson_row),
+    'csv': ('text/csv', 'csv', _csv_row),
+    'vcard': ('text/vcard', 'vcf', _vcard_row),
+}
+
+
+async def export_contacts(rows: AsyncIterator[RowMapping], fmt: str, batch_size: int = 1000) -> AsyncIterator[bytes]:
+    """
+    The export_contacts function encodes a stream of user rows as NDJSON, CSV or vCard.
+        Output is handed out in chunks of batch_size rows to keep the number of writes to the socket low.
+
+    :param rows: AsyncIterator[RowMapping]: Rows from repository_users.stream_users
+    :param fmt: str: 'ndjson', 'csv' or 'vcard'
+    :param batch_size: int: How many rows go into one chunk
+    :return: An async iterator of encoded chunks
+    """
+    encode: Callable[[RowMapping], str] = EXPORT_FORMATS[fmt][2]
+    chunk = [','.join(EXPORT_FIELDS) + '\n'] if fmt == 'csv' else []
+    async for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= batch_size:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode()
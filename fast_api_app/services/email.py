@@ -1,56 +1,192 @@
+import asyncio
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
+from typing import List
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
-from pydantic import EmailStr
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 from fast_api_app.services.auth import auth_service
 from fast_api_app.conf.config import settings
 
 base_path = Path(__file__).resolve().parent.parent
-print(base_path)
-TEMPLATE_FOLDEr = base_path/'services'/'templates'
-
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Desired Name",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=TEMPLATE_FOLDEr,
-)
-
-
-async def send_email(email: EmailStr, username: str, host: str):
-    """
-    The send_email function sends an email to the user with a link to confirm their email address.
-        The function takes in three parameters:
-            -email: EmailStr, the user's email address.
-            -username: str, the username of the user who is registering for an account.  This will be used in a greeting message within the body of the email sent to them.
-            -host: str, this is where we are hosting our application (i.e., localhost).  This will be used as part of a URL that users can click on within their emails.
-
-    :param email: EmailStr: Specify the email address of the recipient
+TEMPLATE_FOLDER = base_path / 'services' / 'templates'
+
+
+class SMTPPool:
+    """
+    A pool of persistent SMTP connections.
+
+    Connections are opened on demand, up to size of them, and handed back after use instead of being closed,
+    so the TCP/TLS handshake and the login happen once per connection rather than once per message.
+    A connection the server dropped while idle is reopened on the next acquire.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = False, start_tls: bool = False, validate_certs: bool = True, size: int = 4,
+                 timeout: float = 30):
+        self.options = dict(hostname=hostname, port=port, username=username, password=password, use_tls=use_tls,
+                            start_tls=start_tls, validate_certs=validate_certs, timeout=timeout)
+        self.size = size
+        self._idle: List[aiosmtplib.SMTP] = []
+        self._slots: asyncio.Semaphore | None = None
+
+    async def _connect(self, smtp: aiosmtplib.SMTP | None) -> aiosmtplib.SMTP:
+        if smtp is not None and smtp.is_connected:
+            return smtp
+        smtp = aiosmtplib.SMTP(**self.options)
+        await smtp.connect()
+        return smtp
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        The connection function lends out a connected SMTP client for the duration of a with block.
+
+        :return: An async context manager yielding an aiosmtplib.SMTP
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            smtp = await self._connect(self._idle.pop() if self._idle else None)
+            try:
+                yield smtp
+            except Exception:
+                smtp.close()
+                raise
+            if smtp.is_connected:
+                self._idle.append(smtp)
+
+    async def close(self):
+        while self._idle:
+            smtp = self._idle.pop()
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+
+class MailSender:
+    """
+    Renders templated emails and delivers them over an SMTPPool.
+
+    Templates are compiled once by a Jinja2 environment that never re-reads them from disk.
+    """
+
+    def __init__(self, pool: SMTPPool, sender: str, sender_name: str | None = None,
+                 template_folder: Path = TEMPLATE_FOLDER):
+        self.pool = pool
+        self.sender = formataddr((sender_name, sender)) if sender_name else sender
+        self.templates = Environment(loader=FileSystemLoader(template_folder), autoescape=select_autoescape(),
+                                     auto_reload=False, cache_size=-1)
+
+    def build(self, recipient: str, subject: str, template_name: str, **context) -> EmailMessage:
+        """
+        The build function renders an HTML template into a ready to send message.
+
+        :param recipient: str: The address to send to
+        :param subject: str: The subject line
+        :param template_name: str: File name of the template in the template folder
+        :param context: The template variables
+        :return: The message
+        """
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(self.templates.get_template(template_name).render(**context), subtype="html")
+        return message
+
+    async def send(self, message: EmailMessage):
+        """
+        The send function delivers one message on a pooled connection, reconnecting once if the server
+        had closed it.
+
+        :param message: EmailMessage: The message to send
+        :return: None
+        """
+        try:
+            async with self.pool.connection() as smtp:
+                await smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            async with self.pool.connection() as smtp:
+                await smtp.send_message(message)
+
+    async def send_many(self, messages: List[EmailMessage]) -> List[Exception | None]:
+        """
+        The send_many function delivers a batch of messages, spreading it over the pool's connections
+        and sending many messages back to back on each of them.
+
+        :param messages: List[EmailMessage]: The messages to send
+        :return: For every message, None when it was sent or the exception that stopped it
+        """
+        results: List[Exception | None] = [None] * len(messages)
+        lanes = max(1, min(self.pool.size, len(messages)))
+
+        async def deliver(lane: int):
+            for index in range(lane, len(messages), lanes):
+                try:
+                    await self.send(messages[index])
+                except (aiosmtplib.SMTPException, OSError) as err:
+                    results[index] = err
+
+        await asyncio.gather(*(deliver(lane) for lane in range(lanes)))
+        return results
+
+    async def close(self):
+        await self.pool.close()
+
+
+def create_mail_sender() -> MailSender:
+    """
+    The create_mail_sender function builds the MailSender for the SMTP server in the settings.
+
+    :return: A MailSender with its own connection pool
+    """
+    pool = SMTPPool(settings.mail_server, settings.mail_port,
+                    username=settings.mail_username if settings.mail_use_credentials else None,
+                    password=settings.mail_password if settings.mail_use_credentials else None,
+                    use_tls=settings.mail_ssl_tls, start_tls=settings.mail_starttls,
+                    validate_certs=settings.mail_validate_certs, size=settings.mail_pool_size,
+                    timeout=settings.mail_timeout)
+    return MailSender(pool, settings.mail_from, settings.mail_from_name)
+
+
+_mail_sender: MailSender | None = None
+
+
+def get_mail_sender() -> MailSender:
+    """
+    The get_mail_sender function returns the shared MailSender, creating it on first use.
+        Only processes that send mail (the outbox worker) ever build it.
+
+    :return: The shared MailSender
+    """
+    global _mail_sender
+    if _mail_sender is None:
+        _mail_sender = create_mail_sender()
+    return _mail_sender
+
+
+async def close_mail_sender():
+    global _mail_sender
+    if _mail_sender is not None:
+        await _mail_sender.close()
+        _mail_sender = None
+
+
+def build_confirmation_email(email: str, username: str, host: str) -> EmailMessage:
+    """
+    The build_confirmation_email function renders the email with the link that confirms the user's address.
+
+    :param email: str: The recipient
     :param username: str: Display the username in the email
-    :param host: str: Pass in the host name of the server
-    :return: A coroutine object, which is a special type of object that can be used with the asyncio module
-    :doc-author: Trelent
-    """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    :param host: str: Base URL of the API, used in the confirmation link
+    :return: The message, ready for the mail sender
+    """
+    token_verification = auth_service.create_email_token({"sub": email})
+    return get_mail_sender().build(email, "Confirm your email ", "email_template.html",
+                             host=host, username=username, token=token_verification)
+
@@ -0,0 +1,290 @@
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Tuple
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fast_api_app.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('db', 'redis', 'hash', 'jwt', 'serialize')
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 1000, 10000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RequestTimings:
+    """
+    Time spent in each phase while one request is handled, and the SQL it ran.
+
+    statements counts executions per statement text. Parameters are bound separately, so the same
+    query run for different ids counts as the same statement.
+    """
+
+    def __init__(self, request: str = ''):
+        self.request = request
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.queries = 0
+        self.rows = 0
+        self.statements: Counter[str] = Counter()
+
+    def repeated_statements(self, threshold: int) -> list[tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statements.items() if count > threshold]
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar('request_timings', default=None)
+
+
+def current_timings() -> RequestTimings | None:
+    return _current.get()
+
+
+def record(phase: str, seconds: float):
+    """
+    The record function adds seconds to a phase of the request being handled. Outside of a request it does nothing.
+
+    :param phase: str: One of PHASES
+    :param seconds: float: Time spent
+    :return: None
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.phases[phase] += seconds
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    The timed function measures the body of a with block, awaits included, as part of phase.
+
+    :param phase: str: One of PHASES
+    :return: A context manager
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one series per label set.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}'
+            yield f'{self.name}_sum{_labels(labels)} {total}'
+            yield f'{self.name}_count{_labels(labels)} {cumulative}'
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Registry:
+    """
+    The metrics the /metrics endpoint exposes.
+
+    Histograms are updated as requests finish. Collectors are called at scrape time and return the
+    current value of a gauge or counter kept elsewhere, e.g. cache hit counters.
+    """
+
+    def __init__(self):
+        self.requests = Histogram('http_request_duration_seconds', 'Time to handle a request, by route.')
+        self.phases = Histogram('http_request_phase_seconds', 'Time a request spent in each phase, by route.')
+        self.queries = Histogram('http_request_db_queries', 'SQL statements a request ran, by route.', COUNT_BUCKETS)
+        self.rows = Histogram('http_request_db_rows', 'Rows the SQL statements of a request returned or changed, '
+                              'best effort: see _row_count.', COUNT_BUCKETS)
+        self.repeated = Counter()
+        self._collectors: list[tuple[str, str, str, Callable[[], Dict[Labels, float]]]] = []
+
+    def add_collector(self, name: str, kind: str, help_text: str, collect: Callable[[], Dict[Labels, float]]):
+        """
+        The add_collector function registers a metric whose samples are read when /metrics is scraped.
+
+        :param name: str: Metric name
+        :param kind: str: 'gauge' or 'counter'
+        :param help_text: str: The HELP line
+        :param collect: Callable: Returns the current value for every label set
+        :return: None
+        """
+        self._collectors.append((name, kind, help_text, collect))
+
+    def observe(self, route: str, method: str, status_code: int, timings: RequestTimings, seconds: float):
+        self.requests.observe((('method', method), ('route', route), ('status', str(status_code))), seconds)
+        for phase, spent in timings.phases.items():
+            self.phases.observe((('route', route), ('phase', phase)), spent)
+        self.queries.observe((('route', route),), timings.queries)
+        self.rows.observe((('route', route),), timings.rows)
+
+    def render(self) -> str:
+        lines = [*self.requests.render(), *self.phases.render(), *self.queries.render(), *self.rows.render(),
+                 '# HELP http_requests_repeated_statements_total Requests that ran one statement more than '
+                 'settings.n_plus_one_threshold times.',
+                 '# TYPE http_requests_repeated_statements_total counter']
+        lines += [f'http_requests_repeated_statements_total{_labels((("route", route),))} {count}'
+                  for route, count in self.repeated.items()]
+        for name, kind, help_text, collect in self._collectors:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(labels)} {value}' for labels, value in collect().items()]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def server_timing(timings: RequestTimings) -> str:
+    parts = [f'{phase};dur={spent * 1000:.2f}' + (f';desc="{timings.queries} queries, {timings.rows} rows"'
+                                                  if phase == 'db' else '')
+             for phase, spent in timings.phases.items()]
+    parts.append(f'total;dur={(time.perf_counter() - timings.started) * 1000:.2f}')
+    return ', '.join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times every HTTP request.
+
+    Phase timings recorded while the request runs are sent back in a Server-Timing header (the total is
+    the time until the response headers) and, with the full latency, added to the registry under the
+    route's path template, so /api/users/1 and /api/users/2 share a series.
+    """
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings(f'{scope["method"]} {scope["path"]}')
+        token = _current.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path_format", None) or "unmatched"
+            self.registry.observe(route, scope["method"], status_code, timings, time.perf_counter() - timings.started)
+            repeated = timings.repeated_statements(settings.n_plus_one_threshold)
+            if repeated:
+                self.registry.repeated[route] += 1
+                for statement, count in repeated:
+                    logger.warning("%s ran the same statement %d times, possible N+1: %s",
+                                   timings.request, count, _shorten(statement))
+
+
+def _shorten(text: str, limit: int = 1000) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _row_count(cursor) -> int:
+    """
+    The _row_count function tells how many rows a statement returned or changed, as far as the cursor knows
+    right after execution. It is best effort, and http_request_db_rows is only as good as it is:
+        - DML: the driver's rowcount, exact on every driver.
+        - SELECT: SQLAlchemy's asyncpg and aiosqlite adapters buffer the whole result in the private _rows
+          list, which is read here; drivers that report SELECT rows in rowcount (psycopg2) are counted from it.
+          Server-side cursors, and any driver or SQLAlchemy version without either, count as 0.
+
+    :param cursor: The DBAPI cursor the statement ran on
+    :return: The number of rows, 0 when it cannot be known yet
+    """
+    if cursor.description is not None:
+        rows = getattr(cursor, '_rows', None)
+        if rows is not None:
+            return len(rows)
+    return max(cursor.rowcount, 0)
+
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    The instrument_engine function accounts for every statement engine runs in the request that ran it:
+        its time goes to the db phase, and the query count, the row count (best effort, see _row_count) and the
+        per-statement execution counts of the request are updated. Statements slower than settings.slow_query_threshold
+        seconds are logged with their parameters and the request that issued them.
+
+    :param engine: AsyncEngine: The engine to watch
+    :return: None
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        timings = _current.get()
+        if timings is not None:
+            timings.phases['db'] += elapsed
+            timings.queries += 1
+            timings.rows += _row_count(cursor)
+            timings.statements[statement] += 1
+        if elapsed >= settings.slow_query_threshold:
+            logger.warning("slow query, %.1f ms in %s: %s parameters=%s", elapsed * 1000,
+                           timings.request if timings is not None else 'no request', _shorten(statement),
+                           _shorten(repr(parameters)) if settings.slow_query_log_parameters else '<hidden>')
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+
+class TimedJSONResponse(JSONResponse):
+
+    def render(self, content) -> bytes:
+        with timed('serialize'):
+            return super().render(content)
+
+
+class TimedORJSONResponse(ORJSONResponse):
+
+    def render(self, content) -> bytes:
+        with timed('serialize'):
+            return super().render(content)
@@ -0,0 +1,88 @@
+import json
+import time
+
+from redis.exceptions import WatchError
+
+from fast_api_app.conf.config import settings
+from fast_api_app.services.metrics import timed
+from fast_api_app.services.redis_client import get_redis
+
+
+class EmailOutbox:
+    """
+    A durable queue of confirmation emails kept in a Redis stream.
+
+    The API only appends to the stream (one XADD); delivery happens in the separate worker process
+    (fast_api_app.worker), which reads the stream through a consumer group so a message is only
+    acknowledged once it was sent. Failed deliveries wait in a sorted set scored by their next attempt
+    time, and deliveries that keep failing end up in a dead-letter stream.
+    """
+
+    STREAM = 'email:outbox'
+    GROUP = 'email-workers'
+    RETRY = 'email:outbox:retry'
+    DEAD = 'email:outbox:dead'
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def redis(self):
+        client = self._client or get_redis()
+        if client is None:
+            raise RuntimeError("Redis is not initialised")
+        return client
+
+    async def enqueue(self, email: str, username: str, host: str) -> str:
+        """
+        The enqueue function appends a confirmation email to the outbox.
+
+        :param email: str: The recipient
+        :param username: str: The name used in the greeting
+        :param host: str: Base URL of the API, used in the confirmation link
+        :return: The stream entry id
+        """
+        fields = {"email": email, "username": username, "host": host, "attempts": 0}
+        with timed('redis'):
+            return await self.redis.xadd(self.STREAM, fields, maxlen=settings.outbox_maxlen, approximate=True)
+
+    async def retry_later(self, fields: dict, delay: float):
+        """
+        The retry_later function schedules another delivery attempt delay seconds from now.
+
+        :param fields: dict: The entry fields, with attempts already increased
+        :param delay: float: Seconds to wait before the next attempt
+        :return: None
+        """
+        await self.redis.zadd(self.RETRY, {json.dumps(fields, sort_keys=True): time.time() + delay})
+
+    async def promote_due(self, limit: int = 100) -> int:
+        """
+        The promote_due function moves retries whose time has come back onto the stream.
+            The ZREM and the XADDs run in one MULTI, so a crash cannot drop an entry between them. The retry set
+            is WATCHed: if another worker changes it first the move is abandoned and left for the next poll,
+            so several workers can run this at once without adding an entry twice.
+
+        :param limit: int: Maximum number of entries to move
+        :return: How many entries were moved
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.RETRY)
+                due = await pipe.zrangebyscore(self.RETRY, '-inf', time.time(), start=0, num=limit)
+                if not due:
+                    return 0
+                pipe.multi()
+                pipe.zrem(self.RETRY, *due)
+                for member in due:
+                    pipe.xadd(self.STREAM, json.loads(member), maxlen=settings.outbox_maxlen, approximate=True)
+                await pipe.execute()
+            except WatchError:
+                return 0
+        return len(due)
+
+    async def bury(self, fields: dict, error: str):
+        await self.redis.xadd(self.DEAD, {**fields, "error": error}, maxlen=settings.outbox_maxlen, approximate=True)
+
+
+email_outbox = EmailOutbox()
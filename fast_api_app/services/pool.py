@@ -0,0 +1,56 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+
+class BoundedPool:
+    """
+    Runs CPU-bound functions off the event loop on a process pool with a cap on concurrent jobs.
+
+    At most max_concurrency jobs are handed to the executor at once. A caller that cannot get a slot
+    within queue_timeout seconds gets a 503 instead of piling up behind the others. With
+    max_workers=0 jobs run on the default thread pool instead of separate processes.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_concurrency: int, queue_timeout: float):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._executor: Executor | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    def _get_executor(self) -> Executor | None:
+        if self._executor is None and self.max_workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        The run function calls fn(*args) on the pool and waits for the result without blocking the event loop.
+            fn and its arguments must be picklable, so fn has to be a module-level function.
+
+        :param fn: Callable: The function to run
+        :param args: The positional arguments for fn
+        :return: What fn returned
+        :raises HTTPException: 503 when no slot frees up within queue_timeout
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Server is busy, try again later", headers={"Retry-After": "1"})
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._slots = None
@@ -0,0 +1,160 @@
+import asyncio
+import math
+import time
+
+from fastapi import Depends, HTTPException, Request, status
+from redis.exceptions import RedisError
+
+from fast_api_app.conf.config import settings
+from fast_api_app.database.models import UserAuth
+from fast_api_app.services.auth import auth_service
+from fast_api_app.services.cache import TTLCache
+from fast_api_app.services.metrics import timed
+from fast_api_app.services.redis_client import get_redis
+
+
+class TokenBucket:
+    """
+    An in-process token bucket: refills at rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens: float = 1) -> float:
+        """
+        The take function removes tokens from the bucket if there are enough of them.
+
+        :param tokens: float: How many tokens to take
+        :return: 0 when the tokens were taken, otherwise how many seconds to wait until they are available
+        """
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1):
+        """
+        The acquire function waits until tokens can be taken from the bucket and takes them.
+
+        :param tokens: float: How many tokens to take
+        :return: None
+        """
+        while (wait := self.take(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+
+def parse_rate(spec: str) -> tuple[int, int]:
+    """
+    The parse_rate function reads a limit written as "times/seconds", e.g. "10/60".
+
+    :param spec: str: The limit
+    :return: (times, seconds)
+    """
+    times, seconds = spec.split('/')
+    return int(times), int(seconds)
+
+
+class HybridRateLimiter:
+    """
+    Allows times hits per key in every fixed window of seconds, across all workers.
+
+    The shared count lives in Redis, but a worker does not ask Redis on every hit: it leases a batch of
+    tokens with one INCRBY and spends them locally, so most checks never leave the process. A lease is
+    at most a tenth of the limit, so one worker cannot take a whole window's budget. Tokens a worker
+    leased but did not spend expire with the window, which can only make the limit stricter. Once
+    Redis reports the window spent the worker remembers it and rejects without asking again.
+    Without Redis, or when it fails, each worker falls back to its own token bucket.
+
+    Limits below 20 per window lease one token at a time, which is a plain counter: one atomic INCRBY
+    and EXPIRE per allowed hit. That is deliberate. Larger leases would let a single worker hold most of
+    a small budget while the others reject, and a small budget means few calls anyway: at most times + 1
+    round trips per key and window, after which rejections are answered locally. The shipped tiers are
+    all this small; leasing pays off for limits in the hundreds.
+    """
+
+    def __init__(self, name: str, times: int, seconds: int, batch: int = settings.rate_limit_batch,
+                 client=None, maxsize: int = settings.rate_limit_cache_size):
+        self.name = name
+        self.times = times
+        self.seconds = seconds
+        self.batch = max(1, min(batch, times // 10))
+        self._client = client
+        self._leases = TTLCache(maxsize, seconds)
+        self._buckets = TTLCache(maxsize, seconds)
+
+    def _local(self, key: str) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.times / self.seconds, self.times)
+        self._buckets.set(key, bucket)
+        return bucket.take()
+
+    async def hit(self, key: str) -> float:
+        """
+        The hit function counts one request for key.
+
+        :param key: str: Who is being limited, e.g. a user id
+        :return: 0 when the request is allowed, otherwise how many seconds until it would be
+        """
+        now = time.time()
+        window = int(now // self.seconds)
+        retry_after = (window + 1) * self.seconds - now
+        lease = self._leases.get(key)
+        if lease is None or lease[0] != window:
+            lease = [window, 0, False]
+            self._leases.set(key, lease, retry_after)
+        if lease[1] > 0:
+            lease[1] -= 1
+            return 0
+        if lease[2]:
+            return retry_after
+
+        client = self._client or get_redis()
+        if client is None:
+            return self._local(key)
+        counter = f'ratelimit:{self.name}:{key}:{window}'
+        try:
+            with timed('redis'):
+                async with client.pipeline(transaction=True) as pipe:
+                    total, _ = await pipe.incrby(counter, self.batch).expire(counter, self.seconds + 1).execute()
+        except RedisError:
+            return self._local(key)
+        granted = max(0, min(self.batch, self.times - (total - self.batch)))
+        if granted == 0:
+            lease[2] = True
+            return retry_after
+        lease[1] = granted - 1
+        return 0
+
+
+rate_limiters = {tier: HybridRateLimiter(tier, *parse_rate(spec)) for tier, spec in settings.rate_limit_tiers.items()}
+
+
+class RateLimit:
+    """
+    A route dependency that limits the authenticated user with the limiter of a tier from settings.rate_limit_tiers.
+
+    Every route has a budget of its own: the key is the user plus the method and path template of the route,
+    so /api/users/1 and /api/users/2 share one budget but GET and DELETE on them do not.
+    """
+
+    def __init__(self, tier: str):
+        self.limiter = rate_limiters[tier]
+
+    async def __call__(self, request: Request, current_user: UserAuth = Depends(auth_service.get_current_user)):
+        route = request.scope.get('route')
+        path = route.path_format if route is not None else request.url.path
+        wait = await self.limiter.hit(f"{current_user.id}:{request.method}:{path}")
+        if wait > 0:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests",
+                                headers={"Retry-After": str(math.ceil(wait))})
@@ -0,0 +1,63 @@
+import redis.asyncio
+
+from fast_api_app.conf.config import settings
+
+_client: redis.asyncio.Redis | None = None
+
+
+def create_redis() -> redis.asyncio.Redis:
+    """
+    The create_redis function builds an async Redis client on a bounded connection pool configured from settings.
+        When every connection is busy, callers wait up to settings.redis_pool_timeout for one to free up
+        instead of opening new ones.
+
+    :return: A redis.asyncio.Redis client that decodes responses to str
+    """
+    pool = redis.asyncio.BlockingConnectionPool(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        db=settings.redis_db,
+        password=settings.redis_password,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_connect_timeout,
+        health_check_interval=settings.redis_health_check_interval,
+        encoding="utf-8",
+        decode_responses=True,
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+async def init_redis(client: redis.asyncio.Redis | None = None) -> redis.asyncio.Redis:
+    """
+    The init_redis function creates the application-wide Redis client. It is called once from the lifespan handler.
+
+    :param client: redis.asyncio.Redis | None: Use this client instead of creating one, e.g. a fakeredis client
+    :return: The shared client
+    """
+    global _client
+    if _client is None:
+        _client = client or create_redis()
+    return _client
+
+
+def get_redis() -> redis.asyncio.Redis | None:
+    """
+    The get_redis function returns the shared Redis client.
+
+    :return: The client, or None outside of the application lifespan
+    """
+    return _client
+
+
+async def close_redis():
+    """
+    The close_redis function closes the shared client and disconnects its pool.
+
+    :return: None
+    """
+    global _client
+    if _client is not None:
+        await _client.close(close_connection_pool=True)
+        _client = None
@@ -0,0 +1,140 @@
+import logging
+import secrets
+
+import redis.asyncio
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from fast_api_app.conf.config import settings
+from fast_api_app.services.cache import TTLCache
+from fast_api_app.services.metrics import timed
+from fast_api_app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Login sessions kept in Redis, so logins and refreshes do not write to the database.
+
+    A login starts a family (fid) and issues its first refresh token (jti). Each refresh consumes the presented
+    jti and issues a new one in the same family. A consumed jti that is presented again means the token was
+    copied, so the whole family is revoked. Access tokens carry the fid as well and stop working once their
+    family is gone.
+
+    Keys, all expiring with the refresh token lifetime:
+        session:family:{fid} -> email, pushed back on every rotation
+        session:token:{jti} -> fid, the refresh token that may be used next
+        session:used:{jti} -> fid, refresh tokens already rotated, kept for reuse detection
+    """
+
+    def __init__(self, client: redis.asyncio.Redis | None = None, ttl: int = settings.refresh_token_ttl,
+                 local_ttl: float = settings.session_local_ttl):
+        self._client = client
+        self.ttl = ttl
+        self.active = TTLCache(settings.session_cache_size, local_ttl)
+
+    @property
+    def redis(self) -> redis.asyncio.Redis:
+        client = self._client or get_redis()
+        if client is None:
+            raise RuntimeError("Redis is not initialised")
+        return client
+
+    @staticmethod
+    def _unavailable(e: RedisError) -> HTTPException:
+        logger.warning("session store unavailable: %s", e)
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Session store unavailable")
+
+    async def start(self, email: str) -> tuple[str, str]:
+        """
+        The start function opens a new session family for a login.
+
+        :param email: str: The user who logged in
+        :return: The family id and the id of its first refresh token
+        """
+        fid, jti = secrets.token_hex(16), secrets.token_hex(16)
+        try:
+            with timed('redis'):
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.set(f"session:family:{fid}", email, ex=self.ttl)
+                    pipe.set(f"session:token:{jti}", fid, ex=self.ttl)
+                    await pipe.execute()
+        except RedisError as e:
+            raise self._unavailable(e)
+        return fid, jti
+
+    async def rotate(self, fid: str, jti: str) -> str | None:
+        """
+        The rotate function exchanges a refresh token for the next one of its family.
+            The token is consumed and marked used in one transaction: GETDEL hands it to exactly one caller and
+            SET ... GET tells every later caller, however close behind, that it was already used, so of two
+            requests with the same token the second revokes the family.
+
+        :param fid: str: The fid claim of the refresh token
+        :param jti: str: The jti claim of the refresh token
+        :return: The id of the new refresh token, or None if the token is unknown, reused or revoked
+        """
+        try:
+            with timed('redis'):
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.getdel(f"session:token:{jti}")
+                    pipe.set(f"session:used:{jti}", fid, ex=self.ttl, get=True)
+                    pipe.exists(f"session:family:{fid}")
+                    stored, reused, alive = await pipe.execute()
+                if reused is not None:
+                    await self.revoke(fid)
+                    return None
+                if stored != fid or not alive:
+                    return None
+                new_jti = secrets.token_hex(16)
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.set(f"session:token:{new_jti}", fid, ex=self.ttl)
+                    pipe.expire(f"session:family:{fid}", self.ttl)
+                    await pipe.execute()
+        except RedisError as e:
+            raise self._unavailable(e)
+        return new_jti
+
+    async def revoke(self, fid: str):
+        """
+        The revoke function ends a session family: its refresh and access tokens stop working.
+            Other workers may keep accepting its access tokens for up to settings.session_local_ttl seconds.
+
+        :param fid: str: The family id
+        :return: None
+        """
+        self.active.pop(fid)
+        try:
+            with timed('redis'):
+                await self.redis.delete(f"session:family:{fid}")
+        except RedisError as e:
+            raise self._unavailable(e)
+
+    async def is_active(self, fid: str) -> bool:
+        """
+        The is_active function tells whether the family an access token belongs to is still open.
+            Open families are remembered in-process for settings.session_local_ttl seconds. If Redis cannot be
+            reached the token is accepted, as it is signed and short-lived anyway.
+
+        :param fid: str: The fid claim of the access token
+        :return: False once the family was revoked or has expired
+        """
+        if self.active.get(fid):
+            return True
+        try:
+            with timed('redis'):
+                alive = await self.redis.exists(f"session:family:{fid}")
+        except RedisError as e:
+            logger.warning("session store unavailable, accepting access token: %s", e)
+            return True
+        if alive:
+            self.active.set(fid, True)
+        return bool(alive)
+
+
+session_store = SessionStore()
+
+
+def get_session_store() -> SessionStore:
+    return session_store
@@ -0,0 +1,181 @@
+"""
+Standalone email worker that drains the outbox the API appends to.
+
+Run one or more of them next to the API:
+
+    python -m fast_api_app.worker --concurrency 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+import aiosmtplib
+from redis.exceptions import RedisError, ResponseError
+
+from fast_api_app.conf.config import settings
+from fast_api_app.services.email import MailSender, build_confirmation_email, close_mail_sender, get_mail_sender
+from fast_api_app.services.outbox import EmailOutbox
+from fast_api_app.services.ratelimit import TokenBucket
+from fast_api_app.services.redis_client import init_redis, close_redis
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """
+    Reads the outbox stream through its consumer group and sends up to concurrency emails at once.
+
+    Each recipient domain has its own token bucket, so one slow or strict provider does not get flooded.
+    A failed delivery is retried with exponential backoff (base * 2 ** attempt, capped) and is moved to the
+    dead-letter stream after max_attempts. Entries another consumer read but never acknowledged are
+    claimed after claim_idle seconds, so a crashed worker does not lose mail. When Redis fails the worker
+    logs it and polls again with exponential backoff instead of exiting.
+    """
+    RETRY_DELAY = 0.5
+    RETRY_MAX_DELAY = 30.0
+
+    def __init__(self, outbox: EmailOutbox, sender: MailSender, consumer: str,
+                 concurrency: int = settings.outbox_concurrency):
+        self.outbox = outbox
+        self.sender = sender
+        self.consumer = consumer
+        self.concurrency = concurrency
+        self.domains: dict[str, TokenBucket] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    async def setup(self):
+        try:
+            await self.outbox.redis.xgroup_create(self.outbox.STREAM, self.outbox.GROUP, id='0', mkstream=True)
+        except ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+    def _bucket(self, email: str) -> TokenBucket:
+        domain = email.rsplit('@', 1)[-1].lower()
+        if domain not in self.domains:
+            self.domains[domain] = TokenBucket(settings.outbox_domain_rate, settings.outbox_domain_burst)
+        return self.domains[domain]
+
+    async def deliver(self, entry_id: str, fields: dict):
+        """
+        The deliver function sends one outbox entry and acknowledges it, scheduling a retry or
+        dead-lettering it when sending fails.
+            Only SMTP and network errors are retried. Anything else (a malformed entry, a template error)
+            would fail the same way again, so the entry goes to the dead-letter stream at once, as it does
+            when its retry cannot be scheduled.
+
+        :param entry_id: str: The stream entry id
+        :param fields: dict: The entry fields
+        :return: None
+        """
+        try:
+            await self._bucket(fields["email"]).acquire()
+            await self.sender.send(build_confirmation_email(fields["email"], fields["username"], fields["host"]))
+        except Exception as err:
+            await self._failed(entry_id, fields, err)
+        await self.outbox.redis.xack(self.outbox.STREAM, self.outbox.GROUP, entry_id)
+        await self.outbox.redis.xdel(self.outbox.STREAM, entry_id)
+
+    async def _failed(self, entry_id: str, fields: dict, err: Exception):
+        attempts = int(fields.get("attempts", 0)) + 1
+        fields = {**fields, "attempts": attempts}
+        if isinstance(err, (aiosmtplib.SMTPException, OSError)) and attempts < settings.outbox_max_attempts:
+            delay = min(settings.outbox_backoff_base * 2 ** (attempts - 1), settings.outbox_backoff_max)
+            try:
+                await self.outbox.retry_later(fields, delay)
+                return
+            except RedisError as redis_err:
+                err = redis_err
+        logger.warning("outbox entry %s dead-lettered after %d attempt(s): %r", entry_id, attempts, err)
+        await self.outbox.bury(fields, repr(err))
+
+    async def _run_entry(self, entry_id: str, fields: dict):
+        try:
+            await self.deliver(entry_id, fields)
+        except Exception:
+            # Not acknowledged: the entry stays pending and is claimed again after outbox_claim_idle
+            logger.exception("outbox entry %s could not be settled", entry_id)
+        finally:
+            self._slots.release()
+
+    async def poll(self, block: int = 500) -> int:
+        """
+        The poll function promotes due retries, claims stale entries and starts delivering new ones,
+            never running more than concurrency deliveries at a time. With every slot busy it first waits
+            for a delivery to finish.
+
+        :param block: int: Milliseconds to wait for new entries, kept below the Redis socket timeout
+        :return: How many entries were started
+        """
+        if len(self._tasks) >= self.concurrency:
+            # Every slot is busy: wait for one to free up rather than asking Redis for work that cannot start
+            await asyncio.wait(set(self._tasks), return_when=asyncio.FIRST_COMPLETED)
+        await self.outbox.promote_due()
+        redis = self.outbox.redis
+        _, entries, *_ = await redis.xautoclaim(self.outbox.STREAM, self.outbox.GROUP, self.consumer,
+                                                min_idle_time=int(settings.outbox_claim_idle * 1000),
+                                                count=max(1, self.concurrency - len(self._tasks)))
+        free = self.concurrency - len(self._tasks)
+        if free > len(entries):
+            response = await redis.xreadgroup(self.outbox.GROUP, self.consumer, {self.outbox.STREAM: '>'},
+                                              count=free - len(entries), block=block)
+            for _, stream_entries in response or []:
+                entries += stream_entries
+        for entry_id, fields in entries:
+            if not fields:
+                continue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run_entry(entry_id, fields))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return len(entries)
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def run(self, stop: asyncio.Event):
+        ready = False
+        delay = self.RETRY_DELAY
+        while not stop.is_set():
+            try:
+                if not ready:
+                    await self.setup()
+                    ready = True
+                await self.poll()
+                delay = self.RETRY_DELAY
+            except RedisError as e:
+                # The group is created again in case Redis lost it along with the stream
+                ready = False
+                logger.warning("outbox poll failed, retrying in %.1f s: %r", delay, e)
+                try:
+                    await asyncio.wait_for(stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self.RETRY_MAX_DELAY)
+        await self.drain()
+
+
+async def main(concurrency: int, consumer: str):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    redis = await init_redis()
+    try:
+        await OutboxWorker(EmailOutbox(redis), get_mail_sender(), consumer, concurrency).run(stop)
+    finally:
+        await close_mail_sender()
+        await close_redis()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deliver queued emails from the outbox.')
+    parser.add_argument('--concurrency', type=int, default=settings.outbox_concurrency)
+    parser.add_argument('--consumer', default=f'{socket.gethostname()}-{os.getpid()}')
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.consumer))
@@ -1,10 +1,49 @@
-from fastapi import FastAPI
-from fastapi_limiter import FastAPILimiter
-from fast_api_app.routes import users, auth
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from fast_api_app.routes import users, auth, avatars, metrics
+from fast_api_app.conf.config import settings
+from fast_api_app.database.connect_db import create_schema, database_error_status, engine
+from fast_api_app.database.replicas import replica_engines
+from fast_api_app.services.cache import user_cache
+from fast_api_app.services.auth import hash_pool
+from fast_api_app.services.avatars import MULTIPART_OVERHEAD, UploadLimitMiddleware, image_pool
+from fast_api_app.services.redis_client import init_redis, close_redis
+from fast_api_app.services.metrics import MetricsMiddleware, TimedJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import redis.asyncio
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    The lifespan function sets up the things the app shares between requests and tears them down on shutdown.
+    A single Redis connection pool, configured from the settings, is created here and handed to the user cache;
+    the rate limiters and the email outbox pick it up through get_redis. Tables are created here only when
+    settings.create_schema_on_startup is set; with it off the schema is left to Alembic and startup never
+    runs DDL: `alembic upgrade head` builds a fresh database, and one whose tables create_all made earlier is
+    marked current once with `alembic stamp head`. Importing this module connects to nothing.
+
+    :param app: FastAPI: The application
+    :return: None
+    :doc-author: Trelent
+    """
+    if settings.create_schema_on_startup:
+        await create_schema()
+    r = await init_redis()
+    await user_cache.init(r)
+    yield
+    await user_cache.close()
+    hash_pool.shutdown()
+    image_pool.shutdown()
+    await close_redis()
+    await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
 origins = [
     "http://localhost:3000"
 ]
@@ -15,22 +54,31 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(UploadLimitMiddleware, limits={'/api/users/avatar': settings.avatar_max_bytes + MULTIPART_OVERHEAD})
+app.add_middleware(MetricsMiddleware)
 app.include_router(auth.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
+app.include_router(avatars.router, prefix='/api')
+app.include_router(metrics.router)
 
 
-@app.on_event("startup")
-async def startup():
+@app.exception_handler(DBAPIError)
+@app.exception_handler(PoolTimeoutError)
+async def database_error_handler(request: Request, exc: Exception):
     """
-    The startup function is called when the application starts up.
-    It's a good place to initialize things that are used by the app, like databases or caches.
+    The database_error_handler function answers 503 or 504 when the database timed out or is unreachable,
+    so clients and load balancers can retry. Any other database error is re-raised and ends up as a 500.
 
-    :return: A list of functions that will be called after the server starts
+    :param request: Request: The request that failed
+    :param exc: Exception: The SQLAlchemy error
+    :return: A JSON response with the status from database_error_status
     :doc-author: Trelent
     """
-    r = await redis.asyncio.Redis(host='localhost', port=6379, db=0, encoding="utf-8",
-                                  decode_responses=True)
-    await FastAPILimiter.init(r)
+    status_code = database_error_status(exc)
+    if status_code is None:
+        raise exc
+    detail = "Database timed out" if status_code == 504 else "Database unavailable"
+    return JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": "1"})
 
 
 @app.get("/")
@@ -0,0 +1,55 @@
+"""create users tables
+
+Revision ID: 0f3b9c2d1e84
+Revises: 
+Create Date: 2026-10-17 18:02:41.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0f3b9c2d1e84'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The tables as create_all first made them; the later revisions build on these. A database that was set up
+    # by create_all rather than by this history is already at head: run `alembic stamp head` on it instead
+    op.create_table('users_auth',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('username', sa.String(length=50), nullable=True),
+                    sa.Column('email', sa.String(), nullable=False),
+                    sa.Column('password', sa.String(length=255), nullable=False),
+                    sa.Column('refresh_token', sa.String(length=255), nullable=True),
+                    sa.Column('confirmed', sa.Boolean(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_users_auth_id'), 'users_auth', ['id'], unique=False)
+    op.create_index(op.f('ix_users_auth_email'), 'users_auth', ['email'], unique=False)
+    op.create_table('users',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('first_name', sa.String(length=25), nullable=False),
+                    sa.Column('last_name', sa.String(length=25), nullable=False),
+                    sa.Column('birthday_date', sa.Date(), nullable=True),
+                    sa.Column('email', sa.String(), nullable=False),
+                    sa.Column('phone_numbers', sa.String(), nullable=False),
+                    sa.Column('other_description', sa.String(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=False)
+    op.create_index(op.f('ix_users_phone_numbers'), 'users', ['phone_numbers'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_users_phone_numbers'), table_name='users')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_table('users')
+    op.drop_index(op.f('ix_users_auth_email'), table_name='users_auth')
+    op.drop_index(op.f('ix_users_auth_id'), table_name='users_auth')
+    op.drop_table('users_auth')
@@ -0,0 +1,26 @@
+"""users_auth avatar hash
+
+Revision ID: 3d8a6b2f9e14
+Revises: e81a0b6f2c57
+Create Date: 2026-10-17 12:20:41.285733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d8a6b2f9e14'
+down_revision: Union[str, None] = 'e81a0b6f2c57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users_auth', sa.Column('avatar_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users_auth', 'avatar_hash')
@@ -0,0 +1,35 @@
+"""users birthday key
+
+Revision ID: 5b2d7e0c41a9
+Revises: 37f6fb105986
+Create Date: 2026-10-17 10:12:04.518233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2d7e0c41a9'
+down_revision: Union[str, None] = '37f6fb105986'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('birthday_key', sa.Integer(), nullable=True))
+    users = sa.table('users', sa.column('birthday_date', sa.Date), sa.column('birthday_key', sa.Integer))
+    op.execute(
+        users.update()
+        .where(users.c.birthday_date.is_not(None))
+        .values(birthday_key=sa.extract('month', users.c.birthday_date) * 100
+                + sa.extract('day', users.c.birthday_date))
+    )
+    op.create_index(op.f('ix_users_birthday_key'), 'users', ['birthday_key'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_users_birthday_key'), table_name='users')
+    op.drop_column('users', 'birthday_key')
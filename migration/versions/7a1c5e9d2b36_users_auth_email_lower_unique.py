@@ -0,0 +1,29 @@
+"""users_auth email lower unique
+
+Revision ID: 7a1c5e9d2b36
+Revises: 3d8a6b2f9e14
+Create Date: 2026-10-17 13:05:12.418390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a1c5e9d2b36'
+down_revision: Union[str, None] = '3d8a6b2f9e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Fails if two accounts already differ only in the case of their email; merge them first
+    op.create_index('ix_users_auth_email_lower', 'users_auth', [sa.text('lower(email)')], unique=True)
+    op.drop_index('ix_users_auth_email', table_name='users_auth')
+
+
+def downgrade() -> None:
+    op.create_index('ix_users_auth_email', 'users_auth', ['email'])
+    op.drop_index('ix_users_auth_email_lower', table_name='users_auth')
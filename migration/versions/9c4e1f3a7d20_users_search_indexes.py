@@ -0,0 +1,31 @@
+"""users search indexes
+
+Revision ID: 9c4e1f3a7d20
+Revises: 5b2d7e0c41a9
+Create Date: 2026-10-17 11:03:41.207615
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e1f3a7d20'
+down_revision: Union[str, None] = '5b2d7e0c41a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email) text_pattern_ops')])
+    op.create_index('ix_users_name_lower', 'users',
+                    [sa.text('lower(last_name) text_pattern_ops'), sa.text('lower(first_name) text_pattern_ops')])
+    op.create_index('ix_users_first_name_lower', 'users', [sa.text('lower(first_name) text_pattern_ops')])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_first_name_lower', table_name='users')
+    op.drop_index('ix_users_name_lower', table_name='users')
+    op.drop_index('ix_users_email_lower', table_name='users')
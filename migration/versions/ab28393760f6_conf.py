@@ -1,7 +1,7 @@
 """conf
 
 Revision ID: ab28393760f6
-Revises: 
+Revises: 0f3b9c2d1e84
 Create Date: 2023-10-22 18:48:33.349104
 
 """
@@ -13,7 +13,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision: str = 'ab28393760f6'
-down_revision: Union[str, None] = None
+down_revision: Union[str, None] = '0f3b9c2d1e84'
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
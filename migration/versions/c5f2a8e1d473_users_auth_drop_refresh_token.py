@@ -0,0 +1,27 @@
+"""users_auth drop refresh token
+
+Revision ID: c5f2a8e1d473
+Revises: 7a1c5e9d2b36
+Create Date: 2026-10-17 13:48:27.904215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5f2a8e1d473'
+down_revision: Union[str, None] = '7a1c5e9d2b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Refresh tokens now live in the Redis session store; the ones stored here can no longer be used
+    op.drop_column('users_auth', 'refresh_token')
+
+
+def downgrade() -> None:
+    op.add_column('users_auth', sa.Column('refresh_token', sa.String(length=255), nullable=True))
@@ -0,0 +1,26 @@
+"""users last_name id index
+
+Revision ID: e81a0b6f2c57
+Revises: 9c4e1f3a7d20
+Create Date: 2026-10-17 11:48:19.663102
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81a0b6f2c57'
+down_revision: Union[str, None] = '9c4e1f3a7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_last_name_id', 'users', ['last_name', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_last_name_id', table_name='users')
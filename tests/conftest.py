@@ -0,0 +1,92 @@
+import os
+
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", "sqlite:///./test.db")
+os.environ.setdefault("MAIL_FROM", "noreply@example.com")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from fast_api_app.database.models import Base, UserAuth
+from fast_api_app.database.connect_db import get_db
+from fast_api_app.services.sessions import SessionStore, get_session_store
+
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# TestClient runs every request on its own event loop, so the app side must not reuse pooled connections
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture(scope="module")
+def session():
+    # Create the database
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def client(session):
+    # Dependency override
+
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    # A fresh client per request (each runs on its own event loop), all on the same fake server
+    redis_server = fakeredis.FakeServer()
+
+    def override_get_session_store():
+        return SessionStore(fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True), local_ttl=0)
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_store] = override_get_session_store
+
+    yield TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def auth_headers(client, session):
+    """
+    A factory: auth_headers(email, **fields) adds a confirmed account for email the first time it is asked for,
+    logs it in and returns the Authorization header of the new session. Extra fields go to the UserAuth row.
+    """
+    password = "123456789"
+
+    def login(email: str, **fields) -> dict:
+        if session.query(UserAuth).filter(UserAuth.email == email).first() is None:
+            session.add(UserAuth(username=email.split('@')[0], email=email, confirmed=True,
+                                 password=CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(password), **fields))
+            session.commit()
+        response = client.post("/api/auth/login", data={"username": email, "password": password})
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return login
+
+
+@pytest.fixture(scope="module")
+def user():
+    return {"username": "deadpool", "email": "deadpool@example.com", "password": "123456789"}
@@ -1,11 +1,13 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock
+
+from passlib.context import CryptContext
 
 from fast_api_app.database.models import UserAuth
 
 
 def test_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("fast_api_app.routes.auth.send_email", mock_send_email)
+    mock_enqueue = AsyncMock()
+    monkeypatch.setattr("fast_api_app.routes.auth.email_outbox.enqueue", mock_enqueue)
     response = client.post(
         "/api/auth/signup",
         json=user,
@@ -14,6 +16,7 @@ def test_create_user(client, user, monkeypatch):
     data = response.json()
     assert data["user"]["email"] == user.get("email")
     assert "id" in data["user"]
+    mock_enqueue.assert_awaited_once_with(user.get("email"), user.get("username"), "http://testserver/")
 
 
 def test_repeat_create_user(client, user):
@@ -26,6 +29,14 @@ def test_repeat_create_user(client, user):
     assert data["detail"] == "Account already exists"
 
 
+def test_repeat_create_user_other_case(client, user):
+    response = client.post(
+        "/api/auth/signup",
+        json={**user, "email": user.get("email").upper()},
+    )
+    assert response.status_code == 409, response.text
+
+
 def test_login_user_not_confirmed(client, user):
     response = client.post(
         "/api/auth/login",
@@ -49,6 +60,27 @@ def test_login_user(client, session, user):
     assert data["token_type"] == "bearer"
 
 
+def test_login_email_ignores_case(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email').upper(), "password": user.get('password')},
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_login_rehashes_outdated_password(client, session, user):
+    current_user: UserAuth = session.query(UserAuth).filter(UserAuth.email == user.get('email')).first()
+    current_user.password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=5).hash(user.get('password'))
+    session.commit()
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 200, response.text
+    session.refresh(current_user)
+    assert current_user.password.startswith("$2b$04$")
+
+
 def test_login_wrong_password(client, user):
     response = client.post(
         "/api/auth/login",
@@ -67,3 +99,46 @@ def test_login_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Invalid email"
+
+
+def test_refresh_token_rotation_and_reuse(client, user):
+    tokens = client.post("/api/auth/login",
+                         data={"username": user.get('email'), "password": user.get('password')}).json()
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    search = {"url": "/api/users/search", "params": {"first_name": "x"},
+              "headers": {"Authorization": f"Bearer {rotated['access_token']}"}}
+    assert client.get(**search).status_code == 200
+
+    # The first refresh token was used already: the whole session is revoked
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401, response.text
+    response = client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {rotated['refresh_token']}"})
+    assert response.status_code == 401, response.text
+    assert client.get(**search).status_code == 401
+
+
+def test_logout_ends_only_that_session(client, user):
+    sessions = [client.post("/api/auth/login",
+                            data={"username": user.get('email'), "password": user.get('password')}).json()
+                for _ in range(2)]
+    response = client.post("/api/auth/logout", headers={"Authorization": f"Bearer {sessions[0]['access_token']}"})
+    assert response.status_code == 204, response.text
+    for tokens, expected in zip(sessions, (401, 200)):
+        response = client.get("/api/users/search", params={"first_name": "x"},
+                              headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        assert response.status_code == expected, response.text
+    response = client.get("/api/auth/refresh_token",
+                          headers={"Authorization": f"Bearer {sessions[0]['refresh_token']}"})
+    assert response.status_code == 401, response.text
+
+
+def test_request_email_unknown_address(client, monkeypatch):
+    mock_enqueue = AsyncMock()
+    monkeypatch.setattr("fast_api_app.routes.auth.email_outbox.enqueue", mock_enqueue)
+    response = client.post("/api/auth/request_email", json={"email": "nobody@example.com"})
+    assert response.status_code == 200, response.text
+    assert response.json()["message"] == "Check your email for confirmation."
+    mock_enqueue.assert_not_awaited()
@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from fast_api_app.services.auth import Auth
+from fast_api_app.services.cache import TTLCache
+
+
+class TestDecodeAccessToken(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.auth = Auth()
+        self.auth.token_cache = TTLCache(maxsize=10, ttl=0)
+
+    async def test_repeat_token_skips_verification(self):
+        token = await self.auth.create_access_token(data={"sub": "deadpool@example.com", "fid": "family"})
+        self.assertEqual(self.auth.decode_access_token(token), ("deadpool@example.com", "family"))
+        with patch("fast_api_app.services.auth.jwt.decode") as decode:
+            self.assertEqual(self.auth.decode_access_token(token), ("deadpool@example.com", "family"))
+        decode.assert_not_called()
+        self.assertEqual(self.auth.token_cache.stats(), {"size": 1, "hits": 1, "misses": 1})
+
+    async def test_expired_token(self):
+        token = await self.auth.create_access_token(data={"sub": "deadpool@example.com", "fid": "family"},
+                                                    expires_delta=-1)
+        self.assertIsNone(self.auth.decode_access_token(token))
+        self.assertEqual(len(self.auth.token_cache), 0)
+
+    async def test_refresh_token_is_not_an_access_token(self):
+        token = await self.auth.create_refresh_token(data={"sub": "deadpool@example.com", "fid": "family",
+                                                           "jti": "token"})
+        self.assertIsNone(self.auth.decode_access_token(token))
+        self.assertIsNone(self.auth.decode_access_token("not-a-token"))
+
+    async def test_access_token_without_session(self):
+        token = await self.auth.create_access_token(data={"sub": "deadpool@example.com"})
+        self.assertIsNone(self.auth.decode_access_token(token))
+
+    async def test_decode_refresh_token(self):
+        token = await self.auth.create_refresh_token(data={"sub": "deadpool@example.com", "fid": "family",
+                                                           "jti": "token"})
+        self.assertEqual(await self.auth.decode_refresh_token(token), ("deadpool@example.com", "family", "token"))
+        for token in (await self.auth.create_refresh_token(data={"sub": "deadpool@example.com"}),
+                      await self.auth.create_access_token(data={"sub": "deadpool@example.com", "fid": "family"})):
+            with self.assertRaises(HTTPException) as error:
+                await self.auth.decode_refresh_token(token)
+            self.assertEqual(error.exception.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+from fastapi import HTTPException, Request, UploadFile
+from PIL import Image
+
+from main import app
+from fast_api_app.conf.config import settings
+from fast_api_app.services.avatars import MULTIPART_OVERHEAD, LocalAvatarStore, UploadLimitMiddleware, \
+    get_avatar_store, get_avatar_uploader, read_upload, resize_avatar
+from fast_api_app.services.pool import BoundedPool
+
+
+def make_image(width, height, fmt='JPEG'):
+    out = BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(out, format=fmt)
+    return out.getvalue()
+
+
+def test_resize_avatar_crops_to_square():
+    avatar = Image.open(BytesIO(resize_avatar(make_image(800, 400))))
+    assert avatar.format == 'PNG'
+    assert avatar.size == (250, 250)
+
+
+def test_resize_avatar_rejects_non_images():
+    with pytest.raises(ValueError):
+        resize_avatar(b'not an image')
+
+
+def test_read_upload_caps_size():
+    file = UploadFile(BytesIO(b'x' * 1000), filename='a.png')
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(read_upload(file, 999))
+    assert err.value.status_code == 413
+
+
+def test_upload_limit_counts_chunked_bodies():
+    async def endpoint(scope, receive, send):
+        await Request(scope, receive).body()
+
+    async def receive():
+        return {"type": "http.request", "body": b'x' * 60, "more_body": True}
+
+    middleware = UploadLimitMiddleware(endpoint, {'/upload': 100})
+    scope = {"type": "http", "method": "POST", "path": "/upload", "headers": []}
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(middleware(scope, receive, None))
+    assert err.value.status_code == 413
+
+
+@pytest.fixture(scope="module")
+def headers(auth_headers):
+    return auth_headers('avatar@example.com')
+
+
+@pytest.fixture()
+def uploader(tmp_path, monkeypatch):
+    monkeypatch.setattr("fast_api_app.routes.users.image_pool", BoundedPool("image", 0, 2, 5))
+    local = LocalAvatarStore(tmp_path)
+    app.dependency_overrides[get_avatar_uploader] = lambda: local
+    yield local
+    del app.dependency_overrides[get_avatar_uploader]
+
+
+def test_update_avatar_skips_same_content(client, headers, uploader):
+    files = {"file": ("me.jpg", make_image(640, 480), "image/jpeg")}
+    response = client.patch("/api/users/avatar", files=files, headers=headers)
+    assert response.status_code == 200, response.text
+    url = response.json()["avatar"]
+    assert Image.open(uploader.path(url.rsplit('/', 1)[-1])).size == (250, 250)
+
+    response = client.patch("/api/users/avatar", files=files, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"] == url
+    assert uploader.uploads == 1
+
+
+def test_update_avatar_rejects_large_body_before_parsing(client, headers, uploader, monkeypatch):
+    def unexpected(*args):
+        raise AssertionError("the form should not reach the route")
+
+    monkeypatch.setattr("fast_api_app.routes.users.read_upload", unexpected)
+    body = b'x' * (settings.avatar_max_bytes + MULTIPART_OVERHEAD + 1)
+    response = client.patch("/api/users/avatar", files={"file": ("me.jpg", body, "image/jpeg")},
+                            headers=headers)
+    assert response.status_code == 413, response.text
+    assert uploader.uploads == 0
+
+
+def test_update_avatar_rejects_invalid_image(client, headers, uploader):
+    response = client.patch("/api/users/avatar", files={"file": ("me.jpg", b"nope", "image/jpeg")},
+                            headers=headers)
+    assert response.status_code == 400, response.text
+    assert uploader.uploads == 0
+
+
+@pytest.fixture()
+def stored(client, tmp_path):
+    store = LocalAvatarStore(tmp_path)
+    app.dependency_overrides[get_avatar_store] = lambda: store
+    url = asyncio.run(store.upload(b'0123456789', 'avatar', 'digest'))
+    yield url, store
+    del app.dependency_overrides[get_avatar_store]
+
+
+def test_store_is_content_addressed(stored):
+    url, store = stored
+    assert asyncio.run(store.upload(b'0123456789', 'other', 'digest')) == url
+    assert len(list(store.root.rglob('*.png'))) == 1
+
+
+def test_read_avatar_caching_headers(client, stored):
+    url, _ = stored
+    response = client.get(url)
+    assert response.status_code == 200, response.text
+    assert response.content == b'0123456789'
+    assert response.headers["etag"] == f'"{url.rsplit("/", 1)[-1]}"'
+    assert "immutable" in response.headers["cache-control"]
+
+    response = client.get(url, headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b''
+
+
+def test_read_avatar_ranges(client, stored):
+    url, _ = stored
+    response = client.get(url, headers={"Range": "bytes=2-4"})
+    assert response.status_code == 206
+    assert response.content == b'234'
+    assert response.headers["content-range"] == "bytes 2-4/10"
+
+    response = client.get(url, headers={"Range": "bytes=-3"})
+    assert response.content == b'789'
+
+    response = client.get(url, headers={"Range": "bytes=2-4", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == b'0123456789'
+
+    response = client.get(url, headers={"Range": "bytes=20-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10"
+
+
+def test_read_avatar_missing(client, stored):
+    assert client.get('/api/avatars/' + '0' * 64).status_code == 404
+    assert client.get('/api/avatars/not-a-digest').status_code == 422
@@ -0,0 +1,27 @@
+import asyncio
+
+from benchmarks.dataset import contact, generate_contacts
+from benchmarks.endpoints import SCENARIOS, run, summarize
+
+
+def test_dataset_is_deterministic():
+    assert list(generate_contacts(3, seed=7)) == list(generate_contacts(3, seed=7))
+    assert list(generate_contacts(2, seed=7, start=1))[0] == contact(1, seed=7)
+    assert contact(0, seed=7) != contact(0, seed=8)
+
+
+def test_summarize_percentiles():
+    result = summarize([i / 1000 for i in range(1, 101)], elapsed=2, errors=1)
+    assert result["requests"] == 100
+    assert result["rps"] == 50
+    assert result["p50_ms"] == 50.5
+    assert result["p99_ms"] == 99.01
+
+
+def test_every_route_runs(tmp_path):
+    result = asyncio.run(run(50, 42, requests=2, concurrency=2,
+                             database_url=f"sqlite+aiosqlite:///{tmp_path / 'contacts.db'}"))
+    assert set(result["results"]) == {scenario.name for scenario in SCENARIOS}
+    assert {name: r["errors"] for name, r in result["results"].items() if r["errors"]} == {}
+    assert result["meta"]["seeded"] is True
+    assert result["meta"]["emails_delivered"] == 4
@@ -0,0 +1,172 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+import redis.asyncio
+
+from fast_api_app.database.models import UserAuth
+from fast_api_app.services.cache import TTLCache, UserCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        with patch("fast_api_app.services.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1, ttl=5)
+        with patch("fast_api_app.services.cache.time.monotonic", return_value=105.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = fakeredis.FakeServer()
+        self.workers = [UserCache(maxsize=10, local_ttl=60, ttl=900) for _ in range(2)]
+        for worker in self.workers:
+            await worker.init(fakeredis.FakeAsyncRedis(server=self.server, decode_responses=True))
+        self.user = UserAuth(id=1, username="deadpool", email="deadpool@example.com", password="hash",
+                             avatar="url", confirmed=True)
+
+    async def asyncTearDown(self):
+        for worker in self.workers:
+            await worker.close()
+
+    async def test_round_trip_keeps_public_fields_only(self):
+        await self.workers[0].set(self.user)
+        cached = await self.workers[1].get(self.user.email)
+        self.assertEqual((cached.id, cached.username, cached.avatar, cached.confirmed), (1, "deadpool", "url", True))
+        self.assertIsNone(cached.password)
+
+    async def test_invalidate_reaches_every_worker(self):
+        await self.workers[0].set(self.user)
+        await self.workers[1].get(self.user.email)
+        self.assertEqual(len(self.workers[1].local), 1)
+        await self.workers[0].invalidate(self.user.email)
+        for _ in range(50):
+            if not len(self.workers[1].local):
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self.workers[1].local), 0)
+        self.assertIsNone(await self.workers[1].get(self.user.email))
+
+    async def test_without_redis(self):
+        cache = UserCache(maxsize=10, local_ttl=60, ttl=900)
+        await cache.set(self.user)
+        self.assertEqual((await cache.get(self.user.email)).id, 1)
+        await cache.invalidate(self.user.email)
+        self.assertIsNone(await cache.get(self.user.email))
+
+
+
+def encode(items) -> bytes:
+    parts = [f"*{len(items)}\r\n"]
+    for item in items:
+        parts.append(f":{item}\r\n" if isinstance(item, int) else f"${len(item)}\r\n{item}\r\n")
+    return "".join(parts).encode()
+
+
+class StubRedis:
+    """
+    A Redis stand-in that confirms SUBSCRIBE and then stays silent until a test publishes or drops clients.
+    """
+
+    def __init__(self):
+        self.writers = []
+        self.subscriptions = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def _handle(self, reader, writer):
+        self.writers.append(writer)
+        try:
+            while line := await reader.readline():
+                command = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    command.append((await reader.readexactly(length + 2))[:-2].decode())
+                if command[0].upper() == "SUBSCRIBE":
+                    writer.write(encode(["subscribe", command[1], 1]))
+                    self.subscriptions += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+    def publish(self, channel: str, data: str):
+        for writer in self.writers:
+            writer.write(encode(["message", channel, data]))
+
+    def drop_clients(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+
+    async def stop(self):
+        self.drop_clients()
+        self.server.close()
+
+
+class TestUserCacheListener(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.stub = await StubRedis().start()
+        # The shared pool's short socket_timeout must not end a subscription that is just quiet
+        self.client = redis.asyncio.Redis(port=self.stub.port, socket_timeout=0.1, decode_responses=True)
+        self.cache = UserCache(maxsize=10, local_ttl=60, ttl=900)
+        self.cache.LISTEN_TIMEOUT = 0.05
+        await self.cache.init(self.client)
+
+    async def asyncTearDown(self):
+        await self.cache.close()
+        await self.stub.stop()
+        await self.client.close(close_connection_pool=True)
+
+    async def invalidated(self, email: str) -> bool:
+        self.cache.local.set(email, "{}")
+        self.stub.publish(UserCache.CHANNEL, email)
+        for _ in range(50):
+            if self.cache.local.get(email) is None:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    async def test_survives_quiet_subscription(self):
+        await asyncio.sleep(0.5)
+        self.assertFalse(self.cache._listener.done())
+        self.assertTrue(await self.invalidated("deadpool@example.com"))
+
+    async def test_resubscribes_after_connection_is_closed(self):
+        self.cache.RECONNECT_DELAY = 0.01
+        self.cache.local.set("stale@example.com", "{}")
+        with self.assertLogs("fast_api_app.services.cache", "WARNING"):
+            self.stub.drop_clients()
+            for _ in range(100):
+                if self.stub.subscriptions == 2:
+                    break
+                await asyncio.sleep(0.01)
+        self.assertEqual(self.stub.subscriptions, 2)
+        self.assertFalse(self.cache._listener.done())
+        # Whatever was published while the subscription was down is gone, so L1 starts over
+        for _ in range(50):
+            if not len(self.cache.local):
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self.cache.local), 0)
+        self.assertTrue(await self.invalidated("deadpool@example.com"))
+
+
+if __name__ == '__main__':
+    unittest.main()
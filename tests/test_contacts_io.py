@@ -0,0 +1,126 @@
+import io
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from fastapi import UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from fast_api_app.database.models import Base, User, birthday_key
+from fast_api_app.repository.users import stream_users
+from fast_api_app.services.contacts_io import iter_lines, iter_csv_records, import_contacts, export_contacts
+
+
+def upload(content: str) -> UploadFile:
+    return UploadFile(file=io.BytesIO(content.encode()), filename="contacts")
+
+
+class TestReaders(unittest.IsolatedAsyncioTestCase):
+
+    async def test_iter_lines_across_chunks(self):
+        lines = [line async for line in iter_lines(upload("first\r\nsecond\nthird"), chunk_size=4)]
+        self.assertEqual(lines, ["first", "second", "third"])
+
+    async def test_csv_multiline_value(self):
+        content = 'first_name,other_description\nJohn,"two\nlines"\nJane,\n'
+        records = [record async for record in iter_csv_records(iter_lines(upload(content)))]
+        self.assertEqual(records, [(2, {"first_name": "John", "other_description": "two\nlines"}),
+                                   (4, {"first_name": "Jane", "other_description": None})])
+
+    async def test_csv_stray_quote(self):
+        content = 'first_name,last_name\nAnn,O"Neil\nBob,Smith\nCid,Lee\n'
+        records = [record async for record in iter_csv_records(iter_lines(upload(content)))]
+        self.assertEqual(records, [(2, {"first_name": "Ann", "last_name": 'O"Neil'}),
+                                   (3, {"first_name": "Bob", "last_name": "Smith"}),
+                                   (4, {"first_name": "Cid", "last_name": "Lee"})])
+
+    async def test_csv_unterminated_value_costs_one_row(self):
+        content = 'first_name,last_name\nAnn,"Neil\nBob,Smith\nCid,Lee\nDan,Roe\n'
+        with patch("fast_api_app.services.contacts_io.MAX_RECORD_LINES", 2):
+            records = [record async for record in iter_csv_records(iter_lines(upload(content)))]
+        self.assertIsInstance(records[0][1], ValueError)
+        self.assertEqual(records[0][0], 2)
+        self.assertEqual([line for line, _ in records[1:]], [3, 4, 5])
+
+
+class TestImportContacts(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def test_import_csv(self):
+        content = ("first_name,last_name,birthday_date,phone_numbers,email,other_description\n"
+                   "John,Doe,1990-12-30,0501234567,john@example.com,\n"
+                   "Jane,Doe,not-a-date,0501234567,jane@example.com,\n"
+                   "Ann,Lee,1980-03-01,0501234567,ann@example.com,friend\n")
+        with patch("fast_api_app.services.contacts_io.settings.import_batch_size", 1):
+            report = await import_contacts(upload(content), "csv", None, self.session)
+        self.assertEqual((report["imported"], report["failed"]), (2, 1))
+        self.assertEqual(report["errors"][0]["line"], 3)
+        self.assertIn("birthday_date", report["errors"][0]["detail"])
+        users = (await self.session.scalars(select(User).order_by(User.id))).all()
+        self.assertEqual([user.first_name for user in users], ["John", "Ann"])
+        self.assertEqual(users[0].birthday_key, birthday_key(users[0].birthday_date))
+
+    async def test_import_ndjson(self):
+        row = {"first_name": "John", "last_name": "Doe", "birthday_date": "1990-12-30",
+               "phone_numbers": "0501234567", "email": "john@example.com", "other_description": None}
+        content = "\n".join([json.dumps(row), "{broken", "", json.dumps([1, 2])])
+        report = await import_contacts(upload(content), "ndjson", None, self.session)
+        self.assertEqual((report["imported"], report["failed"]), (1, 2))
+        self.assertEqual([error["line"] for error in report["errors"]], [2, 4])
+
+
+class TestExportContacts(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+        self.session.add_all([User(first_name="John", last_name="Doe", birthday_date=date(1990, 12, 30),
+                                   phone_numbers="0501234567", email="john@example.com", other_description="a; b"),
+                              User(first_name="Jane", last_name="Doe", phone_numbers="0501234567",
+                                   email="jane@example.com")])
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def export(self, fmt):
+        chunks = [chunk async for chunk in export_contacts(stream_users(None, self.session, batch_size=1), fmt,
+                                                           batch_size=1)]
+        return b"".join(chunks).decode()
+
+    async def test_export_ndjson(self):
+        rows = [json.loads(line) for line in (await self.export("ndjson")).splitlines()]
+        self.assertEqual([row["first_name"] for row in rows], ["John", "Jane"])
+        self.assertEqual(rows[0]["birthday_date"], "1990-12-30")
+        self.assertIsNone(rows[1]["birthday_date"])
+
+    async def test_export_csv_round_trip(self):
+        content = await self.export("csv")
+        records = [record async for _, record in iter_csv_records(iter_lines(upload(content)))]
+        self.assertEqual([record["email"] for record in records], ["john@example.com", "jane@example.com"])
+        self.assertEqual(records[0]["other_description"], "a; b")
+
+    async def test_export_vcard(self):
+        content = await self.export("vcard")
+        self.assertEqual(content.count("BEGIN:VCARD\r\n"), 2)
+        self.assertIn("N:Doe;John;;;\r\n", content)
+        self.assertIn("BDAY:1990-12-30\r\n", content)
+        self.assertIn("NOTE:a\\; b\r\n", content)
+
+
+if __name__ == '__main__':
+    unittest.main()
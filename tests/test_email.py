@@ -0,0 +1,38 @@
+import unittest
+
+from benchmarks.fake_smtp import FakeSMTPServer
+from fast_api_app.services.email import MailSender, SMTPPool
+
+
+class TestMailSender(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = await FakeSMTPServer().start()
+        self.sender = MailSender(SMTPPool(self.server.host, self.server.port, size=2), "noreply@example.com")
+
+    async def asyncTearDown(self):
+        await self.sender.close()
+        await self.server.stop()
+
+    def message(self, i):
+        return self.sender.build(f"user{i}@example.com", "Confirm your email ", "email_template.html",
+                                 host="http://testserver/", username=f"user{i}", token="token")
+
+    async def test_send_many_reuses_connections(self):
+        results = await self.sender.send_many([self.message(i) for i in range(10)])
+        self.assertEqual(results, [None] * 10)
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertEqual(self.server.connections, 2)
+        await self.sender.send(self.message(10))
+        self.assertEqual(self.server.connections, 2)
+
+    async def test_rendered_template(self):
+        await self.sender.send(self.message(1))
+        received = self.server.messages[0]
+        self.assertEqual(received.rcpt_tos, ["user1@example.com"])
+        self.assertIn(b"Hi user1,", received.data)
+        self.assertIn(b"http://testserver/api/auth/confirmed_email/token", received.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
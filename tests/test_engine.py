@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, text
+
+from fast_api_app.database import connect_db
+from fast_api_app.database.connect_db import (TimedQueuePool, create_db_engine, database_error_status, engine_options,
+                                              pool_limits)
+from fast_api_app.services.metrics import registry
+
+
+class PostgresError(Exception):
+
+    def __init__(self, sqlstate: str):
+        super().__init__(f"sqlstate {sqlstate}")
+        self.sqlstate = sqlstate
+
+
+def test_pool_limits_share_max_connections(monkeypatch):
+    monkeypatch.setattr(connect_db.settings, "db_pool_size", 10)
+    monkeypatch.setattr(connect_db.settings, "db_max_overflow", 10)
+    assert pool_limits() == (10, 10)
+    monkeypatch.setattr(connect_db.settings, "db_max_connections", 48)
+    monkeypatch.setattr(connect_db.settings, "web_concurrency", 4)
+    assert pool_limits() == (10, 2)
+    monkeypatch.setattr(connect_db.settings, "web_concurrency", 100)
+    assert pool_limits() == (1, 0)
+
+
+def test_postgres_engine_options(monkeypatch):
+    monkeypatch.setattr(connect_db.settings, "db_statement_timeout", 2500)
+    options = engine_options("postgresql://user:secret@db/contacts")
+    assert options["poolclass"] is TimedQueuePool
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"]["server_settings"] == {"statement_timeout": "2500", "lock_timeout": "3000"}
+    assert options["connect_args"]["prepared_statement_cache_size"] == 100
+    assert engine_options("sqlite+aiosqlite://") == {}
+
+    engine = create_db_engine("postgresql://user:secret@db/contacts", "test-postgres")
+    try:
+        assert isinstance(engine.pool, TimedQueuePool)
+        assert engine.pool.size() == 5
+        assert engine.url.drivername == "postgresql+asyncpg"
+    finally:
+        asyncio.run(engine.dispose())
+        connect_db.engines.pop("test-postgres")
+
+
+def test_pool_timeout_is_counted_and_unavailable(monkeypatch, tmp_path):
+    monkeypatch.setattr(connect_db.settings, "db_pool_size", 1)
+    monkeypatch.setattr(connect_db.settings, "db_max_overflow", 0)
+    monkeypatch.setattr(connect_db.settings, "db_pool_timeout", 0.05)
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pool.db'}", "test-pool")
+
+    async def exhaust():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            with pytest.raises(exc.TimeoutError) as error:
+                async with engine.connect():
+                    pass
+            return error.value
+
+    try:
+        error = asyncio.run(exhaust())
+        assert database_error_status(error) == 503
+        metrics = registry.render()
+        assert 'db_pool_timeouts_total{engine="test-pool"} 1' in metrics
+        assert 'db_pool_checkouts_total{engine="test-pool"} 1' in metrics
+        assert 'db_pool_checked_out{engine="test-pool"} 0' in metrics
+    finally:
+        asyncio.run(engine.dispose())
+        connect_db.engines.pop("test-pool")
+
+
+def test_database_error_status():
+    def error(orig, cls=exc.DBAPIError):
+        return cls("SELECT 1", {}, orig)
+
+    assert database_error_status(error(PostgresError("57014"))) == 504
+    assert database_error_status(error(PostgresError("55P03"))) == 503
+    assert database_error_status(error(PostgresError("08006"))) == 503
+    assert database_error_status(error(Exception("database is locked"), exc.OperationalError)) == 503
+    assert database_error_status(error(PostgresError("23505"), exc.IntegrityError)) is None
+    assert database_error_status(ValueError()) is None
+
+
+@pytest.fixture(scope="module")
+def headers(auth_headers):
+    return auth_headers('timeout@example.com')
+
+
+def test_statement_timeout_maps_to_504(client, headers, monkeypatch):
+    async def slow_search(*args, **kwargs):
+        raise exc.DBAPIError("SELECT ...", {}, PostgresError("57014"))
+
+    monkeypatch.setattr("fast_api_app.routes.users.repository_users.search_users", slow_search)
+    response = client.get("/api/users/search", params={"first_name": "x"}, headers=headers)
+    assert response.status_code == 504, response.text
+    assert response.headers["retry-after"] == "1"
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from fast_api_app.services import metrics
+from fast_api_app.services.metrics import Histogram, RequestTimings, instrument_engine, timed
+
+
+def test_histogram_render():
+    histogram = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+    histogram.observe((('route', '/a'),), 0.05)
+    histogram.observe((('route', '/a'),), 0.5)
+    histogram.observe((('route', '/a'),), 5)
+    lines = list(histogram.render())
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+
+
+def test_timed_outside_request_is_ignored():
+    with timed('db'):
+        pass
+    assert metrics.current_timings() is None
+
+
+async def run_in_request(*statements, request='GET /test'):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    instrument_engine(engine)
+    timings = RequestTimings(request)
+    token = metrics._current.set(timings)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY)"))
+            await conn.execute(text("INSERT INTO t (id) VALUES (1), (2), (3)"))
+            for statement, params in statements:
+                await conn.execute(text(statement), params)
+    finally:
+        metrics._current.reset(token)
+        await engine.dispose()
+    return timings
+
+
+def test_engine_statements_are_accounted():
+    timings = asyncio.run(run_in_request(("SELECT id FROM t", {}), ("UPDATE t SET id = id + 10 WHERE id < 3", {})))
+    assert timings.phases['db'] > 0
+    assert timings.queries == 4
+    assert timings.rows == 3 + 3 + 2
+
+
+def test_slow_queries_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(metrics.settings, "slow_query_threshold", 0)
+    asyncio.run(run_in_request(("SELECT id FROM t WHERE id = :id", {"id": 2}), request='GET /slow'))
+    assert any("GET /slow" in record.message and "parameters=(2,)" in record.message for record in caplog.records)
+
+
+def test_repeated_statements_are_flagged():
+    timings = asyncio.run(run_in_request(*[("SELECT id FROM t WHERE id = :id", {"id": i}) for i in range(12)]))
+    assert timings.repeated_statements(10) == [("SELECT id FROM t WHERE id = ?", 12)]
+    assert timings.repeated_statements(12) == []
+
+
+def test_row_count_without_buffered_rows():
+    assert metrics._row_count(SimpleNamespace(description=[("id",)], _rows=[(1,), (2,)], rowcount=-1)) == 2
+    assert metrics._row_count(SimpleNamespace(description=[("id",)], rowcount=5)) == 5
+    assert metrics._row_count(SimpleNamespace(description=[("id",)], rowcount=-1)) == 0
+
+
+def test_server_timing_and_metrics_endpoint(client, auth_headers):
+    headers = auth_headers('metrics@example.com')
+    response = client.post("/api/auth/login", data={"username": 'metrics@example.com', "password": '123456789'})
+    assert response.status_code == 200, response.text
+    phases = {part.split(';')[0] for part in response.headers["server-timing"].split(', ')}
+    assert {'hash', 'jwt', 'serialize', 'total'} <= phases
+
+    response = client.get("/api/users/search", headers=headers)
+    assert "jwt;dur=" in response.headers["server-timing"]
+
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/auth/login",status="200"} ' in body
+    assert 'http_request_phase_seconds_count{route="/api/auth/login",phase="hash"} ' in body
+    assert 'cache_hits_total{cache="token"}' in body
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+from redis.exceptions import ConnectionError
+
+from benchmarks.fake_smtp import FakeSMTPServer
+from fast_api_app.services.email import MailSender, SMTPPool
+from fast_api_app.services.outbox import EmailOutbox
+from fast_api_app.worker import OutboxWorker
+
+
+class TestEmailOutbox(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.outbox = EmailOutbox(self.redis)
+        for i in range(3):
+            await self.outbox.retry_later({"email": f"user{i}@example.com", "attempts": 1}, -1)
+
+    async def test_promote_due_moves_each_entry_once(self):
+        moved = await asyncio.gather(*(self.outbox.promote_due() for _ in range(3)))
+        self.assertEqual(sum(moved), 3)
+        self.assertEqual(await self.redis.xlen(EmailOutbox.STREAM), 3)
+        self.assertEqual(await self.redis.zcard(EmailOutbox.RETRY), 0)
+
+    async def test_promote_due_keeps_entries_when_the_move_fails(self):
+        with patch("redis.asyncio.client.Pipeline.execute", side_effect=ConnectionError("redis is gone")):
+            with self.assertRaises(ConnectionError):
+                await self.outbox.promote_due()
+        self.assertEqual(await self.redis.zcard(EmailOutbox.RETRY), 3)
+        self.assertEqual(await self.redis.xlen(EmailOutbox.STREAM), 0)
+
+
+class TestOutboxWorker(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.outbox = EmailOutbox(self.redis)
+        self.server = await FakeSMTPServer().start()
+        self.sender = MailSender(SMTPPool(self.server.host, self.server.port, size=2), "noreply@example.com")
+        self.worker = OutboxWorker(self.outbox, self.sender, "test", concurrency=4)
+        await self.worker.setup()
+
+    async def asyncTearDown(self):
+        await self.sender.close()
+        await self.server.stop()
+
+    async def test_delivers_and_acknowledges(self):
+        for i in range(3):
+            await self.outbox.enqueue(f"user{i}@example.com", f"user{i}", "http://testserver/")
+        self.assertEqual(await self.worker.poll(block=10), 3)
+        await self.worker.drain()
+        self.assertEqual(sorted(m.rcpt_tos[0] for m in self.server.messages),
+                         ["user0@example.com", "user1@example.com", "user2@example.com"])
+        self.assertEqual(await self.redis.xlen(EmailOutbox.STREAM), 0)
+        self.assertEqual((await self.redis.xpending(EmailOutbox.STREAM, EmailOutbox.GROUP))["pending"], 0)
+
+    async def test_failure_is_retried_then_dead_lettered(self):
+        await self.server.stop()
+        await self.outbox.enqueue("user@example.com", "user", "http://testserver/")
+        with patch("fast_api_app.worker.settings.outbox_max_attempts", 2), \
+                patch("fast_api_app.services.outbox.time.time", return_value=1000.0):
+            await self.worker.poll(block=10)
+            await self.worker.drain()
+            retries = await self.redis.zrange(EmailOutbox.RETRY, 0, -1, withscores=True)
+            self.assertEqual(len(retries), 1)
+            self.assertEqual(json.loads(retries[0][0])["attempts"], 1)
+            self.assertEqual(retries[0][1], 1005.0)
+        with patch("fast_api_app.worker.settings.outbox_max_attempts", 2):
+            await self.worker.poll(block=10)
+            await self.worker.drain()
+        self.assertEqual(await self.redis.zcard(EmailOutbox.RETRY), 0)
+        dead = await self.redis.xrange(EmailOutbox.DEAD)
+        self.assertEqual(dead[0][1]["email"], "user@example.com")
+        self.assertEqual(dead[0][1]["attempts"], "2")
+
+
+    async def test_poll_waits_while_every_slot_is_busy(self):
+        worker = OutboxWorker(self.outbox, self.sender, "busy", concurrency=1)
+        finished = asyncio.Event()
+
+        async def slow_send(message):
+            await asyncio.sleep(0.2)
+            finished.set()
+
+        for i in range(2):
+            await self.outbox.enqueue(f"user{i}@example.com", f"user{i}", "http://testserver/")
+        with patch.object(self.sender, "send", slow_send), \
+                patch.object(self.outbox, "promote_due", wraps=self.outbox.promote_due) as promote_due:
+            self.assertEqual(await worker.poll(block=10), 1)
+            self.assertEqual(await worker.poll(block=10), 1)
+            self.assertTrue(finished.is_set())
+            self.assertEqual(promote_due.await_count, 2)
+            await worker.drain()
+        self.assertEqual(await self.redis.xlen(EmailOutbox.STREAM), 0)
+
+    async def test_unexpected_error_is_dead_lettered(self):
+        await self.redis.xadd(EmailOutbox.STREAM, {"username": "user", "host": "http://testserver/", "attempts": 0})
+        await self.worker.poll(block=10)
+        await self.worker.drain()
+        dead = await self.redis.xrange(EmailOutbox.DEAD)
+        self.assertEqual(dead[0][1]["attempts"], "1")
+        self.assertIn("KeyError", dead[0][1]["error"])
+        self.assertEqual((await self.redis.xpending(EmailOutbox.STREAM, EmailOutbox.GROUP))["pending"], 0)
+
+    async def test_retry_that_cannot_be_scheduled_is_dead_lettered(self):
+        await self.server.stop()
+        await self.outbox.enqueue("user@example.com", "user", "http://testserver/")
+        with patch.object(self.outbox, "retry_later", side_effect=ConnectionError("redis is gone")):
+            await self.worker.poll(block=10)
+            await self.worker.drain()
+        dead = await self.redis.xrange(EmailOutbox.DEAD)
+        self.assertEqual(dead[0][1]["attempts"], "1")
+        self.assertEqual((await self.redis.xpending(EmailOutbox.STREAM, EmailOutbox.GROUP))["pending"], 0)
+
+
+    async def test_run_survives_redis_errors(self):
+        stop = asyncio.Event()
+        calls = []
+
+        async def poll():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConnectionError("redis is gone")
+            stop.set()
+
+        self.worker.RETRY_DELAY = 0.01
+        with patch.object(self.worker, "poll", side_effect=poll), \
+                patch.object(self.worker, "setup", wraps=self.worker.setup) as setup:
+            await asyncio.wait_for(self.worker.run(stop), 1)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(setup.await_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
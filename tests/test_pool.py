@@ -0,0 +1,35 @@
+import asyncio
+import time
+import unittest
+
+from fastapi import HTTPException
+
+from fast_api_app.services.pool import BoundedPool
+
+
+def square(value):
+    return value * value
+
+
+class TestBoundedPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_runs_in_process_pool(self):
+        pool = BoundedPool("test", max_workers=1, max_concurrency=2, queue_timeout=5)
+        try:
+            self.assertEqual(await asyncio.gather(pool.run(square, 3), pool.run(square, 4)), [9, 16])
+        finally:
+            pool.shutdown()
+
+    async def test_queue_timeout_is_503(self):
+        pool = BoundedPool("test", max_workers=0, max_concurrency=1, queue_timeout=0.05)
+        busy = asyncio.create_task(pool.run(time.sleep, 0.3))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(HTTPException) as ctx:
+            await pool.run(square, 2)
+        self.assertEqual(ctx.exception.status_code, 503)
+        await busy
+        self.assertEqual(await pool.run(square, 2), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
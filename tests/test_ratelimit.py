@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import fakeredis
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from fast_api_app.services.ratelimit import HybridRateLimiter, RateLimit, TokenBucket, parse_rate
+
+
+def route_request(method: str, path_format: str) -> MagicMock:
+    return MagicMock(method=method, scope={"route": MagicMock(path_format=path_format)})
+
+
+class TestHybridRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    async def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/60"), (10, 60))
+
+    async def test_workers_share_the_limit(self):
+        workers = [HybridRateLimiter("read", 100, 60, batch=10, client=self.redis) for _ in range(3)]
+        allowed = 0
+        for i in range(150):
+            if await workers[i % 3].hit("1") == 0:
+                allowed += 1
+        self.assertLessEqual(allowed, 100)
+        self.assertGreaterEqual(allowed, 80)
+
+    async def test_leases_save_round_trips(self):
+        limiter = HybridRateLimiter("read", 100, 60, batch=10, client=self.redis)
+        for _ in range(10):
+            self.assertEqual(await limiter.hit("1"), 0)
+        keys = await self.redis.keys("ratelimit:read:1:*")
+        self.assertEqual(await self.redis.get(keys[0]), "10")
+
+    async def test_small_limits_count_every_hit(self):
+        limiter = HybridRateLimiter("write", 10, 60, client=self.redis)
+        self.assertEqual(limiter.batch, 1)
+        for _ in range(12):
+            await limiter.hit("1")
+        keys = await self.redis.keys("ratelimit:write:1:*")
+        self.assertEqual(await self.redis.get(keys[0]), "11")
+
+    async def test_keys_are_independent(self):
+        limiter = HybridRateLimiter("bulk", 2, 60, client=self.redis)
+        self.assertEqual(await limiter.hit("1"), 0)
+        self.assertEqual(await limiter.hit("1"), 0)
+        self.assertGreater(await limiter.hit("1"), 0)
+        self.assertEqual(await limiter.hit("2"), 0)
+
+    async def test_exhausted_window_is_remembered(self):
+        limiter = HybridRateLimiter("bulk", 1, 60, client=self.redis)
+        await limiter.hit("1")
+        await limiter.hit("1")
+        await self.redis.flushall()
+        self.assertGreater(await limiter.hit("1"), 0)
+
+    async def test_falls_back_to_local_bucket(self):
+        client = MagicMock()
+        client.pipeline.side_effect = ConnectionError()
+        limiter = HybridRateLimiter("bulk", 2, 60, client=client)
+        self.assertEqual(await limiter.hit("1"), 0)
+        self.assertEqual(await limiter.hit("1"), 0)
+        self.assertGreater(await limiter.hit("1"), 0)
+
+    async def test_dependency_raises_429(self):
+        dependency = RateLimit("bulk")
+        dependency.limiter = MagicMock(hit=AsyncMock(return_value=12.3))
+        with self.assertRaises(HTTPException) as err:
+            await dependency(route_request("GET", "/api/users/"), MagicMock(id=1))
+        self.assertEqual(err.exception.status_code, 429)
+        self.assertEqual(err.exception.headers["Retry-After"], "13")
+        dependency.limiter.hit.assert_awaited_once_with("1:GET:/api/users/")
+
+    async def test_routes_have_their_own_budget(self):
+        dependency = RateLimit("bulk")
+        dependency.limiter = HybridRateLimiter("bulk", 1, 60, client=self.redis)
+        user = MagicMock(id=1)
+        await dependency(route_request("GET", "/api/users/{user_id}"), user)
+        await dependency(route_request("DELETE", "/api/users/{user_id}"), user)
+        await dependency(route_request("GET", "/api/users/search"), user)
+        with self.assertRaises(HTTPException) as err:
+            await dependency(route_request("GET", "/api/users/{user_id}"), user)
+        self.assertEqual(err.exception.status_code, 429)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_take(self):
+        bucket = TokenBucket(1, 2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
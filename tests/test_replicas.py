@@ -0,0 +1,76 @@
+import shutil
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from main import app
+from fast_api_app.database.models import User, UserAuth, birthday_key
+from fast_api_app.database.replicas import ReadRouter, get_read_router
+from fast_api_app.services.cache import user_cache
+
+
+def test_round_robin_and_read_your_writes_window():
+    router = ReadRouter(["first", "second"], window=60)
+    assert [router.reader("a@example.com") for _ in range(3)] == ["first", "second", "first"]
+    router.wrote("A@example.com")
+    assert router.reader("a@example.com") is None
+    assert router.reader("b@example.com") == "second"
+    assert router.reader() == "first"
+
+
+def test_without_replicas_reads_go_to_primary():
+    router = ReadRouter([], window=60)
+    router.wrote("a@example.com")
+    assert router.reader() is None
+    assert len(router.recent_writes) == 0
+
+
+@pytest.fixture(scope="module")
+def router(session, auth_headers, tmp_path_factory):
+    auth_headers("replica@example.com", avatar="fresh")
+    session.add(User(first_name="Ann", last_name="Lee", email="ann@example.com", phone_numbers="0000000000",
+                     birthday_date=date(1990, 1, 1), birthday_key=birthday_key(date(1990, 1, 1)),
+                     other_description="primary"))
+    session.commit()
+    # The replica starts as a copy of the primary, then drifts so reads show which database answered
+    path = tmp_path_factory.mktemp("replica") / "replica.db"
+    shutil.copy("test.db", path)
+    replica_sync = create_engine(f"sqlite:///{path}")
+    with replica_sync.begin() as conn:
+        conn.execute(update(User).values(other_description="replica"))
+        conn.execute(update(UserAuth).values(avatar="stale"))
+    replica_sync.dispose()
+
+    replica = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    router = ReadRouter([async_sessionmaker(replica, expire_on_commit=False)], window=0.5)
+    app.dependency_overrides[get_read_router] = lambda: router
+    yield router
+    del app.dependency_overrides[get_read_router]
+
+
+def test_reads_go_to_replica_until_own_write(client, router, auth_headers):
+    headers = auth_headers("replica@example.com")
+
+    def description():
+        response = client.get("/api/users/search", params={"first_name": "ann"}, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()[0]["other_description"]
+
+    assert description() == "replica"
+    response = client.patch("/api/users/1", json={"last_name": "Leigh"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert description() == "primary"
+    time.sleep(0.6)
+    assert description() == "replica"
+
+
+def test_user_cache_miss_reads_primary(client, router, auth_headers):
+    headers = auth_headers("replica@example.com")
+    user_cache.local.clear()
+    response = client.get("/api/users/me/", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"] == "fresh"
@@ -1,21 +1,22 @@
 import unittest
 from unittest.mock import MagicMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from datetime import date
-from fast_api_app.database.models import User, UserAuth
-from fast_api_app.schemas import UserSchema, UserModel
+from fast_api_app.database.models import Base, User, UserAuth, birthday_key
+from fast_api_app.schemas import UserSchema, UserModel, UserUpdate
 from fast_api_app.repository.users import (
     get_user_by_email,
     create_user,
     update_avatar,
-    update_token,
     get_users,
     get_user,
     get_birthday,
     search_users,
     create_users,
     update_user,
+    patch_user,
     remove_user,
     confirmed_email,
 )
@@ -24,123 +25,267 @@ from fast_api_app.repository.users import (
 class TestUsers(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
         self.user = User(id=1)
 
     async def test_get_user_by_email(self):
         user_auth = UserAuth(email="test@example.com")
-        self.session.query().filter().first.return_value = user_auth
+        self.session.scalar.return_value = user_auth
         result = await get_user_by_email(email="test@example.com", db=self.session)
         self.assertEqual(result, user_auth)
 
     async def test_get_user_by_email_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user_by_email(email="nonexistent@example.com", db=self.session)
         self.assertIsNone(result)
 
     async def test_create_user(self):
         user_data = UserModel(email="new@example.com")
-        new_user = UserAuth(**user_data.dict(), avatar=None)
-        self.session.add.return_value = None
-        self.session.commit.return_value = None
-        self.session.refresh.return_value = None
+        new_user = UserAuth(**user_data.model_dump(), avatar=None)
+        self.session.scalar.return_value = new_user
         result = await create_user(body=user_data, db=self.session)
         self.assertEqual(result, new_user)
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_not_called()
 
     async def test_update_avatar(self):
-        user_auth = UserAuth(email="test@example.com", avatar="old_url")
-        self.session.query().filter().first.return_value = user_auth
-        new_url = "new_url"
-        result = await update_avatar(email="test@example.com", url=new_url, db=self.session)
+        user_auth = UserAuth(email="test@example.com", avatar="new_url")
+        self.session.scalar.return_value = user_auth
+        result = await update_avatar(email="test@example.com", url="new_url", db=self.session)
         self.assertEqual(result, user_auth)
-        self.assertEqual(result.avatar, new_url)
-
-    async def test_update_token(self):
-        user_auth = UserAuth(email="test@example.com")
-        new_token = "new_token"
-        result = await update_token(user=user_auth, token=new_token, db=self.session)
-        self.assertIsNone(result.refresh_token)
-        self.assertEqual(user_auth.refresh_token, new_token)
+        self.assertEqual(self.session.scalar.await_count, 1)
+        self.session.commit.assert_awaited_once()
 
     async def test_get_users(self):
-        users = [User(), User(), User()]
-        self.session.query().filter().offset().limit().all.return_value = users
-        result = await get_users(skip=0, limit=10, user=self.user, db=self.session)
+        users = [User(id=1), User(id=2), User(id=3)]
+        result = MagicMock()
+        result.all.return_value = users
+        self.session.execute.return_value = result
+        result, next_cursor = await get_users(limit=10, cursor=None, user=self.user, db=self.session)
         self.assertEqual(result, users)
+        self.assertIsNone(next_cursor)
+
+    async def test_get_users_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await get_users(limit=10, cursor="not-a-cursor", user=self.user, db=self.session)
 
     async def test_get_user_found(self):
         user = User()
-        self.session.query().filter().first.return_value = user
+        self.session.scalar.return_value = user
         result = await get_user(user_id=1, user=self.user, db=self.session)
         self.assertEqual(result, user)
 
     async def test_get_user_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user(user_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_create_user(self):
         body = UserSchema(first_name="test", last_name="test", birthday_date="2000-01-01", phone_numbers="0000000000",
                           email="test@mail.com", other_description="test")
+        self.session.scalar.return_value = User(id=1, **body.model_dump())
         result = await create_users(body=body, user=self.user, db=self.session)
-        self.assertEqual(result.first_name, body.first_name)
-        self.assertEqual(result.last_name, body.last_name)
-        self.assertEqual(result.birthday_date, body.birthday_date)
-        self.assertEqual(result.phone_numbers, body.phone_numbers)
-        self.assertEqual(result.email, body.email)
-        self.assertEqual(result.other_description, body.other_description)
+        self.assertEqual(result, self.session.scalar.return_value)
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_not_called()
 
     async def test_get_birthday(self):
-        users = [User(birthday_date="2023-10-26")]
+        users = [User(birthday_date=date(2000, 10, 26))]
         today = date(2023, 10, 26)
         end_date = date(2023, 10, 27)
-        self.session.query().all.return_value = users
+        result = MagicMock()
+        result.all.return_value = users
+        self.session.execute.return_value = result
         result = await get_birthday(today, end_date, user=self.user, db=self.session)
         self.assertEqual(result, users)
 
     async def test_search_users(self):
-        users = [User(first_name="John"), User(last_name="Doe"), User(email="johndoe@example.com")]
-        self.session.query().all.return_value = users
+        users = [User(first_name="John")]
+        result = MagicMock()
+        result.all.return_value = users
+        self.session.execute.return_value = result
         result = await search_users(first_name="John", last_name=None, email=None, user=self.user, db=self.session)
         self.assertEqual(result, users)
 
+    async def test_search_users_without_criteria(self):
+        result = await search_users(first_name=None, last_name=None, email=None, user=self.user, db=self.session)
+        self.assertEqual(result, [])
+        self.session.execute.assert_not_called()
+
     async def test_remove_user_found(self):
         user = User()
-        self.session.query().filter().first.return_value = user
+        self.session.scalar.return_value = user
         result = await remove_user(user_id=1, user=self.user, db=self.session)
         self.assertEqual(result, user)
 
     async def test_remove_user_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await remove_user(user_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_update_user_found(self):
         body = UserSchema(first_name="test", last_name="test", birthday_date="2000-01-01", phone_numbers="0000000000",
                           email="test@mail.com", other_description="test")
+        self.session.scalar.return_value = User(id=1, **body.model_dump())
         result = await update_user(user_id=1, body=body, user=self.user, db=self.session)
-        self.assertEqual(result.first_name, body.first_name)
-        self.assertEqual(result.last_name, body.last_name)
-        self.assertEqual(result.birthday_date, body.birthday_date)
-        self.assertEqual(result.phone_numbers, body.phone_numbers)
-        self.assertEqual(result.email, body.email)
-        self.assertEqual(result.other_description, body.other_description)
+        self.assertEqual(result, self.session.scalar.return_value)
+        self.assertEqual(self.session.scalar.await_count, 1)
+        self.session.commit.assert_awaited_once()
 
     async def test_update_user_not_found(self):
         body = UserSchema(first_name="test", last_name="test", birthday_date="2000-01-01", phone_numbers="0000000000",
                           email="test@mail.com", other_description="test")
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         self.session.commit.return_value = None
         result = await update_user(user_id=1, body=body, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_confirmed_email(self):
-        user_auth = UserAuth(email="test@example.com", confirmed=False)
-        self.session.query().filter().first.return_value = user_auth
         self.session.commit.return_value = None
         result = await confirmed_email(email="test@example.com", db=self.session)
-        self.assertTrue(user_auth.confirmed)
         self.assertIsNone(result)
+        self.session.execute.assert_awaited_once()
+        self.session.scalar.assert_not_called()
+
+
+class TestUsersSql(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+        contacts = [("John", "Doe", "john@example.com", date(1990, 12, 30)),
+                    ("Jane", "Doe", "jane@example.com", date(1985, 1, 2)),
+                    ("Johnny", "Smith", "johnny@example.com", date(1992, 2, 29)),
+                    ("Ann", "Johnson", "ann_j@example.com", date(1980, 3, 1)),
+                    ("Bob", "Brown", "bob@example.com", date(1975, 6, 15))]
+        for first_name, last_name, email, day in contacts:
+            self.session.add(User(first_name=first_name, last_name=last_name, email=email, phone_numbers="0000000000",
+                                  birthday_date=day, birthday_key=birthday_key(day)))
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def birthdays(self, today, end_date):
+        users = await get_birthday(today, end_date, user=None, db=self.session)
+        return [user.birthday_date for user in users]
+
+    async def test_window_wraps_year(self):
+        result = await self.birthdays(date(2023, 12, 28), date(2024, 1, 4))
+        self.assertEqual(result, [date(1990, 12, 30), date(1985, 1, 2)])
+
+    async def test_feb_29_in_common_year(self):
+        result = await self.birthdays(date(2023, 2, 25), date(2023, 2, 28))
+        self.assertEqual(result, [date(1992, 2, 29)])
+
+    async def test_feb_29_in_leap_year(self):
+        self.assertEqual(await self.birthdays(date(2024, 2, 25), date(2024, 2, 28)), [])
+        self.assertEqual(await self.birthdays(date(2024, 2, 29), date(2024, 3, 1)),
+                         [date(1992, 2, 29), date(1980, 3, 1)])
+
+    async def test_whole_year(self):
+        result = await self.birthdays(date(2023, 6, 15), date(2024, 6, 15))
+        self.assertEqual(len(result), 5)
+        self.assertEqual(result[0], date(1975, 6, 15))
+
+    async def search(self, **kwargs):
+        criteria = {"first_name": None, "last_name": None, "email": None, **kwargs}
+        users = await search_users(user=None, db=self.session, **criteria)
+        return [user.first_name for user in users]
+
+    async def test_search_returns_each_user_once(self):
+        result = await self.search(first_name="john", last_name="DOE", email="john@example.com")
+        self.assertEqual(result, ["John", "Jane"])
+
+    async def test_search_match_all(self):
+        self.assertEqual(await self.search(first_name="John", last_name="Doe", match_all=True), ["John"])
+        self.assertEqual(await self.search(first_name="Jane", last_name="Smith", match_all=True), [])
+
+    async def test_search_prefix(self):
+        self.assertEqual(await self.search(first_name="jo", prefix=True), ["John", "Johnny"])
+        self.assertEqual(await self.search(email="ann_", prefix=True), ["Ann"])
+        self.assertEqual(await self.search(email="ann%", prefix=True), [])
+
+    async def test_search_limit_and_cursor(self):
+        first_page = await search_users(None, "doe", None, user=None, db=self.session, limit=1)
+        second_page = await search_users(None, "doe", None, user=None, db=self.session, limit=1,
+                                         cursor=first_page[-1].id)
+        self.assertEqual([user.first_name for user in first_page + second_page], ["John", "Jane"])
+
+    async def test_get_users_pages(self):
+        for order_by, expected in (("id", ["John", "Jane", "Johnny", "Ann", "Bob"]),
+                                   ("last_name", ["Bob", "John", "Jane", "Ann", "Johnny"])):
+            names, cursor = [], None
+            while True:
+                users, cursor = await get_users(limit=2, cursor=cursor, user=None, db=self.session, order_by=order_by)
+                names += [user.first_name for user in users]
+                if cursor is None:
+                    break
+            self.assertEqual(names, expected)
+
+    async def test_get_users_cursor_of_other_order(self):
+        _, cursor = await get_users(limit=1, cursor=None, user=None, db=self.session, order_by="id")
+        with self.assertRaises(ValueError):
+            await get_users(limit=1, cursor=cursor, user=None, db=self.session, order_by="last_name")
+
+
+    def count_statements(self):
+        statements = []
+        event.listen(self.engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        return statements
+
+    async def test_writes_are_one_statement(self):
+        statements = self.count_statements()
+        body = UserSchema(first_name="Eve", last_name="Stone", birthday_date="2001-05-04", phone_numbers="0000000000",
+                          email="eve@example.com", other_description=None)
+        created = await create_users(body=body, user=None, db=self.session)
+        self.assertEqual((created.id, created.first_name), (6, "Eve"))
+        self.assertEqual(created.birthday_key, birthday_key(date(2001, 5, 4)))
+
+        updated = await update_user(created.id, body.model_copy(update={"first_name": "Eva"}), user=None,
+                                    db=self.session)
+        self.assertEqual((updated.first_name, updated.email), ("Eva", "eve@example.com"))
+
+        removed = await remove_user(created.id, user=None, db=self.session)
+        self.assertEqual(removed.first_name, "Eva")
+        self.assertIsNone(await remove_user(created.id, user=None, db=self.session))
+        self.assertEqual([statement.split()[0] for statement in statements], ["INSERT", "UPDATE", "DELETE", "DELETE"])
+
+    async def test_patch_user_writes_sent_fields(self):
+        statements = self.count_statements()
+        user = await patch_user(1, UserUpdate(birthday_date=date(1990, 1, 1)), user=None, db=self.session)
+        self.assertEqual((user.first_name, user.birthday_date), ("John", date(1990, 1, 1)))
+        self.assertEqual(user.birthday_key, birthday_key(date(1990, 1, 1)))
+        self.assertEqual(len(statements), 1)
+        self.assertIn("SET birthday_date=?, birthday_key=? WHERE", statements[0])
+        self.assertIsNone(await patch_user(99, UserUpdate(first_name="Nobody"), user=None, db=self.session))
+
+    async def test_patch_user_without_fields(self):
+        user = await patch_user(2, UserUpdate(), user=None, db=self.session)
+        self.assertEqual(user.first_name, "Jane")
+
+    async def test_confirmed_email_single_update(self):
+        self.session.add(UserAuth(username="new", email="new@example.com", password="secret"))
+        await self.session.commit()
+        statements = self.count_statements()
+        await confirmed_email("new@example.com", db=self.session)
+        self.assertEqual([statement.split()[0] for statement in statements], ["UPDATE"])
+        self.assertTrue(await self.session.scalar(select(UserAuth.confirmed)))
+
+
+    async def test_create_user_conflict_ignores_case(self):
+        created = await create_user(UserModel(username="newbie", email="New@Example.com", password="secret"),
+                                    db=self.session)
+        self.assertEqual(created.email, "New@Example.com")
+        statements = self.count_statements()
+        self.assertIsNone(await create_user(UserModel(username="other", email="new@example.COM", password="secret"),
+                                            db=self.session))
+        self.assertIn("ON CONFLICT DO NOTHING", statements[0])
+        self.assertEqual((await get_user_by_email("NEW@example.com", db=self.session)).id, created.id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import fakeredis
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from fast_api_app.services.sessions import SessionStore
+
+
+class TestSessionStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.store = SessionStore(self.redis, ttl=60, local_ttl=60)
+
+    async def test_rotation_keeps_family_open(self):
+        fid, jti = await self.store.start("deadpool@example.com")
+        self.assertEqual(await self.redis.get(f"session:family:{fid}"), "deadpool@example.com")
+        self.assertLessEqual(await self.redis.ttl(f"session:token:{jti}"), 60)
+        new_jti = await self.store.rotate(fid, jti)
+        self.assertNotIn(new_jti, (None, jti))
+        self.assertIsNotNone(await self.store.rotate(fid, new_jti))
+        self.assertTrue(await self.store.is_active(fid))
+
+    async def test_reuse_revokes_family(self):
+        fid, jti = await self.store.start("deadpool@example.com")
+        new_jti = await self.store.rotate(fid, jti)
+        self.assertTrue(await self.store.is_active(fid))
+        self.assertIsNone(await self.store.rotate(fid, jti))
+        self.assertFalse(await self.store.is_active(fid))
+        self.assertIsNone(await self.store.rotate(fid, new_jti))
+
+    async def test_concurrent_reuse_revokes_family(self):
+        fid, jti = await self.store.start("deadpool@example.com")
+        results = await asyncio.gather(self.store.rotate(fid, jti), self.store.rotate(fid, jti))
+        self.assertEqual(sum(result is None for result in results), 1)
+        self.assertFalse(await self.store.is_active(fid))
+        winner = next(result for result in results if result is not None)
+        self.assertIsNone(await self.store.rotate(fid, winner))
+
+    async def test_families_are_independent(self):
+        first, first_jti = await self.store.start("deadpool@example.com")
+        second, _ = await self.store.start("deadpool@example.com")
+        await self.store.revoke(first)
+        self.assertIsNone(await self.store.rotate(first, first_jti))
+        self.assertTrue(await self.store.is_active(second))
+
+    async def test_unknown_token(self):
+        fid, _ = await self.store.start("deadpool@example.com")
+        self.assertIsNone(await self.store.rotate(fid, "unknown"))
+        self.assertTrue(await self.store.is_active(fid))
+
+    async def test_redis_down(self):
+        self.redis.exists = AsyncMock(side_effect=ConnectionError)
+        self.assertTrue(await self.store.is_active("family"))
+        self.redis.pipeline = MagicMock(side_effect=ConnectionError)
+        with self.assertRaises(HTTPException) as error:
+            await self.store.start("deadpool@example.com")
+        self.assertEqual(error.exception.status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Only what importing the app costs on top of the framework it is built on
+IMPORT_SCRIPT = """
+import json, sys, time
+import fastapi, pydantic, sqlalchemy.ext.asyncio
+start = time.perf_counter()
+import main
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+LAZY_MODULES = ('cloudinary', 'PIL', 'passlib', 'jinja2', 'aiosmtplib', 'fakeredis', 'httpx',
+                'fast_api_app.services.email')
+
+
+def import_app(tmp_path):
+    env = {**os.environ, "SQLALCHEMY_DATABASE_URL": f"sqlite:///{tmp_path / 'missing' / 'app.db'}",
+           "ALGORITHM": "HS256"}
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, env=env, capture_output=True,
+                            text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def test_import_is_side_effect_free_and_within_budget(tmp_path):
+    result = import_app(tmp_path)
+    assert not (tmp_path / 'missing').exists()
+    loaded = [name for name in LAZY_MODULES if name in result["modules"]]
+    assert loaded == []
+    assert result["seconds"] < float(os.environ.get("IMPORT_TIME_BUDGET", "1.0"))
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+from fast_api_app.database.models import User, birthday_key
+
+
+@pytest.fixture(scope="module")
+def headers(session, auth_headers):
+    today = date.today()
+    for i, (first_name, last_name) in enumerate([("John", "Doe"), ("Jane", "Doe"), ("Bob", "Brown")]):
+        day = today.replace(year=1990) if (today.month, today.day) != (2, 29) else date(1990, 3, 1)
+        session.add(User(first_name=first_name, last_name=last_name, email=f"{first_name.lower()}@example.com",
+                         phone_numbers="0000000000", birthday_date=day, birthday_key=birthday_key(day),
+                         other_description=None if i else "friend"))
+    session.commit()
+    return auth_headers('reader@example.com')
+
+
+def test_read_users_page(client, headers):
+    response = client.get("/api/users/", params={"limit": 2}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [user["first_name"] for user in data["items"]] == ["John", "Jane"]
+    assert set(data["items"][0]) == {"id", "first_name", "last_name", "birthday_date", "phone_numbers", "email",
+                                     "other_description"}
+    assert data["items"][0]["other_description"] == "friend"
+    assert data["next_cursor"] is not None
+    assert data["estimated_total"] is None
+
+    response = client.get("/api/users/", params={"limit": 2, "cursor": data["next_cursor"]}, headers=headers)
+    assert [user["first_name"] for user in response.json()["items"]] == ["Bob"]
+
+
+def test_search_returns_rows(client, headers):
+    response = client.get("/api/users/search", params={"last_name": "DOE"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [user["email"] for user in response.json()] == ["john@example.com", "jane@example.com"]
+
+
+def test_birthdays_returns_iso_dates(client, headers):
+    response = client.get("/api/users/birthdays", params={"days": 1}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert len(data) == 3
+    assert date.fromisoformat(data[0]["birthday_date"]).year == 1990
+
+
+def test_patch_user_changes_sent_fields(client, headers):
+    response = client.patch("/api/users/3", json={"other_description": "neighbour"}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["first_name"], data["other_description"]) == ("Bob", "neighbour")
+
+    response = client.patch("/api/users/3", json={"first_name": None}, headers=headers)
+    assert response.status_code == 422
+    response = client.patch("/api/users/99", json={"first_name": "Nobody"}, headers=headers)
+    assert response.status_code == 404